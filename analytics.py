@@ -0,0 +1,199 @@
+'''
+Crossword Game Stats analytics across many games.
+
+The moves of a user's games are held in a columnar MoveTable of NumPy
+arrays so that statistics over the whole history are vectorized. It is
+for offline analysis, such as of exported games: the app doesn't import
+it, so NumPy isn't needed where the app runs.
+'''
+
+import datetime
+
+import numpy as np
+
+import game
+import stats
+
+
+def get_day(date_played):
+    '''Return *date_played* as a float number of days (NaN if unknown).'''
+    if isinstance(date_played, game.string_types):
+        date_played = game.parse_datetime(date_played)
+    if not isinstance(date_played, datetime.datetime):
+        return np.nan
+    return (date_played.toordinal() +
+            (date_played.hour * 3600 + date_played.minute * 60 +
+             date_played.second) / 86400.)
+
+
+def rolling_average(values, window):
+    '''Return the mean of each *window* consecutive values.
+
+    The first window - 1 values average over as many values as there are.
+    '''
+    values = np.asarray(values, dtype=float)
+    if not len(values):
+        return values
+    totals = np.cumsum(values)
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    totals[window:] = totals[window:] - totals[:-window]
+    return totals / counts
+
+
+class MoveTable(object):
+    '''Columnar table of the moves of many games.
+
+    Attributes, each a NumPy array with one element per move:
+        - *game*: index of the move's game.
+        - *player*: index into *players* of the player who moved.
+        - *date*: day the game was played (see get_day()).
+        - *score*: move score.
+        - *move_type*: index into game.move_types (len(game.move_types)
+          for unknown move types).
+        - *word_length*: number of letters in the word played (0 if none).
+
+    Attributes with one element per game and player in it:
+        - *result_game*, *result_player*, *result_score*: final scores.
+
+    And *game_date*, the day each game was played.
+    '''
+    def __init__(self, games=()):
+        self.players = []
+        player_codes = {}
+        type_codes = dict((t, i) for i, t in enumerate(game.move_types))
+        columns = ([], [], [], [], [])
+        game_dates = []
+        for gi, g in enumerate(games):
+            game_dates.append(get_day(g._metadata.get('date_played')))
+            for move in g._moves:
+                player = move['player']
+                if not player in player_codes:
+                    player_codes[player] = len(self.players)
+                    self.players.append(player)
+                columns[0].append(gi)
+                columns[1].append(player_codes[player])
+                columns[2].append(move['score'])
+                columns[3].append(type_codes.get(move['move_type'],
+                                                 len(game.move_types)))
+                columns[4].append(len(move['word'] or ''))
+        self.game = np.array(columns[0], dtype=np.int32)
+        self.player = np.array(columns[1], dtype=np.int32)
+        self.score = np.array(columns[2], dtype=np.int32)
+        self.move_type = np.array(columns[3], dtype=np.int8)
+        self.word_length = np.array(columns[4], dtype=np.int8)
+        self.game_date = np.array(game_dates, dtype=float)
+        self.date = self.game_date[self.game]
+        self._set_results()
+
+    def _set_results(self):
+        nplayers = max(len(self.players), 1)
+        keys, inverse = np.unique(self.game.astype(np.int64) * nplayers +
+                                  self.player, return_inverse=True)
+        self.result_game = (keys // nplayers).astype(np.int32)
+        self.result_player = (keys % nplayers).astype(np.int32)
+        self.result_score = np.bincount(
+                inverse, weights=self.score,
+                minlength=len(keys)).astype(np.int32)
+
+    def player_index(self, player):
+        return self.players.index(player)
+
+    def player_turns(self, player):
+        '''Return a mask of the moves that are turns (see stats) of *player*.'''
+        is_turn = np.zeros(len(game.move_types) + 1, dtype=bool)
+        is_turn[[game.move_types.index(t) for t in stats.turn_move_types]] = (
+                True)
+        return ((self.player == self.player_index(player)) &
+                is_turn[self.move_type])
+
+    def player_games(self, player):
+        '''Return the games of *player* sorted by date.
+
+        Returns a dictionary of arrays with one element per game: 'game',
+        'date', 'score', 'opponent' (the best scoring other player, or -1)
+        and 'opponent_score'.
+        '''
+        p = self.player_index(player)
+        mine = self.result_player == p
+        games = self.result_game[mine]
+        scores = self.result_score[mine]
+        # Best opponent in each game: sort the other players' results by
+        # game and descending score and take the first of each game.
+        others = ~mine
+        other_games = self.result_game[others]
+        order = np.lexsort((-self.result_score[others], other_games))
+        other_games = other_games[order]
+        first = np.concatenate(([True], other_games[1:] != other_games[:-1]))
+        first_games = other_games[first]
+        best_player = self.result_player[others][order][first]
+        best_score = self.result_score[others][order][first]
+        opponent = -np.ones(len(games), dtype=np.int32)
+        opponent_score = np.zeros(len(games), dtype=np.int32)
+        if len(first_games):
+            pos = np.minimum(np.searchsorted(first_games, games),
+                             len(first_games) - 1)
+            found = first_games[pos] == games
+            opponent[found] = best_player[pos[found]]
+            opponent_score[found] = best_score[pos[found]]
+        dates = self.game_date[games]
+        by_date = np.argsort(dates, kind='mergesort')
+        return {'game': games[by_date],
+                'date': dates[by_date],
+                'score': scores[by_date],
+                'opponent': opponent[by_date],
+                'opponent_score': opponent_score[by_date]}
+
+    def rolling_scores(self, player, window=10):
+        '''Return (dates, rolling average game score) for *player*.'''
+        games = self.player_games(player)
+        return games['date'], rolling_average(games['score'], window)
+
+    def rolling_move_scores(self, player, window=50):
+        '''Return (dates, rolling average move score) of *player*'s turns.'''
+        mask = self.player_turns(player)
+        order = np.argsort(self.date[mask], kind='mergesort')
+        return (self.date[mask][order],
+                rolling_average(self.score[mask][order], window))
+
+    def win_rate_over_time(self, player, window=20):
+        '''Return (dates, rolling win rate) for *player*. A tie is half a win.'''
+        games = self.player_games(player)
+        wins = (np.sign(games['score'] - games['opponent_score']) + 1) / 2.
+        return games['date'], rolling_average(wins, window)
+
+    def score_distribution(self, player, bins=20, moves=False):
+        '''Return np.histogram() of *player*'s game scores (or move scores).'''
+        if moves:
+            values = self.score[self.player_turns(player)]
+        else:
+            values = self.player_games(player)['score']
+        return np.histogram(values, bins=bins)
+
+    def head_to_head(self, player):
+        '''Return *player*'s record against each opponent.
+
+        Returns a list of dictionaries with the 'opponent', number of
+        'games', 'wins', 'losses' and 'ties' and the 'average_margin',
+        most games first.
+        '''
+        games = self.player_games(player)
+        found = games['opponent'] >= 0
+        opponents, inverse = np.unique(games['opponent'][found],
+                                       return_inverse=True)
+        margin = (games['score'] - games['opponent_score'])[found]
+        n = len(opponents)
+        counts = np.bincount(inverse, minlength=n)
+        wins = np.bincount(inverse, weights=(margin > 0).astype(float),
+                           minlength=n)
+        losses = np.bincount(inverse, weights=(margin < 0).astype(float),
+                             minlength=n)
+        margins = np.bincount(inverse, weights=margin, minlength=n)
+        records = []
+        for i in np.argsort(-counts, kind='mergesort'):
+            records.append({'opponent': self.players[opponents[i]],
+                            'games': int(counts[i]),
+                            'wins': int(wins[i]),
+                            'losses': int(losses[i]),
+                            'ties': int(counts[i] - wins[i] - losses[i]),
+                            'average_margin': float(margins[i]) / counts[i]})
+        return records
@@ -0,0 +1,586 @@
+'''
+Crossword Game Stats benchmarks.
+
+Run with ``python benchmarks.py`` from the repository root to time each
+benchmark in *suite* on corpora of 1, 1k and 100k synthetic games (see
+--sizes). The games are random but use the same line formats as real .GCG
+files and custom score sheets. Corpora are made and timed in chunks of
+*chunk_games* games so that memory use doesn't grow with their size.
+
+Use --json to save the results, and --compare with an earlier file to
+see the change in speed, for example between two commits. Benchmarks of
+code that needs App Engine or Jinja2 are skipped when those can't be
+imported.
+'''
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+import zlib
+
+import compact
+import game
+import render
+import scoring
+import stats
+
+
+# Games made and timed at a time.
+chunk_games = 1000
+
+
+def random_word(rnd, length):
+    return ''.join(rnd.choice('AEIOURSTLNDGBCMPFHVWYKJXQZ')
+                   for i in range(length))
+
+
+def random_gcg_move(rnd, player, total):
+    '''Return a random .GCG move line and the new total.'''
+    rack = random_word(rnd, 7)
+    r = rnd.random()
+    if r < 0.85:
+        length = rnd.randint(2, 8)
+        score = rnd.randint(2, 90)
+        if rnd.random() < 0.5:
+            x = rnd.randint(0, 15 - length)
+            coords = '%d%s' % (rnd.randint(1, 15), game.columns[x].upper())
+        else:
+            y = rnd.randint(1, 16 - length)
+            coords = '%s%d' % (rnd.choice(game.columns).upper(), y)
+        line = '>%s: %s %s %s +%d %d' % (
+                player, rack, coords, random_word(rnd, length), score,
+                total + score)
+    elif r < 0.93:
+        score = 0
+        line = '>%s: %s -%s +0 %d' % (player, rack, rack[:3], total)
+    elif r < 0.97:
+        score = 0
+        line = '>%s: %s - +0 %d' % (player, rack, total)
+    else:
+        score = -rnd.randint(5, 40)
+        line = '>%s: %s -- %d %d' % (player, rack, score, total + score)
+    return line, total + score
+
+
+def random_gcg(n_games, moves_per_game=24, seed=0):
+    '''Return the text of *n_games* concatenated synthetic .GCG files.'''
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(n_games):
+        players = ['p%d' % rnd.randint(0, 99), 'q%d' % rnd.randint(0, 99)]
+        lines.append('#character-encoding UTF-8')
+        for j, player in enumerate(players):
+            lines.append('#player%d %s Player %s' % (j + 1, player, player))
+        lines.append('#title Synthetic game %d' % i)
+        totals = [0, 0]
+        for j in range(moves_per_game):
+            line, totals[j % 2] = random_gcg_move(
+                    rnd, players[j % 2], totals[j % 2])
+            lines.append(line)
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def random_nfshost(n_games, moves_per_game=12, seed=0):
+    '''Return the text of *n_games* synthetic custom score sheets (see
+    game.Game.read_nfshost()).'''
+    rnd = random.Random(seed)
+    start = datetime.datetime(2012, 1, 1)
+    lines = []
+    for i in range(n_games):
+        played = start + datetime.timedelta(minutes=rnd.randint(0, 10 ** 6))
+        lines.append('played %s' % played.strftime('%Y-%m-%d %H:%M'))
+        players = rnd.sample(['Ann', 'Bob', 'Cat', 'Dan', 'Eve', 'Fay'], 2)
+        sheets = []
+        for j, player in enumerate(players):
+            totals = []
+            total = 0
+            for k in range(moves_per_game):
+                total += rnd.choice([0, rnd.randint(2, 90)])
+                totals.append(total)
+            if j == 1:
+                totals.append(total - rnd.randint(1, 20))
+            sheets.append('%s%s:: %s' % (player, '*' if j == 0 else '',
+                                         ' '.join(str(t) for t in totals)))
+        if players[0] > players[1]:
+            sheets.reverse()
+        lines.extend(sheets)
+        lines.append('Synthetic sheet %d' % i)
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def baseline_parse_gcg_event(line):
+    '''parse_gcg_event() as it was before the table-driven tokenizer.'''
+    logging.debug('parsing: ' + line)
+    line = line.strip().strip('\n').strip()
+    tokens = line.split()
+    player_key = None
+    rack = None
+    word = None
+    start = None
+    direction = None
+    score = None
+    move_type = None
+    coordinates = None
+    board_changed = False
+    coords = None
+    if len(tokens) >= 1:
+        player_key = tokens[0][1:-1]
+    logging.debug('player_key: ' + player_key)
+    if len(tokens) >= 6:
+        move_type = 'regular play'
+        board_changed = True
+        logging.debug(move_type)
+        rack, coords, word, score, total = tokens[1:6]
+        coords = coords.lower()
+        if not '~' in coords:
+            logging.debug('coords: ' + coords)
+            if coords[0] in game.columns:
+                direction = 'vertical'
+                x_adj = 0
+                y_adj = -1
+            else:
+                try:
+                    assert coords[-1] in game.columns
+                except AssertionError:
+                    direction = None
+                else:
+                    direction = 'horizontal'
+                    x_adj = 1
+                    y_adj = 0
+        logging.debug(str(direction))
+        if not direction is None:
+            def get_x(coords):
+                column = re.search('[a-z]', coords).group()
+                return game.columns.index(column)
+
+            def get_y(y):
+                row = re.search('[0-9]+', coords).group()
+                return 14 - (int(row) - 1)
+
+            start = [get_x(coords), get_y(coords)]
+            coordinates = [start]
+            for i in range(1, len(word)):
+                coordinates.append(
+                    (coordinates[-1][0] + x_adj, coordinates[-1][1] + y_adj))
+
+    elif len(tokens) == 5:
+        rack, special, score, total = tokens[1:]
+        if special == '--':
+            move_type = 'phoney withdraw'
+            board_changed = True
+            logging.debug(move_type)
+        elif special == '(challenge)':
+            move_type = 'acceptable challenge'
+            logging.debug(move_type)
+        elif special == '(time)':
+            move_type = 'time penalty'
+            logging.debug(move_type)
+        elif special.startswith('(') and special.endswith(')'):
+            move_type = 'last rack penalty'
+            logging.debug(move_type)
+        elif special == '-':
+            move_type = 'pass'
+            logging.debug(move_type)
+        elif special.startswith('-'):
+            move_type = 'tile exchange'
+            logging.debug(move_type)
+    elif len(tokens) == 4:
+        move_type = 'last rack bonus'
+        logging.debug(move_type)
+        rack, score, total = tokens[1:]
+    else:
+        move_type = 'unspecified'
+    if '~' in str(rack):
+        rack = None
+    if '~' in str(word):
+        word = None
+    if '~' in str(score):
+        score = 0
+    return {'player': player_key,
+            'rack': rack,
+            'word': word,
+            'start': start,
+            'coords': coords,
+            'coordinates': coordinates,
+            'direction': direction,
+            'score': int(score),
+            'move_type': move_type,
+            'board_changed': board_changed}
+
+
+def as_json(obj):
+    '''Return *obj* as it would be decoded from Game.json.'''
+    return json.loads(json.dumps(obj, default=game.serialization_handler))
+
+
+def deep_size(obj, seen=None):
+    '''Return the bytes used by *obj* and everything it refers to, counting
+    shared objects once.'''
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += deep_size(item, seen)
+    elif hasattr(obj, '__slots__'):
+        for name in obj.__slots__:
+            if hasattr(obj, name):
+                size += deep_size(getattr(obj, name), seen)
+    return size
+
+
+def best_of(func, repeat=3):
+    '''Return the shortest of *repeat* timings of func().'''
+    timings = []
+    for i in range(repeat):
+        t0 = time.time()
+        func()
+        timings.append(time.time() - t0)
+    return min(timings)
+
+
+def bench_parse_gcg_event(n_games):
+    move_lines = [l for l in random_gcg(n_games).split('\n')
+                  if l.startswith('>')]
+    for l in move_lines:
+        assert (as_json(baseline_parse_gcg_event(l)) ==
+                as_json(game.parse_gcg_event(l))), l
+    results = []
+    for name, func in [('baseline', baseline_parse_gcg_event),
+                       ('parse_gcg_event', game.parse_gcg_event)]:
+        seconds = best_of(lambda: [func(l) for l in move_lines])
+        results.append((name, len(move_lines), seconds))
+    return results
+
+
+def bench_serialization(n_games):
+    '''Compare the size and speed of Game.json and compact encodings.'''
+    games = list(game.GCGReader(random_gcg(n_games)))
+    json_txts = [g.json for g in games]
+    blobs = [compact.dumps(g) for g in games]
+    sizes = [('json', sum(len(t) for t in json_txts)),
+             ('json+zlib', sum(len(zlib.compress(t.encode('utf-8')))
+                               for t in json_txts)),
+             ('compact', sum(len(b) for b in blobs))]
+    timings = [
+        ('json encode', best_of(lambda: [g.json for g in games])),
+        ('json decode', best_of(lambda: [game.Game(single_game_JSON_txt=t)
+                                         for t in json_txts])),
+        ('compact encode', best_of(lambda: [compact.dumps(g)
+                                            for g in games])),
+        ('compact decode', best_of(lambda: [compact.loads(b)
+                                            for b in blobs]))]
+    return sizes, timings
+
+
+def bench_memory(n_games):
+    '''Compare the memory used by the moves of *n_games* held as
+    dictionaries (as decoded from Game.json) and as game.Move records, both
+    as parsed from .GCG and as decoded from Game.json (like games loaded
+    from the datastore).
+
+    Returns [(name, moves, bytes)].'''
+    games = list(game.GCGReader(random_gcg(n_games)))
+    dict_moves = [json.loads(g.json)['moves'] for g in games]
+    record_moves = [g._moves for g in games]
+    json_record_moves = [game.LazyGame(g.json)._moves for g in games]
+    n_moves = sum(len(moves) for moves in record_moves)
+    return [('dict moves', n_moves, deep_size(dict_moves)),
+            ('Move records', n_moves, deep_size(record_moves)),
+            ('Moves from JSON', n_moves,
+             deep_size(json_record_moves))]
+
+
+def count_moves(games):
+    return sum(len(g._moves) for g in games)
+
+
+def setup_games(seed, n_games):
+    return list(game.GCGReader(random_gcg(n_games, seed=seed)))
+
+
+def run_read_gcg(txt):
+    return count_moves(game.GCGReader(txt))
+
+
+def setup_move_lines(seed, n_games):
+    return [l for l in random_gcg(n_games, seed=seed).split('\n')
+            if l.startswith('>')]
+
+
+def run_parse_gcg_event(move_lines):
+    for l in move_lines:
+        game.parse_gcg_event(l)
+    return len(move_lines)
+
+
+def run_read_nfshost(txt):
+    return count_moves(game.NFSHostReader(txt))
+
+
+def run_get_boards(games):
+    for g in games:
+        g.get_boards()
+    return count_moves(games)
+
+
+def run_json_encode(games):
+    for g in games:
+        g.json
+    return count_moves(games)
+
+
+def setup_json(seed, n_games):
+    return [g.json for g in setup_games(seed, n_games)]
+
+
+def run_read_json(txts):
+    return count_moves(game.Game(single_game_JSON_txt=t) for t in txts)
+
+
+def run_set_game(games):
+    import gae
+    for g in games:
+        gae.GAEGame(uploader_id='benchmark').set_game(g)
+    return count_moves(games)
+
+
+def get_jinja_environment():
+    import jinja2
+    return jinja2.Environment(loader=jinja2.FileSystemLoader(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'html')))
+
+
+def render_game_page(environment, g):
+    '''Render game.html as handlers.ShowGame does, with plain dictionaries
+    for the handler's Move objects.'''
+    scores = scoring.score_game(g)
+    running_totals = stats.GameStats(g).running_totals
+    moves = []
+    for i, move in enumerate(g._moves):
+        m = dict(move, move_number=i, mismatch=scores[i]['mismatch'],
+                 total_score=running_totals[i],
+                 _t_bonuses=', '.join(scores[i]['bonuses']),
+                 _t_score_check='')
+        moves.append(m)
+    moves_html = environment.get_template('game-moves.html').render(
+            moves=moves, key='benchmark', board=render.render_final_board(g))
+    return environment.get_template('game.html').render(
+            title='Game', debug='', moves_html=moves_html)
+
+
+def run_render_game(games):
+    environment = get_jinja_environment()
+    for g in games:
+        render_game_page(environment, g)
+    return count_moves(games)
+
+
+def setup_game_list(seed, n_games):
+    '''Return (games, moves) with the games as the template values of the
+    gae.GAEGame entities listed by index.html.'''
+    listed = []
+    n_moves = 0
+    for i, g in enumerate(setup_games(seed, n_games)):
+        game_stats = stats.GameStats(g)
+        listed.append({
+                '_t_key': 'benchmark-%d-%d' % (seed, i),
+                '_t_date_played': '2012-01-01 00:00',
+                '_t_date_modified': '2012-01-01 00:00:00',
+                '_t_score_summary': ', '.join(
+                    '%s %d' % x for x in zip(game_stats.players,
+                                             game_stats.scores)),
+                '_t_margin': game_stats.margin or '',
+                'winning_player': game_stats.winner,
+                'total_score': sum(game_stats.scores)})
+        n_moves += len(g._moves)
+    return listed, n_moves
+
+
+def run_render_index(game_list):
+    games, n_moves = game_list
+    get_jinja_environment().get_template('index.html').render(
+            title='Games', debug='', games=games, pager=None)
+    return n_moves
+
+
+# (name, setup(seed, n_games), run(setup result) returning the number of
+# moves processed)
+suite = [
+    ('read_gcg', lambda seed, n: random_gcg(n, seed=seed), run_read_gcg),
+    ('parse_gcg_event', setup_move_lines, run_parse_gcg_event),
+    ('read_nfshost', lambda seed, n: random_nfshost(n, seed=seed),
+     run_read_nfshost),
+    ('get_boards', setup_games, run_get_boards),
+    ('json_encode', setup_games, run_json_encode),
+    ('read_json', setup_json, run_read_json),
+    ('set_game', setup_games, run_set_game),
+    ('render_game', setup_games, run_render_game),
+    ('render_index', setup_game_list, run_render_index),
+]
+
+
+def get_skip_reason(name):
+    '''Return why benchmark *name* can't run here, or None.'''
+    try:
+        if name == 'set_game':
+            import gae
+        elif name.startswith('render_'):
+            import jinja2
+    except ImportError as e:
+        return str(e)
+    return None
+
+
+def time_benchmark(setup, run, n_games):
+    '''Return (moves, seconds) of *run* over a corpus of *n_games*.
+
+    Each chunk is timed on its own, not counting its setup, taking the
+    best of three runs for corpora of up to one chunk.'''
+    repeat = 3 if n_games <= chunk_games else 1
+    moves = 0
+    seconds = 0.
+    seed = 0
+    while seed * chunk_games < n_games:
+        arg = setup(seed, min(chunk_games, n_games - seed * chunk_games))
+        results = []
+        seconds += best_of(lambda: results.append(run(arg)), repeat)
+        moves += results[0]
+        seed += 1
+    return moves, seconds
+
+
+def get_revision():
+    '''Return the git commit of the working tree, or None.'''
+    try:
+        return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT,
+                cwd=os.path.dirname(os.path.abspath(__file__))
+                ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes, names=None):
+    '''Run the benchmarks in *suite* (or just those in *names*) on corpora
+    of each of *sizes* games.
+
+    Returns a dictionary for the --json output: the 'python' version,
+    'platform', git 'revision' and 'date', the 'results' (a dictionary
+    of the 'benchmark', 'games', 'moves', 'seconds', 'games_per_second' and
+    'moves_per_second' of each run) and the 'skipped' benchmarks with the
+    reason.'''
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'revision': get_revision(),
+              'date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+              'results': [],
+              'skipped': {}}
+    for name, setup, run in suite:
+        if names and not name in names:
+            continue
+        reason = get_skip_reason(name)
+        if reason:
+            report['skipped'][name] = reason
+            continue
+        for n_games in sizes:
+            moves, seconds = time_benchmark(setup, run, n_games)
+            seconds = max(seconds, 1e-9)
+            report['results'].append({
+                    'benchmark': name, 'games': n_games, 'moves': moves,
+                    'seconds': seconds,
+                    'games_per_second': n_games / seconds,
+                    'moves_per_second': moves / seconds})
+    return report
+
+
+def print_report(report, baseline=None):
+    '''Print the results of run_suite(), with the speed relative to those
+    of an earlier *baseline* report if given.'''
+    before = {}
+    if baseline is not None:
+        for result in baseline['results']:
+            before[result['benchmark'], result['games']] = result
+    for result in report['results']:
+        line = '%-16s %7d games %10.3f s %10.0f games/s %10.0f moves/s' % (
+                result['benchmark'], result['games'], result['seconds'],
+                result['games_per_second'], result['moves_per_second'])
+        old = before.get((result['benchmark'], result['games']))
+        if old is not None:
+            line += ' %6.2fx' % (result['games_per_second'] /
+                                 old['games_per_second'])
+        print(line)
+    for name, reason in sorted(report['skipped'].items()):
+        print('%-16s skipped: %s' % (name, reason))
+
+
+def run_comparisons(n_games):
+    '''Print the baseline, serialization and memory comparisons.'''
+    for name, moves, seconds in bench_parse_gcg_event(n_games):
+        print('%-16s %8d moves %8.3f s %10.0f moves/s' % (
+                name, moves, seconds, moves / seconds))
+    sizes, timings = bench_serialization(n_games)
+    for name, size in sizes:
+        print('%-16s %8d bytes/game' % (name, size // n_games))
+    for name, seconds in timings:
+        print('%-16s %8.3f s %10.0f games/s' % (
+                name, seconds, n_games / seconds))
+    for name, moves, size in bench_memory(n_games):
+        print('%-16s %8d moves %10d bytes %6.0f bytes/move' % (
+                name, moves, size, float(size) / moves))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--sizes', default='1,1000,100000',
+                        help='comma separated numbers of games in the '
+                        'corpora (default 1,1000,100000)')
+    parser.add_argument('-b', '--benchmark', action='append', dest='names',
+                        choices=[name for name, setup, run in suite],
+                        help='run only this benchmark (can be repeated)')
+    parser.add_argument('--json', metavar='FILE',
+                        help='write the results to FILE as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='show the speed relative to the results in '
+                        'FILE from --json')
+    parser.add_argument('-n', '--games', type=int, default=None,
+                        help='instead of the suite, compare parse_gcg_event '
+                        'with its baseline, the serializations and the '
+                        'memory used by moves on this many games')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if args.games is not None:
+        run_comparisons(args.games)
+        return
+    sizes = [int(size) for size in args.sizes.split(',')]
+    report = run_suite(sizes, args.names)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
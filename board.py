@@ -0,0 +1,166 @@
+'''
+Crossword Game Stats board replay engine.
+'''
+
+import hashlib
+
+
+_zobrist_keys = {}
+
+
+def zobrist_key(cell, letter):
+    '''Return the 64 bit Zobrist key of *letter* on *cell*.
+
+    The keys are derived from a hash of the cell and letter rather than a
+    random table, so that position hashes are the same in every process
+    and can be stored.
+    '''
+    try:
+        return _zobrist_keys[cell, letter]
+    except KeyError:
+        txt = (u'%d:%s' % (cell, letter)).encode('utf-8')
+        key = int(hashlib.sha1(txt).hexdigest()[:16], 16)
+        _zobrist_keys[cell, letter] = key
+        return key
+
+
+class BoardReplay(object):
+    '''Board positions of a game, replayed move by move.
+
+    Only one board is held in memory: a bytearray of size * size cells in
+    which each cell is an index into *alphabet* (0 being an empty square).
+    Each move is stored as a delta, a tuple of (cell, old, new) triples, so
+    replaying a move costs O(tiles placed). A copy of the board is kept
+    every *checkpoint_interval* moves so that board_at() can seek to any
+    move without replaying the whole game. A phoney withdraw undoes the
+    delta of the last play that placed tiles.
+
+    Each position also has a Zobrist hash: the XOR of zobrist_key() of
+    every tile on the board, updated from the delta of each move. The
+    empty board hashes to 0, and the same tiles on the same squares hash
+    the same whichever order they were played in.
+
+    Attributes:
+        - *alphabet*: list of the letters seen so far, indexed by code.
+        - *cells*: the board after the last move.
+        - *deltas*: one delta per move (empty if the board didn't change).
+        - *hash*: hash of the board after the last move.
+        - *hashes*: hash of the board after each move.
+    '''
+    def __init__(self, moves=(), size=15, checkpoint_interval=16):
+        self.size = size
+        self.checkpoint_interval = checkpoint_interval
+        self.alphabet = [' ']
+        self._codes = {' ': 0}
+        self.cells = bytearray(size * size)
+        self.deltas = []
+        self.hash = 0
+        self.hashes = []
+        self._checkpoints = [bytearray(self.cells)]
+        self._last_placed = None
+        for move in moves:
+            self.append(move)
+
+    def __len__(self):
+        return len(self.deltas)
+
+    def code(self, letter):
+        '''Return the cell value used for *letter*.'''
+        try:
+            return self._codes[letter]
+        except KeyError:
+            if len(self.alphabet) == 256:
+                raise ValueError('too many distinct letters on the board')
+            self._codes[letter] = len(self.alphabet)
+            self.alphabet.append(letter)
+            return self._codes[letter]
+
+    def get_delta(self, move):
+        '''Return the delta *move* would make to the current board.'''
+        if not move['board_changed']:
+            return ()
+        if move['move_type'] == 'phoney withdraw':
+            if self._last_placed is None:
+                return ()
+            return tuple((cell, new, old) for cell, old, new in
+                         reversed(self.deltas[self._last_placed]))
+        if not move['word'] or not move['coordinates']:
+            return ()
+        size = self.size
+        cells = self.cells
+        delta = []
+        packed = getattr(move, 'cells', None)
+        if packed is not None and size == 15:
+            # A game.Move with its squares already packed as cells.
+            for letter, cell in zip(move['word'], packed):
+                if letter != '.':
+                    new = self.code(letter)
+                    if cells[cell] != new:
+                        delta.append((cell, cells[cell], new))
+            return tuple(delta)
+        for letter, (x, y) in zip(move['word'], move['coordinates']):
+            if letter == '.' or not (0 <= x < size and 0 <= y < size):
+                continue
+            cell = y * size + x
+            new = self.code(letter)
+            if cells[cell] != new:
+                delta.append((cell, cells[cell], new))
+        return tuple(delta)
+
+    def append(self, move):
+        '''Play *move* on the board and record its delta.'''
+        delta = self.get_delta(move)
+        if move['move_type'] == 'phoney withdraw':
+            self._last_placed = None
+        elif delta:
+            self._last_placed = len(self.deltas)
+        apply_delta(self.cells, delta)
+        self.deltas.append(delta)
+        alphabet = self.alphabet
+        for cell, old, new in delta:
+            if old:
+                self.hash ^= zobrist_key(cell, alphabet[old])
+            if new:
+                self.hash ^= zobrist_key(cell, alphabet[new])
+        self.hashes.append(self.hash)
+        if len(self.deltas) % self.checkpoint_interval == 0:
+            self._checkpoints.append(bytearray(self.cells))
+
+    def board_at(self, n):
+        '''Return a copy of the board after move *n* (-1 for the empty board).
+
+        Seeks forward from the nearest checkpoint.
+        '''
+        if not -1 <= n < len(self.deltas):
+            raise IndexError('move %d out of range' % n)
+        k = (n + 1) // self.checkpoint_interval
+        cells = bytearray(self._checkpoints[k])
+        for delta in self.deltas[k * self.checkpoint_interval:n + 1]:
+            apply_delta(cells, delta)
+        return cells
+
+    def hash_at(self, n):
+        '''Return the hash of the board after move *n* (-1 for the empty
+        board).'''
+        if not -1 <= n < len(self.hashes):
+            raise IndexError('move %d out of range' % n)
+        if n == -1:
+            return 0
+        return self.hashes[n]
+
+    def rows_at(self, n):
+        '''Return the board after move *n* as a list of rows of letters.'''
+        return self.get_rows(self.board_at(n))
+
+    def get_rows(self, cells):
+        '''Convert a board from board_at() into a list of rows of letters.'''
+        alphabet = self.alphabet
+        size = self.size
+        return [[alphabet[c] for c in cells[y * size:(y + 1) * size]]
+                for y in range(size)]
+
+
+def apply_delta(cells, delta):
+    for cell, old, new in delta:
+        cells[cell] = new
+
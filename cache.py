@@ -0,0 +1,206 @@
+'''
+Crossword Game Stats caches.
+'''
+
+import collections
+import hashlib
+import os
+import sys
+import time
+
+
+class LRUCache(object):
+    '''A dictionary-like cache holding at most *maxsize* items.
+
+    When it is full the least recently used item is dropped.
+    '''
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._items = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            return default
+        self._items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._items.pop(key, default)
+
+    def clear(self):
+        self._items.clear()
+
+
+class DictBackend(object):
+    '''In-process cache backend with the get/set/delete/incr interface of
+    the App Engine memcache client.
+
+    Holds at most *maxbytes* of values (as measured by sys.getsizeof()),
+    dropping the least recently used first. Each instance has its own
+    items, so it also serves as a stand-in for memcache in local scripts.
+    '''
+    def __init__(self, maxbytes=16 * 1024 * 1024):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._items = collections.OrderedDict()
+
+    def get(self, key):
+        try:
+            value, size = self._items.pop(key)
+        except KeyError:
+            return None
+        self._items[key] = (value, size)
+        return value
+
+    def set(self, key, value):
+        self.delete(key)
+        size = sys.getsizeof(value)
+        if size > self.maxbytes:
+            return False
+        self._items[key] = (value, size)
+        self.nbytes += size
+        while self.nbytes > self.maxbytes:
+            old_value, old_size = self._items.popitem(last=False)[1]
+            self.nbytes -= old_size
+        return True
+
+    def delete(self, key):
+        if key in self._items:
+            self.nbytes -= self._items.pop(key)[1]
+
+    def incr(self, key, initial_value=0):
+        value = self.get(key)
+        if value is None:
+            value = initial_value
+        self.set(key, value + 1)
+        return value + 1
+
+
+class MemcacheBackend(object):
+    '''Cache backend using App Engine memcache, shared by all instances.
+
+    The namespace includes the version of the app, so that a deployment
+    with new templates doesn't see the pages rendered by the last one.
+    '''
+    def __init__(self, namespace='render'):
+        from google.appengine.api import memcache
+        self._client = memcache.Client()
+        self.namespace = '%s-%s' % (namespace,
+                                    os.environ.get('CURRENT_VERSION_ID', ''))
+
+    def get(self, key):
+        return self._client.get(key, namespace=self.namespace)
+
+    def set(self, key, value):
+        return self._client.set(key, value, namespace=self.namespace)
+
+    def delete(self, key):
+        self._client.delete(key, namespace=self.namespace)
+
+    def incr(self, key, initial_value=0):
+        return self._client.incr(key, namespace=self.namespace,
+                                 initial_value=initial_value)
+
+
+def new_generation():
+    '''Return the first generation of a user whose generation isn't cached.
+
+    The generation can be evicted while fragments cached under it are
+    not, so it starts from the time in microseconds rather than 0; that
+    is past any generation it could have counted up to before.
+    '''
+    return int(time.time() * 1000000)
+
+
+class RenderCache(object):
+    '''Cache of rendered pages and page fragments.
+
+    Keys are tuples of strings (or anything with a str()); a key made with
+    user_key() also includes the user's generation, so that
+    invalidate_user() drops all of a user's cached fragments at once.
+
+    Attributes:
+        - *backend*: a DictBackend, MemcacheBackend or anything else with
+          their get/set/incr methods.
+        - *hits*, *misses*: counts of get() calls that found a value or not.
+    '''
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        if not self.hits + self.misses:
+            return 0.
+        return float(self.hits) / (self.hits + self.misses)
+
+    def make_key(self, *parts):
+        key = u':'.join(u'%s' % (p,) for p in parts)
+        if len(key) > 200:
+            # Too long for a memcache key (cursors can be).
+            key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return key
+
+    def user_key(self, user_id, *parts):
+        '''Return a key for a fragment that depends on *user_id*'s games.'''
+        key = self.make_key('generation', user_id)
+        generation = self.backend.get(key)
+        if generation is None:
+            generation = new_generation()
+            self.backend.set(key, generation)
+        return self.make_key(user_id, generation, *parts)
+
+    def invalidate_user(self, user_id):
+        '''Forget the fragments of user_key() for *user_id*.'''
+        self.backend.incr(self.make_key('generation', user_id),
+                          initial_value=new_generation())
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def get_or_render(self, key, render):
+        '''Return the value cached under *key*, or cache and return
+        render().'''
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.set(key, value)
+        return value
+
+
+_render_cache = None
+
+
+def get_render_cache():
+    '''Return the shared RenderCache, using memcache where it is available.'''
+    global _render_cache
+    if _render_cache is None:
+        try:
+            backend = MemcacheBackend()
+        except ImportError:
+            backend = DictBackend()
+        _render_cache = RenderCache(backend)
+    return _render_cache
@@ -0,0 +1,292 @@
+'''
+Crossword Game Stats compact binary game encoding.
+
+A more compact alternative to Game.json. Decoding gives a Game whose JSON
+is the same text, with its dictionary keys in the same order, so that
+stats.json_hash() doesn't change. The encoding (version 1) is:
+
+    version                  byte
+    players                  string (JSON list of every player name, game
+                             players first and then any other movers)
+    number of game players   varint
+    layout                   varint (index into *layouts*, 0 if the
+                             tile_bonuses are stored in the metadata)
+    layout key position      varint, if the layout isn't 0 (position of
+                             tile_bonuses among the metadata keys)
+    metadata                 string (JSON, without a known tile_bonuses)
+    number of key orders     varint
+    key orders               (the index into *move_keys* of each key, a
+                             byte each, in the order that the keys of a
+                             move that isn't raw iterate)
+    number of moves          varint
+    moves                    (see below)
+
+where a string is a varint length followed by UTF-8 bytes. Each move is a
+move type byte (index into game.move_types, *unknown_type* for None or
+*raw_move* for a move stored as a JSON string), a flags byte, the index of
+its key order and of the player (varints) and the score (zigzag varint),
+followed by the rack and word strings if flagged. A regular play whose
+coordinates, start and coords follow from its start square and direction
+(as parse_gcg_event() makes them) has its placement packed in one varint:
+the start cell (y * 15 + x) times two plus one for a horizontal play.
+Other moves store their coords string if they have one.
+'''
+
+import collections
+import json
+
+import game
+
+
+version = 1
+
+layouts = [None, str(game.scrabble_board)]
+
+unknown_type = len(game.move_types)
+raw_move = 255
+
+flag_board_changed = 1
+flag_rack = 2
+flag_word = 4
+flag_placement = 8
+flag_coords = 16
+
+move_keys = ('player', 'rack', 'word', 'start', 'coords', 'coordinates',
+             'direction', 'score', 'move_type', 'board_changed')
+_move_key_set = frozenset(move_keys)
+_key_codes = dict((k, i) for i, k in enumerate(move_keys))
+_type_codes = dict((t, i) for i, t in enumerate(game.move_types))
+_type_codes[None] = unknown_type
+
+
+def write_varint(out, n):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def read_varint(data, pos):
+    n = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def write_string(out, s):
+    if not isinstance(s, bytes):
+        s = s.encode('utf-8')
+    write_varint(out, len(s))
+    out.extend(s)
+
+
+def read_string(data, pos):
+    n, pos = read_varint(data, pos)
+    return bytes(data[pos:pos + n]).decode('utf-8'), pos + n
+
+
+def get_placement(move):
+    '''Return the packed placement of a regular play, or None if its
+    coordinates don't follow from its start square and direction.'''
+    word = move['word']
+    start = move['start']
+    direction = move['direction']
+    if not word or not start or direction not in ('horizontal', 'vertical'):
+        return None
+    x, y = start
+    if not (0 <= x < 15 and 0 <= y < 15):
+        return None
+    placement = (y * 15 + x) * 2 + (direction == 'horizontal')
+    coordinates = move['coordinates'] or ()
+    if [list(c) for c in coordinates] != decode_placement(
+            placement, len(word))[1]:
+        return None
+    if move['coords'] != get_coords(placement):
+        return None
+    return placement
+
+
+def decode_placement(placement, length):
+    '''Return (start, coordinates, direction) of a packed placement.'''
+    cell, horizontal = divmod(placement, 2)
+    y, x = divmod(cell, 15)
+    if horizontal:
+        x_adj, y_adj, direction = 1, 0, 'horizontal'
+    else:
+        x_adj, y_adj, direction = 0, -1, 'vertical'
+    start = [x, y]
+    coordinates = [start] + [[x + i * x_adj, y + i * y_adj]
+                             for i in range(1, length)]
+    return start, coordinates, direction
+
+
+def get_coords(placement):
+    '''Return the lower case GCG coordinates of a packed placement.'''
+    cell, horizontal = divmod(placement, 2)
+    y, x = divmod(cell, 15)
+    if horizontal:
+        return '%d%s' % (15 - y, game.columns[x])
+    return '%s%d' % (game.columns[x], 15 - y)
+
+
+def dumps(g):
+    '''Encode Game *g*. Returns bytes.'''
+    players = list(g._players)
+    player_index = dict((p, i) for i, p in enumerate(players))
+    for move in g._moves:
+        if not move.get('player') in player_index:
+            player_index[move.get('player')] = len(players)
+            players.append(move.get('player'))
+    metadata = collections.OrderedDict(g._metadata.items())
+    layout = 0
+    if metadata.get('tile_bonuses') in layouts[1:]:
+        key_position = list(metadata).index('tile_bonuses')
+        layout = layouts.index(metadata.pop('tile_bonuses'))
+
+    out = bytearray([version])
+    write_string(out, json.dumps(players))
+    write_varint(out, len(g._players))
+    write_varint(out, layout)
+    if layout:
+        write_varint(out, key_position)
+    write_string(out, json.dumps(metadata,
+                                 default=game.serialization_handler))
+    moves_out = bytearray()
+    order_index = {}
+    for move in g._moves:
+        write_move(moves_out, move, player_index, order_index)
+    write_varint(out, len(order_index))
+    for order in sorted(order_index, key=order_index.get):
+        out.extend(_key_codes[key] for key in order)
+    write_varint(out, len(g._moves))
+    out.extend(moves_out)
+    return bytes(out)
+
+
+def write_move(out, move, player_index, order_index):
+    '''Append *move* to *out*, adding the order of its keys to
+    *order_index* (key order: index) if it's new.'''
+    move_type = move.get('move_type')
+    score = move.get('score')
+    if (set(move) != _move_key_set or not move_type in _type_codes or
+            not isinstance(score, int) or isinstance(score, bool) or
+            not isinstance(move['board_changed'], bool)):
+        write_raw_move(out, move)
+        return
+    flags = 0
+    if move['board_changed']:
+        flags |= flag_board_changed
+    if move['rack'] is not None:
+        flags |= flag_rack
+    if move['word'] is not None:
+        flags |= flag_word
+    placement = None
+    if move_type == 'regular play':
+        placement = get_placement(move)
+    if placement is not None:
+        flags |= flag_placement
+    elif (move['start'] is not None or move['coordinates'] is not None or
+            move['direction'] is not None):
+        write_raw_move(out, move)
+        return
+    elif move['coords'] is not None:
+        flags |= flag_coords
+    order = tuple(move)
+    if not order in order_index:
+        order_index[order] = len(order_index)
+    out.append(_type_codes[move_type])
+    out.append(flags)
+    write_varint(out, order_index[order])
+    write_varint(out, player_index[move['player']])
+    write_varint(out, (score << 1) ^ (score >> 63))
+    if flags & flag_rack:
+        write_string(out, move['rack'])
+    if flags & flag_word:
+        write_string(out, move['word'])
+    if flags & flag_placement:
+        write_varint(out, placement)
+    elif flags & flag_coords:
+        write_string(out, move['coords'])
+
+
+def write_raw_move(out, move):
+    out.append(raw_move)
+    write_string(out, json.dumps(move, default=game.serialization_handler))
+
+
+def loads(data):
+    '''Decode bytes from dumps() into a Game.'''
+    data = bytearray(data)
+    if data[0] != version:
+        raise ValueError('unknown compact game version %d' % data[0])
+    pos = 1
+    txt, pos = read_string(data, pos)
+    players = json.loads(txt)
+    n_game_players, pos = read_varint(data, pos)
+    layout, pos = read_varint(data, pos)
+    if layout:
+        key_position, pos = read_varint(data, pos)
+    txt, pos = read_string(data, pos)
+    items = list(_ordered_loads(txt).items())
+    if layout:
+        items.insert(key_position, ('tile_bonuses', layouts[layout]))
+    metadata = collections.OrderedDict(items)
+    n_orders, pos = read_varint(data, pos)
+    key_orders = []
+    for i in range(n_orders):
+        key_orders.append([move_keys[code]
+                           for code in data[pos:pos + len(move_keys)]])
+        pos += len(move_keys)
+    n_moves, pos = read_varint(data, pos)
+    moves = []
+    for i in range(n_moves):
+        move, pos = read_move(data, pos, players, key_orders)
+        moves.append(move)
+    g = game.Game()
+    g._players = players[:n_game_players]
+    g._metadata = metadata
+    g._moves = game.MoveList(moves)
+    return g
+
+
+def _ordered_loads(txt):
+    '''json.loads() keeping the key order of objects, as Game.json writes
+    dictionaries in the order they were filled.'''
+    return json.loads(txt, object_pairs_hook=collections.OrderedDict)
+
+
+def read_move(data, pos, players, key_orders):
+    type_code = data[pos]
+    pos += 1
+    if type_code == raw_move:
+        txt, pos = read_string(data, pos)
+        return _ordered_loads(txt), pos
+    flags = data[pos]
+    order, pos = read_varint(data, pos + 1)
+    player, pos = read_varint(data, pos)
+    score, pos = read_varint(data, pos)
+    # Filled in the order of the encoded move's keys, so that its JSON is
+    # the same.
+    move = collections.OrderedDict((key, None) for key in key_orders[order])
+    move['player'] = players[player]
+    move['score'] = (score >> 1) ^ -(score & 1)
+    move['board_changed'] = bool(flags & flag_board_changed)
+    if type_code < unknown_type:
+        move['move_type'] = game.move_types[type_code]
+    if flags & flag_rack:
+        move['rack'], pos = read_string(data, pos)
+    if flags & flag_word:
+        move['word'], pos = read_string(data, pos)
+    if flags & flag_placement:
+        placement, pos = read_varint(data, pos)
+        move['start'], move['coordinates'], move['direction'] = (
+                decode_placement(placement, len(move['word'])))
+        move['coords'] = get_coords(placement)
+    elif flags & flag_coords:
+        move['coords'], pos = read_string(data, pos)
+    return move, pos
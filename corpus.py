@@ -0,0 +1,224 @@
+'''
+Crossword Game Stats analysis of local archives of games.
+
+Run with ``python corpus.py DIRECTORY [...]`` to summarize every .GCG and
+custom format score sheet under the directories, one row per game, as CSV
+or NDJSON (one JSON object per line). Files are parsed by a pool of
+worker processes, a chunk of files at a time.
+'''
+
+import argparse
+import csv
+import io
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+import game
+import stats
+
+
+# File extensions (lower case) of each import format.
+default_extensions = {'.gcg': 'GCG', '.txt': 'custom'}
+
+# Columns of a summary, in order.
+fields = ['file', 'index', 'error', 'title', 'date_played', 'players',
+          'scores', 'winner', 'margin', 'moves', 'turns', 'bingos',
+          'fingerprint']
+
+logger = logging.getLogger(__name__)
+
+
+def find_files(paths, extensions=default_extensions):
+    '''Return a sorted list of (path, import format) of the files under
+    *paths* with one of the *extensions*. A path can also be a file.'''
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            names = [path]
+        else:
+            names = [os.path.join(dirpath, filename)
+                     for dirpath, dirnames, filenames in os.walk(path)
+                     for filename in filenames]
+        for name in names:
+            file_type = extensions.get(os.path.splitext(name)[1].lower())
+            if file_type is not None:
+                found.append((name, file_type))
+    return sorted(found)
+
+
+def get_reader(file_type):
+    '''Return the reader class of an import format.'''
+    return {'GCG': game.GCGReader, 'custom': game.NFSHostReader}[file_type]
+
+
+def get_summary(g):
+    '''Return the summary of Game *g* as a dictionary with the *fields*
+    that don't depend on the file.'''
+    game_stats = stats.GameStats(g)
+    per_player = [game_stats.per_player[p] for p in game_stats.players]
+    date_played = g._metadata.get('date_played')
+    if date_played is not None:
+        date_played = game.serialization_handler(date_played)
+    return {'title': g._metadata.get('title'),
+            'date_played': date_played,
+            'players': game_stats.players,
+            'scores': game_stats.scores,
+            'winner': game_stats.winner,
+            'margin': game_stats.margin,
+            'moves': len(g._moves),
+            'turns': sum(p['turns'] for p in per_player),
+            'bingos': sum(p['bingos'] for p in per_player),
+            'fingerprint': stats.fingerprint(g)}
+
+
+def summarize_file(item):
+    '''Return (path, [summary of each game], number of moves) for an item
+    of find_files(). A game that can't be read, or a file that can't be
+    opened, has a summary with just its 'error'.'''
+    path, file_type = item
+    summaries = []
+    n_moves = 0
+    try:
+        with io.open(path, encoding='utf-8', errors='replace') as f:
+            reader = get_reader(file_type)(f, skip_errors=True)
+            for i, g in enumerate(reader):
+                if isinstance(g, Exception):
+                    summary = {'error': str(g)}
+                else:
+                    summary = get_summary(g)
+                    n_moves += len(g._moves)
+                summary.update({'file': path, 'index': i})
+                summaries.append(summary)
+    except (IOError, OSError) as e:
+        summaries.append({'file': path, 'index': None, 'error': str(e)})
+    return path, summaries, n_moves
+
+
+def iter_summaries(files, processes=None, chunksize=None):
+    '''Summarize *files* from find_files() in a pool of *processes* (all
+    of the CPUs by default), yielding the results of summarize_file() in
+    the order of *files*.
+
+    Each worker is sent *chunksize* files at a time; by default the files
+    are split into about four chunks per process, so that workers rarely
+    wait on each other or on the pool.
+    '''
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes <= 1 or len(files) <= 1:
+        for item in files:
+            yield summarize_file(item)
+        return
+    if chunksize is None:
+        chunksize = max(1, len(files) // (processes * 4))
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap(summarize_file, files, chunksize):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _csv_value(value):
+    if isinstance(value, list):
+        value = ';'.join(str(v) if not isinstance(v, game.string_types)
+                         else v for v in value)
+    if value is None:
+        return ''
+    if sys.version_info[0] < 3 and isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class CSVWriter(object):
+    '''Writes summaries as CSV, with lists joined by ";".'''
+    def __init__(self, f):
+        self._writer = csv.writer(f)
+        self._writer.writerow(fields)
+
+    def write(self, summary):
+        self._writer.writerow([_csv_value(summary.get(field))
+                               for field in fields])
+
+
+class NDJSONWriter(object):
+    '''Writes summaries as one JSON object per line.'''
+    def __init__(self, f):
+        self._f = f
+
+    def write(self, summary):
+        self._f.write(json.dumps(dict((field, summary.get(field))
+                                      for field in fields),
+                                 sort_keys=True))
+        self._f.write('\n')
+
+
+writers = {'csv': CSVWriter, 'ndjson': NDJSONWriter}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help='directories (or files) to read')
+    parser.add_argument('-o', '--output', default='-',
+                        help='file to write (default standard output)')
+    parser.add_argument('-f', '--format', choices=sorted(writers),
+                        default=None,
+                        help='output format (default from the output file '
+                        'extension, otherwise csv)')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='worker processes (default the number of CPUs)')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='files sent to a worker at a time')
+    parser.add_argument('--custom-ext', default='.txt',
+                        help='extension of custom format score sheets '
+                        '(default .txt)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    extensions = {'.gcg': 'GCG', args.custom_ext.lower(): 'custom'}
+    output_format = args.format
+    if output_format is None:
+        output_format = os.path.splitext(args.output)[1].lstrip('.').lower()
+        if not output_format in writers:
+            output_format = 'csv'
+
+    t0 = time.time()
+    files = find_files(args.paths, extensions)
+    if args.output == '-':
+        f = sys.stdout
+    elif sys.version_info[0] < 3:
+        f = open(args.output, 'wb')
+    else:
+        f = io.open(args.output, 'w', encoding='utf-8', newline='')
+    writer = writers[output_format](f)
+    n_games = n_errors = n_moves = 0
+    try:
+        for path, summaries, moves in iter_summaries(
+                files, args.processes, args.chunksize):
+            for summary in summaries:
+                writer.write(summary)
+                if summary.get('error'):
+                    n_errors += 1
+                else:
+                    n_games += 1
+            n_moves += moves
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    seconds = max(time.time() - t0, 1e-9)
+    logger.info('%d files, %d games (%d errors), %d moves in %.2f s: '
+                '%.1f files/s, %.0f moves/s', len(files), n_games, n_errors,
+                n_moves, seconds, len(files) / seconds, n_moves / seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,27 @@
+import collections
 import datetime
+import json
+import re
 
 from google.appengine.ext import db, blobstore
 
+import cache
 import game
+import openings
+import profiling
+import search
+import stats
+
+
+# Decoded games by (entity key, date_modified), so that a game viewed
+# again isn't parsed again.
+_game_cache = cache.LRUCache(256)
+
+# openings.OpeningTree of a user's games by RenderCache.user_key().
+_opening_trees = cache.LRUCache(4)
+
+# Candidate games checked by search_games() for one query.
+max_search_candidates = 1000
 
 
 class GAEGame(db.Model):
@@ -23,6 +42,18 @@ class GAEGame(db.Model):
     duplicate_game_keys = db.StringListProperty()
     tags = db.StringListProperty()
     trashed = db.BooleanProperty()
+    json_hash = db.StringProperty()
+    score_summary = db.StringProperty()
+    stats_serialisation = db.TextProperty()
+    fingerprint = db.StringProperty()
+    search_index = db.TextProperty()
+    # The terms of search_index, queried by search_games().
+    search_terms = db.StringListProperty()
+    # Positions after the opening plays, queried by find_position_games().
+    position_hashes = db.StringListProperty()
+    # openings.encode_play() of each opening play, loaded by
+    # get_opening_tree() with a projection query.
+    opening_plays = db.StringListProperty()
     
     @property
     def _t_scores(self):
@@ -34,8 +65,9 @@ class GAEGame(db.Model):
     
     @property
     def _t_score_summary(self):
-        return ', '.join(['%s %d' % (player, score) for
-                          player, score in zip(self.players, self.scores)])
+        if self.score_summary:
+            return self.score_summary
+        return get_score_summary(self.players, self.scores)
                           
     @property
     def _t_date_played(self):
@@ -60,24 +92,242 @@ class GAEGame(db.Model):
         '''Set up GAE object.'''
         self.date_played = g._metadata.get('date_played', None)
         self.date_modified = datetime.datetime.now()
-        self.players = list(g._players)
-        self.scores = [0 for player in self.players]
-        for move in g._moves:
-            player_index = self.players.index(move['player'])
-            self.scores[player_index] += move['score']
-        self.total_score = sum(self.scores)
-        sorted_scores, sorted_players = zip(
-                *sorted(zip(self.scores, self.players), key=lambda x: x[0]))
-        self.margin = None
-        if len(sorted_scores) > 1:
-            self.margin = sorted_scores[-1] - sorted_scores[-2]
-        self.winning_player = sorted_players[-1]
-        self.trashed = False
-        
         self.json_serialisation = str(g.json)
+        self.json_hash = stats.json_hash(self.json_serialisation)
+        self.fingerprint = stats.fingerprint(g)
+        term_moves = search.get_move_terms(g)
+        self.search_index = json.dumps(term_moves)
+        self.search_terms = sorted(term_moves)
+        game_stats = stats.get_game_stats(g, self.json_serialisation)
+        opening_results = openings.get_opening_results(g, game_stats)
+        self.position_hashes = [openings.position_key(result[1])
+                                for result in opening_results]
+        self.opening_plays = [openings.encode_play(ply, *result)
+                              for ply, result in enumerate(opening_results)]
+        self.stats_serialisation = game_stats.json
+        self.players = list(game_stats.players)
+        self.scores = game_stats.scores
+        self.total_score = sum(self.scores)
+        self.margin = game_stats.margin
+        self.winning_player = game_stats.winner
+        self.score_summary = get_score_summary(self.players, self.scores)
+        if self.trashed is None:
+            self.trashed = False
+    
+    def get_stats(self):
+        '''Return the stats.GameStats of the game.
+
+        Uses the statistics stored with the entity if there are any, so
+        that json_serialisation doesn't need to be parsed.
+        '''
+        if self.json_hash and self.stats_serialisation:
+            with profiling.timed('json_decode'):
+                return stats.load_game_stats(self.json_hash,
+                                             self.stats_serialisation)
+        return stats.get_game_stats(self.get_game(), self.json_serialisation)
     
     def get_game(self):
-        return game.Game(single_game_JSON_txt=self.json_serialisation)
+        '''Return the game.LazyGame of the game.
+
+        Games are cached by entity key and date_modified; treat the game
+        returned as read only.
+        '''
+        if not self.is_saved():
+            with profiling.timed('json_decode'):
+                return game.LazyGame(self.json_serialisation)
+        cache_key = (str(self.key()), self.date_modified)
+        g = _game_cache.get(cache_key)
+        if g is None:
+            with profiling.timed('json_decode'):
+                g = game.LazyGame(self.json_serialisation)
+            _game_cache[cache_key] = g
+        return g
+
+    @classmethod
+    def get_page(cls, uploader_id, filters=(), sort=None, cursor=None,
+                 page_size=50):
+        '''Return one page of a user's games for the list pages.
+
+        Only the properties in *list_projection* are loaded, once the
+        user's UserSummary says all of their games have them (see
+        UserSummary.list_ready); until then whole entities are loaded, as
+        a projection query would leave out the games without them.
+        *filters* is a list of (property operator, value) pairs, *sort* one
+        of the keys of *list_sorts* and *cursor* the cursor returned for
+        the previous page. Returns (games, cursor for the next page or
+        None).
+        '''
+        summary = UserSummary.get_by_key_name(uploader_id)
+        projection = None
+        if summary is not None and summary.list_ready:
+            projection = list_projection
+        q = db.Query(cls, projection=projection)
+        q.filter('uploader_id =', uploader_id)
+        for prop_op, value in filters:
+            q.filter(prop_op, value)
+        q.order(list_sorts.get(sort, list_sorts[default_sort]))
+        if cursor:
+            q.with_cursor(cursor)
+        games = q.fetch(page_size)
+        next_cursor = None
+        if len(games) == page_size:
+            next_cursor = q.cursor()
+        return games, next_cursor
+
+
+class GameFingerprint(db.Model):
+    '''Index of a user's games by stats.fingerprint(), keyed by
+    "user ID:fingerprint" so that many can be looked up with one db.get().
+
+    Attributes:
+        - *game_key*: key of the first game stored with the fingerprint.
+    '''
+    game_key = db.StringProperty()
+
+    @classmethod
+    def key_for(cls, uploader_id, fingerprint):
+        return db.Key.from_path(cls.kind(),
+                                '%s:%s' % (uploader_id, fingerprint))
+
+
+def find_duplicates(uploader_id, fingerprints):
+    '''Return {fingerprint: key of the stored game} for those of
+    *fingerprints* that *uploader_id* already has a game for.'''
+    fingerprints = list(set(fingerprints))
+    found = db.get([GameFingerprint.key_for(uploader_id, fp)
+                    for fp in fingerprints])
+    return dict((fp, f.game_key) for fp, f in zip(fingerprints, found)
+                if f is not None)
+
+
+def index_fingerprints(gae_games):
+    '''Store a GameFingerprint for each of the saved *gae_games* that isn't
+    a linked duplicate and hasn't been indexed yet.'''
+    games = [g for g in gae_games
+             if g.fingerprint and not g.duplicate_game_keys]
+    keys = [GameFingerprint.key_for(g.uploader_id, g.fingerprint)
+            for g in games]
+    new = {}
+    for key, found, gae_game in zip(keys, db.get(keys), games):
+        if found is None and not key in new:
+            new[key] = GameFingerprint(key=key, game_key=str(gae_game.key()))
+    db.put(list(new.values()))
+
+
+def remove_fingerprint(gae_game):
+    '''Delete the GameFingerprint of *gae_game* if it points to it.'''
+    if not gae_game.fingerprint:
+        return
+    key = GameFingerprint.key_for(gae_game.uploader_id, gae_game.fingerprint)
+    found = db.get(key)
+    if found is not None and found.game_key == str(gae_game.key()):
+        db.delete(key)
+
+
+def search_games(uploader_id, terms, limit=100, batch_size=50):
+    '''Return the untrashed games of *uploader_id* with a move described by
+    all of the search *terms* (see search.parse_query()).
+
+    Candidate games are found with the search_terms index: the games with
+    every term that has no wildcards or, if every term has them, the games
+    with a term starting with the first one's prefix. The search_index of
+    each candidate, up to *max_search_candidates* of them, is then checked
+    for a single move described by all of the terms. Games stored before
+    search_terms existed aren't found until they are refreshed.
+
+    Returns ([(GAEGame, [move numbers])] of up to *limit* games, whether
+    there may be more).
+    '''
+    if not terms:
+        return [], False
+    q = GAEGame.all(keys_only=True)
+    q.filter('uploader_id =', uploader_id)
+    q.filter('trashed =', False)
+    exact = [t for t in terms if not '*' in t and not '?' in t]
+    for term in exact:
+        q.filter('search_terms =', term)
+    if not exact:
+        prefix = re.split('[*?]', terms[0], 1)[0]
+        q.filter('search_terms >=', prefix)
+        q.filter('search_terms <', prefix + u'\ufffd')
+    found = []
+    seen = set()
+    checked = 0
+    while len(found) < limit and checked < max_search_candidates:
+        keys = [k for k in q.fetch(batch_size) if not k in seen]
+        if not keys:
+            return found, False
+        seen.update(keys)
+        checked += len(keys)
+        index = search.SearchIndex()
+        gae_games = {}
+        for gae_game in db.get(keys):
+            if gae_game is not None and gae_game.search_index:
+                with profiling.timed('json_decode'):
+                    term_moves = json.loads(gae_game.search_index)
+                index.add_game(str(gae_game.key()), term_moves)
+                gae_games[str(gae_game.key())] = gae_game
+        game_moves = collections.OrderedDict()
+        for game_key, move in index.search(terms):
+            game_moves.setdefault(game_key, []).append(move)
+        for game_key, moves in game_moves.items():
+            found.append((gae_games[game_key], moves))
+        q.with_cursor(q.cursor())
+    return found[:limit], True
+
+
+def get_opening_tree(uploader_id):
+    '''Return the openings.OpeningTree of the untrashed games of
+    *uploader_id*, kept until the user's games change.
+
+    The tree is built from the opening_plays of the games, with a
+    projection query that returns each play as a separate result, so no
+    game is loaded or replayed. Games stored before opening_plays existed
+    are left out until they are refreshed.
+    '''
+    cache_key = cache.get_render_cache().user_key(uploader_id, 'openings')
+    tree = _opening_trees.get(cache_key)
+    if tree is None:
+        tree = openings.OpeningTree()
+        q = db.Query(GAEGame, projection=('opening_plays',))
+        q.filter('uploader_id =', uploader_id)
+        q.filter('trashed =', False)
+        for gae_game in q.run(batch_size=1000):
+            for txt in gae_game.opening_plays:
+                tree.add_play(*openings.decode_play(txt))
+        _opening_trees[cache_key] = tree
+    return tree
+
+
+def find_position_games(uploader_id, position, limit=100):
+    '''Return up to *limit* untrashed games of *uploader_id* that reached
+    the board *position* in their opening plays, found through
+    position_hashes.'''
+    q = GAEGame.all()
+    q.filter('uploader_id =', uploader_id)
+    q.filter('trashed =', False)
+    q.filter('position_hashes =', openings.position_key(position))
+    return q.fetch(limit)
+
+
+# Properties the game list pages show, loaded with projection queries (see
+# index.yaml for the indexes these need). Games stored before score_summary
+# existed aren't in the projection indexes, so users with such games get
+# whole entities until their games have been refreshed.
+list_projection = ('date_played', 'date_modified', 'score_summary', 'margin',
+                   'winning_player', 'total_score')
+list_sorts = {'date_played': '-date_played',
+              'date_played_asc': 'date_played',
+              'margin': '-margin',
+              'margin_asc': 'margin',
+              'total_score': '-total_score',
+              'total_score_asc': 'total_score'}
+default_sort = 'date_played'
+
+
+def get_score_summary(players, scores):
+    return ', '.join(['%s %d' % (player, score) for
+                      player, score in zip(players, scores)])
 
 
 class Photograph(db.Model):
@@ -86,3 +336,208 @@ class Photograph(db.Model):
     game_key = db.StringProperty()
     blob_key = blobstore.BlobReferenceProperty()
     uploader_id = db.StringProperty()
+
+
+# Times UserSummary.rebuild() recounts a summary that is changed by another
+# request while it counts.
+rebuild_attempts = 3
+
+
+class UserSummary(db.Model):
+    '''Running totals of one user's games, with the user ID as key name.
+
+    Updated by the handlers that import, trash, restore and delete games so
+    that pages don't need to query every GAEGame to count them.
+
+    Attributes:
+        - *list_ready*: every game of the user has the properties of
+          list_projection, so the list pages can use projection queries.
+    '''
+    game_count = db.IntegerProperty(default=0)
+    trashed_count = db.IntegerProperty(default=0)
+    players_seen = db.StringListProperty()
+    summary_serialisation = db.TextProperty()
+    date_modified = db.DateTimeProperty()
+    list_ready = db.BooleanProperty(default=False)
+
+    def __init__(self, *args, **kwargs):
+        db.Model.__init__(self, *args, **kwargs)
+        self._summary = None
+
+    @property
+    def summary(self):
+        '''Dictionary with game counts per 'import_batches' and 'players'
+        (games, wins and points for each player of untrashed games).'''
+        if self._summary is None:
+            self._summary = {'import_batches': {}, 'players': {}}
+            if self.summary_serialisation:
+                self._summary = json.loads(self.summary_serialisation)
+        return self._summary
+
+    @property
+    def import_batches(self):
+        return self.summary['import_batches']
+
+    @classmethod
+    def get_for_user(cls, user_id):
+        '''Return the summary for *user_id*, building it if there is none.'''
+        summary = cls.get_by_key_name(user_id)
+        if summary is None:
+            summary = cls.rebuild(user_id)
+        return summary
+
+    @classmethod
+    def rebuild(cls, user_id, method=None, gae_games=(), list_ready=None):
+        '''Recount all of the games of *user_id* and store the summary.
+
+        The recount is a query, which may not yet see games changed just
+        before it, so games that have just been changed with *method* (as
+        in update_user_summary()) are passed as *gae_games* and counted as
+        they are now rather than as the query sees them. The summary is
+        only stored if no other request has stored one since the recount
+        started; otherwise the games are recounted.
+
+        *list_ready* is worked out from the games counted unless it is
+        given.
+        '''
+        changed = dict((str(gae_game.key()), gae_game)
+                       for gae_game in gae_games)
+        for attempt in range(rebuild_attempts):
+            existing = cls.get_by_key_name(user_id)
+            started = existing and existing.date_modified
+            summary = cls(key_name=user_id)
+            q = GAEGame.all()
+            q.filter('uploader_id =', user_id)
+            ready = True
+            for gae_game in q.run(batch_size=1000):
+                if not str(gae_game.key()) in changed:
+                    summary._add(gae_game)
+                    ready = ready and gae_game.score_summary is not None
+            if method != 'remove':
+                for gae_game in changed.values():
+                    summary._add(gae_game)
+                    ready = ready and gae_game.score_summary is not None
+            summary.list_ready = ready if list_ready is None else list_ready
+
+            def txn():
+                current = cls.get_by_key_name(user_id)
+                if (current and current.date_modified) != started:
+                    return None
+                summary.put()
+                return summary
+
+            stored = db.run_in_transaction(txn)
+            if stored is not None:
+                return stored
+        raise db.TransactionFailedError(
+                'the summary of %s kept changing while it was recounted' %
+                user_id)
+
+    def put(self, **kwargs):
+        self.summary_serialisation = json.dumps(self.summary)
+        self.date_modified = datetime.datetime.now()
+        return db.Model.put(self, **kwargs)
+
+    def _count_players(self, gae_game, sign):
+        players = self.summary['players']
+        for player, score in zip(gae_game.players, gae_game.scores):
+            if not player in players:
+                players[player] = {'games': 0, 'wins': 0, 'points': 0}
+            players[player]['games'] += sign
+            players[player]['points'] += sign * score
+            if player == gae_game.winning_player:
+                players[player]['wins'] += sign
+            if not player in self.players_seen:
+                self.players_seen.append(player)
+
+    def _add(self, gae_game):
+        batches = self.summary['import_batches']
+        batch = gae_game.import_batch or ''
+        batches[batch] = batches.get(batch, 0) + 1
+        if gae_game.trashed:
+            self.trashed_count += 1
+        else:
+            self.game_count += 1
+            self._count_players(gae_game, 1)
+
+    def _remove(self, gae_game):
+        batches = self.summary['import_batches']
+        batch = gae_game.import_batch or ''
+        batches[batch] = batches.get(batch, 0) - 1
+        if batches[batch] <= 0:
+            del batches[batch]
+        if gae_game.trashed:
+            self.trashed_count -= 1
+        else:
+            self.game_count -= 1
+            self._count_players(gae_game, -1)
+
+    def _trash(self, gae_game):
+        self.game_count -= 1
+        self.trashed_count += 1
+        self._count_players(gae_game, -1)
+
+    def _restore(self, gae_game):
+        self.game_count += 1
+        self.trashed_count -= 1
+        self._count_players(gae_game, 1)
+
+
+def update_user_summary(user_id, method, gae_games):
+    '''Apply UserSummary *method* ('add', 'remove', 'trash' or 'restore') to
+    each of *gae_games* in a transaction, after the games themselves have
+    been changed. A user without a summary gets one recounted.'''
+    def txn():
+        summary = UserSummary.get_by_key_name(user_id)
+        if summary is None:
+            return None
+        for gae_game in gae_games:
+            getattr(summary, '_' + method)(gae_game)
+        summary.put()
+        return summary
+
+    summary = db.run_in_transaction(txn)
+    if summary is None:
+        summary = UserSummary.rebuild(user_id, method, gae_games)
+    return summary
+
+
+class RefreshJob(db.Model):
+    '''Progress of a background job that reprocesses all of a user's games
+    (see tasks.refresh_games).'''
+    uploader_id = db.StringProperty()
+    status = db.StringProperty(default='running')
+    cursor = db.TextProperty()
+    done = db.IntegerProperty(default=0)
+    errors = db.IntegerProperty(default=0)
+    total = db.IntegerProperty(default=0)
+    date_started = db.DateTimeProperty()
+    date_modified = db.DateTimeProperty()
+
+    @property
+    def rate(self):
+        '''Games processed per second.'''
+        seconds = (self.date_modified - self.date_started).total_seconds()
+        if seconds > 0:
+            return self.done / seconds
+        return 0.
+
+    @property
+    def eta(self):
+        '''Estimated time the job will finish, or None.'''
+        if self.status != 'running' or not self.rate:
+            return None
+        remaining = max(self.total - self.done, 0) / self.rate
+        return self.date_modified + datetime.timedelta(seconds=remaining)
+
+    @property
+    def _t_percent(self):
+        if self.total:
+            return min(100 * self.done // self.total, 100)
+        return 100
+
+    @property
+    def _t_eta(self):
+        if self.eta is None:
+            return ''
+        return self.eta.strftime('%Y-%m-%d %H:%M:%S')
@@ -2,12 +2,23 @@
 Crossword Game Stats classes.
 '''
 
+import collections
 import datetime
 import itertools
 import json
 import logging
 import re
 import sys
+import time
+
+import board
+import profiling
+
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
 
 
 columns = 'abcdefghijklmno'
@@ -29,11 +40,239 @@ l  w   l   w  l
 W  l   W   l  W
 '''[1:-1].split('\n')
 
-logging.basicConfig(stream=sys.stdout,
-                    format='%(asctime)s %(message)s',
-                    level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+move_types = ('regular play', 'tile exchange', 'pass', 'phoney withdraw',
+              'acceptable challenge', 'time penalty', 'last rack penalty',
+              'last rack bonus', 'unspecified')
+
+# Lookup tables for parse_gcg_event(). Coordinates are either column-first
+# (vertical play, e.g. "h8") or row-first (horizontal play, e.g. "8h").
+_gcg_columns = dict((c, i) for i, c in enumerate(columns))
+_gcg_rows = dict((str(n), 15 - n) for n in range(1, 16))
+_gcg_coords_re = re.compile('^(?:([a-o])([0-9]+)|([0-9]+)([a-o]))$')
+_gcg_specials = {'--': ('phoney withdraw', True),
+                 '(challenge)': ('acceptable challenge', False),
+                 '(time)': ('time penalty', False),
+                 '-': ('pass', False)}
+_gcg_special_events = dict((move_type, special) for special, (move_type, bc)
+                           in _gcg_specials.items())
                     
 
+class ParseError(ValueError):
+    '''Error reading a game, with the number of the line it was found on.'''
+    def __init__(self, msg, lineno=None):
+        ValueError.__init__(self, msg)
+        self.msg = msg
+        self.lineno = lineno
+
+    def __str__(self):
+        if self.lineno is None:
+            return self.msg
+        return 'line %d: %s' % (self.lineno, self.msg)
+
+
+move_keys = ('player', 'rack', 'word', 'start', 'coords', 'coordinates',
+             'direction', 'score', 'move_type', 'board_changed')
+_move_key_set = frozenset(move_keys)
+_move_type_codes = dict((t, i) for i, t in enumerate(move_types))
+_move_type_codes[None] = len(move_types)
+_move_type_names = move_types + (None, )
+
+
+try:
+    _intern_str = intern
+except NameError:
+    _intern_str = sys.intern
+
+
+# Strings shared by _intern() that intern() doesn't take (unicode on Python
+# 2, which is what json.loads() returns there). It is cleared when it has
+# *max_interned* of them.
+_interned = {}
+max_interned = 10000
+
+
+def _intern(s):
+    '''Share one copy of a string that is repeated in many moves.'''
+    if type(s) is str:
+        return _intern_str(s)
+    if isinstance(s, string_types):
+        if len(_interned) >= max_interned:
+            _interned.clear()
+        return _interned.setdefault(s, s)
+    return s
+
+
+def _pack(xy):
+    '''Return square [x, y] of the board as y * 15 + x, or None if it is
+    off the board.'''
+    try:
+        x, y = xy
+    except (TypeError, ValueError):
+        return None
+    if type(x) is int and type(y) is int and 0 <= x < 15 and 0 <= y < 15:
+        return y * 15 + x
+    return None
+
+
+class Move(object):
+    '''One move of a game, with the keys in *move_keys*.
+
+    A record rather than a dictionary, to save memory when many games are
+    loaded, but it reads like the dictionary of the JSON format (move['score'],
+    move.get(), dict(move), **move) and compares equal to it. The move type
+    is stored as its index in move_types, the player name is interned and
+    squares on the board are packed into one small integer each, y * 15 +
+    x (see _pack()); coordinates and start are unpacked into [x, y] lists
+    when they are read.
+    '''
+    __slots__ = ('player', 'rack', 'word', '_start', 'coords', '_cells',
+                 'direction', 'score', '_type', 'board_changed')
+
+    def __init__(self, player=None, rack=None, word=None, start=None,
+                 coords=None, coordinates=None, direction=None, score=0,
+                 move_type=None, board_changed=False):
+        self.player = _intern(player)
+        self.rack = rack
+        self.word = word
+        self.coords = coords
+        self.direction = direction
+        self.score = score
+        self.board_changed = board_changed
+        self.start = start
+        self.coordinates = coordinates
+        self.move_type = move_type
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**dict((str(k), v) for k, v in d.items()))
+
+    @property
+    def start(self):
+        if type(self._start) is int:
+            return list(divmod(self._start, 15)[::-1])
+        return self._start
+
+    @start.setter
+    def start(self, start):
+        packed = _pack(start)
+        self._start = start if packed is None else packed
+
+    @property
+    def coordinates(self):
+        if type(self._cells) is tuple:
+            return [[cell % 15, cell // 15] for cell in self._cells]
+        return self._cells
+
+    @coordinates.setter
+    def coordinates(self, coordinates):
+        self._cells = coordinates
+        if coordinates is not None:
+            cells = tuple(_pack(xy) for xy in coordinates)
+            if not None in cells:
+                self._cells = cells
+
+    @property
+    def cells(self):
+        '''The packed squares of the coordinates, or None if they aren't
+        all on the board.'''
+        if type(self._cells) is tuple:
+            return self._cells
+        return None
+
+    @property
+    def move_type(self):
+        if type(self._type) is int:
+            return _move_type_names[self._type]
+        return self._type
+
+    @move_type.setter
+    def move_type(self, move_type):
+        self._type = _move_type_codes.get(move_type, move_type)
+
+    def __getitem__(self, key):
+        if not key in _move_key_set:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if not key in _move_key_set:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        if key in _move_key_set:
+            return getattr(self, key)
+        return default
+
+    def __contains__(self, key):
+        return key in _move_key_set
+
+    def __iter__(self):
+        return iter(move_keys)
+
+    def __len__(self):
+        return len(move_keys)
+
+    def keys(self):
+        return list(move_keys)
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in move_keys]
+
+    def as_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (Move, dict)):
+            return self.as_dict() == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Move(%s)' % ', '.join('%s=%r' % item for item in self.items())
+
+
+def as_move(move):
+    '''Return a move dictionary as a Move. Dictionaries without exactly the
+    keys of a Move are returned as they are.'''
+    if isinstance(move, dict) and len(move) == len(move_keys) and all(
+            key in move for key in move_keys):
+        return Move.from_dict(move)
+    return move
+
+
+class MoveList(list):
+    '''The moves of a game: a list that stores move dictionaries as Move
+    records (see as_move()).'''
+    def __init__(self, moves=()):
+        list.__init__(self, [as_move(move) for move in moves])
+
+    def append(self, move):
+        list.append(self, as_move(move))
+
+    def extend(self, moves):
+        list.extend(self, [as_move(move) for move in moves])
+
+    def insert(self, i, move):
+        list.insert(self, i, as_move(move))
+
+    def __setitem__(self, i, value):
+        if isinstance(i, slice):
+            value = [as_move(move) for move in value]
+        else:
+            value = as_move(value)
+        list.__setitem__(self, i, value)
+
+
 class Game(object):
     '''A game of Scrabble.
     
@@ -45,26 +284,23 @@ class Game(object):
           intent is to avoid pickling and running into compatibility problems
           down the track. The JSON format will be stable for ever -- a list
           of player names, a list of dictionaries for the moves, and a
-          metadata dictionary for information about the game.
+          metadata dictionary for information about the game. The moves
+          are written last so that LazyGame can read the rest without
+          decoding them.
     '''
     
     @property
     def json(self):
-        def serialization_handler(obj):
-            if isinstance(obj, datetime.datetime):
-                return obj.strftime('%Y-%m-%d %H:%M:%S')
-            else:
-                return str(obj)
-                
-        return json.dumps({'moves': self._moves,
-                           'metadata': self._metadata,
-                           'players': self._players},
+        return json.dumps(collections.OrderedDict([
+                              ('players', self._players),
+                              ('metadata', self._metadata),
+                              ('moves', self._moves)]),
                           default=serialization_handler)
     
     def __init__(self, tile_bonuses=str(scrabble_board),
                 single_game_JSON_txt=None, GCG_txt=None, custom_txt=None):
         self._players = []
-        self._moves = []
+        self._moves = MoveList()
         self._metadata = {'players': {},
                           'tile_bonuses': tile_bonuses}
         if not single_game_JSON_txt is None:
@@ -74,130 +310,436 @@ class Game(object):
         elif not custom_txt is None:
             self.read_nfshost(custom_txt)
     
+    def get_replay(self):
+        '''Return a board.BoardReplay of this game's moves.'''
+        return board.BoardReplay(self._moves)
+
     def get_boards(self):
-        boards = [get_blank_board(15)]
-        for move in self._moves:
+        '''Return the board after each board-changing move.
+
+        A phoney withdraw replaces the board of the withdrawn move. Returns
+        False if no move changed the board.
+        '''
+        replay = self.get_replay()
+        boards = []
+        for i, move in enumerate(self._moves):
             if move['board_changed']:
-                logging.debug('replaying move: %s' % move)
                 if move['move_type'] == 'phoney withdraw':
-                    boards[-1] = boards[-2]
-                    logging.debug('new board: %s' % get_ascii_board(boards[-1]))
+                    if boards:
+                        boards[-1] = replay.rows_at(i)
                     continue
-                board = list([list(r) for r in boards[-1]])
-                for letter, (x, y) in zip(
-                        list(move['word']), move['coordinates']):
-                    board[y][x] = letter
-                logging.debug('new board: %s' % get_ascii_board(board))
-                boards.append(board)
-        if len(boards) > 1:
-            return boards[1:]
+                boards.append(replay.rows_at(i))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('board after move %d:\n%s', i,
+                                 get_ascii_board(boards[-1]))
+        if boards:
+            return boards
         else:
             return False
-    
+
+    @property
+    def gcg(self):
+        '''The game in .GCG format. Unknown racks and words are written as
+        "~".'''
+        lines = []
+        for i, player in enumerate(self._players):
+            info = self._metadata['players'].get(player)
+            name = player
+            if isinstance(info, dict):
+                name = info.get('name', player)
+            lines.append('#player%d %s %s' % (i + 1, player, name))
+        for pragma in ('title', 'description'):
+            if self._metadata.get(pragma):
+                lines.append('#%s %s' % (pragma, self._metadata[pragma]))
+        totals = {}
+        for move in self._moves:
+            totals[move['player']] = (totals.get(move['player'], 0) +
+                                      move['score'])
+            lines.append(get_gcg_event(move, totals[move['player']]))
+        return '\n'.join(lines) + '\n'
+
     def read_json(self, txt):
-        jsondict = json.loads(txt)
-        self._moves = jsondict['moves']
+        with profiling.timed('json_decode'):
+            jsondict = json.loads(txt)
+        self._moves = MoveList(jsondict['moves'])
         self._players = jsondict['players']
         self._metadata = jsondict['metadata']
     
     def read_gcg(self, txt):
-        '''Parser for .GCG files.'''
-        lines = [l.strip() for l in txt.split('\n')]
-        for i, line in enumerate(lines):
-            if line.startswith('#player'):
-                tokens = line.split()
-                pragma, player_key = tokens[:2]
-                player_name = player_key
-                if len(tokens) > 2:
-                    player_name = ' '.join(tokens[2:])
-                self._players.append(player_key)
-                self._metadata['players'][player_key] = {'name': player_name}
-            if line.startswith('#title'):
-                self._metadata['title'] = remove_substr(line, '#title')
-            if line.startswith('#description'):
-                description = remove_substr(line, '#description')
-                lines_copy = list(lines[i:])
-                for j, line2 in enumerate(list(lines[i:])):
-                    line2 = line2.strip()
-                    if line2.startswith('#') or line2.startswith('>'):
-                        break
-                    else:
-                        description += '\n' + line2
-                self._metadata['description'] = description
-            if line.startswith('>'):
-                self._moves.append(parse_gcg_event(line))
-                
+        '''Parser for .GCG files.
+
+        *txt* can be a string, a file object or any other iterable of lines.
+        '''
+        in_description = False
+        for lineno, line in enumerate(iter_lines(txt), 1):
+            try:
+                in_description = self._read_gcg_line(line.strip(),
+                                                     in_description)
+            except Exception as e:
+                raise ParseError('%s in %r' % (e, line.strip()), lineno)
+
+    def _read_gcg_line(self, line, in_description=False):
+        '''Parse one stripped line of a .GCG file into this game.
+
+        Returns True if the following lines continue a #description pragma.
+        '''
+        if in_description and not line.startswith(('#', '>')):
+            if line:
+                self._metadata['description'] += '\n' + line
+            return True
+        if line.startswith('#player'):
+            tokens = line.split()
+            pragma, player_key = tokens[:2]
+            player_name = player_key
+            if len(tokens) > 2:
+                player_name = ' '.join(tokens[2:])
+            self._players.append(player_key)
+            self._metadata['players'][player_key] = {'name': player_name}
+        elif line.startswith('#title'):
+            self._metadata['title'] = remove_substr(line, '#title')
+        elif line.startswith('#description'):
+            self._metadata['description'] = remove_substr(line, '#description')
+            return True
+        elif line.startswith('>'):
+            self._moves.append(parse_gcg_event(line))
+        return False
+
     def read_nfshost(self, txt):
-        lines = [l.strip() for l in txt.split('\n')]
-        turn_scores = []
-        for line in lines:
-            if line.startswith('played'):
-                if line == 'played':
+        '''Parser for the custom score sheet format.
+
+        A sheet has a "played" line with the date, a line of cumulative
+        scores for each player ("player:: 5 12 17", with a "*" on the
+        player facing the board) and any other lines as the description.
+        *txt* can be a string, a file object or any other iterable of
+        lines. Raises ParseError. See NFSHostReader for many sheets.
+        '''
+        self._read_nfshost_lines(enumerate(iter_lines(txt), 1))
+
+    def _read_nfshost_lines(self, numbered_lines):
+        '''Read a score sheet from (line number, line) pairs.'''
+        sheet = []
+        description = []
+        for lineno, line in numbered_lines:
+            line = line.strip()
+            try:
+                if line.startswith('played'):
+                    if line != 'played':
+                        self._metadata['date_played'] = parse_datetime(
+                                line[len('played'):].strip())
+                elif '::' in line:
+                    sheet.append(self._read_nfshost_scores(line))
+                elif line and not line.startswith('entered'):
+                    description.append(line)
+            except Exception as e:
+                raise ParseError('%s in %r' % (e, line), lineno)
+        if description:
+            self._metadata['description'] = '\n'.join(description) + '\n'
+        self._set_nfshost_moves(sheet)
+
+    def _read_nfshost_scores(self, line):
+        '''Add the player of a line of cumulative scores and return
+        (player, scores).'''
+        player, scores = line.split('::', 1)
+        player = player.strip()
+        if '*' in player:
+            player = player.replace('*', '')
+            self._metadata.setdefault('board_facing', []).append(player)
+        if player in self._players:
+            raise ValueError('player %r is listed twice' % player)
+        self._players.append(player)
+        self._metadata['players'][player] = player
+        return player, [int(score) for score in scores.split()]
+
+    def _set_nfshost_moves(self, sheet):
+        '''Add the moves of (player, cumulative scores) pairs.
+
+        The move scores are the differences between cumulative scores. If a
+        player's last move lost points, the last moves are the end of game
+        adjustments: that player's last rack penalty and everyone else's
+        last rack bonus.
+        '''
+        move_scores = [[b - a for a, b in zip([0] + totals, totals)]
+                       for player, totals in sheet]
+        last_rack_penalty = None
+        for (player, totals), scores in zip(sheet, move_scores):
+            if len(scores) > 1 and scores[-1] < 0:
+                last_rack_penalty = player
+                break
+        nturns = max([len(scores) for scores in move_scores] or [0])
+        for n in range(nturns):
+            for (player, totals), scores in zip(sheet, move_scores):
+                if n >= len(scores):
                     continue
+                if scores[n]:
+                    move_type = 'regular play'
                 else:
-                    self._metadata['date_played'] = parse_datetime(
-                            line.replace('played', '').strip()
-                            )
-            elif line.startswith('entered'):
-                continue
-            elif '::' in line:
-                # Player's moves are listed.
-                player = line[:line.find('::')]
-                if '*' in player:
-                    player = player.replace('*', '')
-                    if not 'board_facing' in self._metadata:
-                        self._metadata['board_facing'] = []
-                    self._metadata['board_facing'].append(player)
-                self._players.append(player)
-                self._metadata['players'][player] = player
-                scores = line[line.find('::'):].replace('::', '').strip().split()
-                if scores:
-                    turn_scores.append(map(int, scores))
-                else:
-                    turn_scores = []
+                    move_type = 'tile exchange'
+                if n == len(scores) - 1 and last_rack_penalty:
+                    if player == last_rack_penalty:
+                        move_type = 'last rack penalty'
+                    else:
+                        move_type = 'last rack bonus'
+                self._moves.append(Move(player=player, score=scores[n],
+                                        move_type=move_type))
+
+
+class LazyGame(Game):
+    '''A Game read from its JSON that only decodes the moves when they are
+    first accessed.
+
+    The players and metadata are decoded straight away. JSON written with
+    the moves last (as Game.json does) is only scanned as far as the
+    moves; anything else is decoded in full.
+    '''
+    def __init__(self, txt):
+        self._moves_list = None
+        self._moves_txt = None
+        self._players = []
+        self._metadata = {}
+        self.read_json(txt)
+
+    @property
+    def _moves(self):
+        if self._moves_list is None:
+            if self._moves_txt is None:
+                self._moves_list = MoveList()
             else:
-                if not 'description' in self._metadata:
-                    self._metadata['description'] = ''
-                self._metadata['description'] += line + '\n'
-        N = max([len(ts) for ts in turn_scores])
-        nplayers = len(self._players)
-        last_rack_penalty = ''
-        for i in range(nplayers):
-            turns = turn_scores[i]
-            player = self._players[i]
-            if turns[-1] - turns[-2] < 0:
-                last_rack_penalty = player
+                with profiling.timed('json_decode'):
+                    self._moves_list = MoveList(
+                            _json_decoder.decode(self._moves_txt))
+            self._moves_txt = None
+        return self._moves_list
+
+    @_moves.setter
+    def _moves(self, moves):
+        if not isinstance(moves, MoveList):
+            moves = MoveList(moves)
+        self._moves_list = moves
+        self._moves_txt = None
+
+    def read_json(self, txt):
+        seen = {}
+        pos = _skip_whitespace(txt, 0)
+        if txt[pos:pos + 1] != '{':
+            raise ValueError('expected a JSON object')
+        pos = _skip_whitespace(txt, pos + 1)
+        while txt[pos:pos + 1] == '"':
+            key, pos = _json_decoder.raw_decode(txt, pos)
+            pos = _skip_whitespace(txt, pos)
+            if txt[pos:pos + 1] != ':':
+                raise ValueError('expected ":" at %d' % pos)
+            pos = _skip_whitespace(txt, pos + 1)
+            if (key == 'moves' and 'players' in seen and
+                    'metadata' in seen):
+                # The last key: keep its text to decode later.
+                end = txt.rstrip().rfind('}')
+                self._moves_txt = txt[pos:end]
                 break
-        for n in range(N):
-            for i in range(nplayers):
-                turns = turn_scores[i]
-                if n < len(turns):
-                    player = self._players[i]
-                    if n == 0:
-                        score = turns[n]
-                    else:
-                        score = turns[n] - turns[n - 1]
-                    if score:
-                        move_type = 'regular play'
-                    else:
-                        move_type = 'tile exchange'
-                    if n == len(turns) - 1 and last_rack_penalty:
-                        if player == last_rack_penalty:
-                            move_type = 'last rack penalty'
-                        else:
-                            move_type = 'last rack bonus'
-                    self._moves.append({
-                         'player': player,
-                         'rack': None,
-                         'word': None,
-                         'start': None,
-                         'coords': None,
-                         'coordinates': None,
-                         'direction': None,
-                         'score': score,
-                         'move_type': move_type,
-                         'board_changed': False})
-                
+            seen[key], pos = _json_decoder.raw_decode(txt, pos)
+            pos = _skip_whitespace(txt, pos)
+            if txt[pos:pos + 1] == ',':
+                pos = _skip_whitespace(txt, pos + 1)
+        else:
+            self._moves = seen['moves']
+        self._players = seen['players']
+        self._metadata = seen['metadata']
+
+    def iter_moves(self):
+        '''Yield the moves one at a time, decoding each as it is reached.'''
+        if self._moves_txt is None:
+            for move in self._moves:
+                yield move
+            return
+        txt = self._moves_txt
+        pos = _skip_whitespace(txt, 0)
+        if txt[pos:pos + 1] != '[':
+            raise ValueError('expected a JSON list of moves')
+        pos = _skip_whitespace(txt, pos + 1)
+        while txt[pos:pos + 1] not in (']', ''):
+            move, pos = _json_decoder.raw_decode(txt, pos)
+            yield as_move(move)
+            pos = _skip_whitespace(txt, pos)
+            if txt[pos:pos + 1] == ',':
+                pos = _skip_whitespace(txt, pos + 1)
+
+
+class GCGReader(object):
+    '''Streaming parser for one or more concatenated .GCG files.
+
+    *lines* can be a string, a file object or any other iterable of lines.
+    Iterating over the reader yields a Game for each game in the input, as
+    soon as it is finished, so that archives of many games can be read in
+    constant memory. A new game starts whenever one of the pragmas in
+    *game_start_pragmas* follows a move.
+
+    If *skip_errors* is true, a game with a line that can't be parsed is
+    yielded as a ParseError instead of a Game, and reading carries on with
+    the next game. Otherwise the ParseError is raised.
+
+    Attributes:
+        - *counters*: running totals of games, lines and moves read and of
+          the seconds spent parsing them.
+        - *last_game*: the same counters for the most recently yielded game.
+    '''
+    game_start_pragmas = ('#character-encoding', '#player', '#title', '#id')
+
+    def __init__(self, lines, tile_bonuses=str(scrabble_board),
+                 skip_errors=False):
+        self._lines = lines
+        self.tile_bonuses = tile_bonuses
+        self.skip_errors = skip_errors
+        self.counters = {'games': 0, 'lines': 0, 'moves': 0, 'seconds': 0.}
+        self.last_game = {}
+
+    def __iter__(self):
+        g = None
+        error = None
+        in_description = False
+        for lineno, line in enumerate(iter_lines(self._lines), 1):
+            line = line.strip()
+            if line.startswith(self.game_start_pragmas):
+                if g is not None and g._moves:
+                    yield self._finish(g, nlines, t0)
+                    g = None
+                elif error is not None and error_in_moves:
+                    yield error
+                    error = None
+            if error is not None:
+                # Skip the rest of a game that couldn't be parsed.
+                error_in_moves = error_in_moves or line.startswith('>')
+                continue
+            if g is None:
+                if not line:
+                    continue
+                g = Game(tile_bonuses=self.tile_bonuses)
+                in_description = False
+                nlines = 0
+                t0 = time.time()
+            nlines += 1
+            try:
+                in_description = g._read_gcg_line(line, in_description)
+            except Exception as e:
+                error = ParseError('%s in %r' % (e, line), lineno)
+                if not self.skip_errors:
+                    raise error
+                error_in_moves = bool(g._moves) or line.startswith('>')
+                g = None
+        if g is not None:
+            yield self._finish(g, nlines, t0)
+        elif error is not None:
+            yield error
+
+    def _finish(self, g, nlines, t0):
+        self.last_game = {'lines': nlines,
+                          'moves': len(g._moves),
+                          'seconds': time.time() - t0}
+        self.counters['games'] += 1
+        for key, value in self.last_game.items():
+            self.counters[key] += value
+        return g
+
+    @property
+    def games_per_second(self):
+        if self.counters['seconds']:
+            return self.counters['games'] / self.counters['seconds']
+        return 0.
+
+    @property
+    def moves_per_second(self):
+        if self.counters['seconds']:
+            return self.counters['moves'] / self.counters['seconds']
+        return 0.
+
+
+
+class NFSHostReader(GCGReader):
+    '''Streaming parser for one or more score sheets in the custom format
+    (see Game.read_nfshost()).
+
+    A new sheet starts at a "played" line, or at a line of scores for a
+    player already on the current sheet. Otherwise as GCGReader: errors
+    are ParseErrors with the line number in the whole input.
+    '''
+    def __iter__(self):
+        sheet = []
+        players = set()
+        for lineno, line in enumerate(iter_lines(self._lines), 1):
+            stripped = line.strip()
+            player = None
+            if '::' in stripped:
+                player = stripped.split('::', 1)[0].replace('*', '').strip()
+            if players and (stripped.startswith('played') or
+                            player in players):
+                yield self._read_sheet(sheet)
+                sheet = []
+                players = set()
+            sheet.append((lineno, stripped))
+            if player is not None:
+                players.add(player)
+        if any(line for lineno, line in sheet):
+            yield self._read_sheet(sheet)
+
+    def _read_sheet(self, sheet):
+        g = Game(tile_bonuses=self.tile_bonuses)
+        t0 = time.time()
+        try:
+            g._read_nfshost_lines(sheet)
+        except ParseError as e:
+            if not self.skip_errors:
+                raise
+            return e
+        return self._finish(g, len(sheet), t0)
+
+
+def iter_import_games(data_object):
+    '''Parse the games of an export JSON style list of {'type', 'data'}
+    dictionaries.
+
+    Yields (index of the dictionary, Game) for each game, or (index,
+    exception) for a game that couldn't be read. A GCG or custom entry may
+    hold many games.
+    '''
+    for i, game_object in enumerate(data_object):
+        try:
+            game_type = game_object['type']
+            data = game_object['data']
+            if game_type == 'GCG':
+                for g in GCGReader(data, skip_errors=True):
+                    yield i, g
+            elif game_type == 'custom':
+                for g in NFSHostReader(data, skip_errors=True):
+                    yield i, g
+            else:
+                yield i, Game(**{game_type + '_txt': data})
+        except Exception as e:
+            yield i, e
+
+
+def iter_lines(txt):
+    '''Iterate over the lines of a string, file object or list of lines.'''
+    if isinstance(txt, string_types):
+        return iter(txt.split('\n'))
+    return iter(txt)
+
+
+_json_decoder = json.JSONDecoder()
+_whitespace_re = re.compile(r'[ \t\n\r]*')
+
+
+def _skip_whitespace(txt, pos):
+    return _whitespace_re.match(txt, pos).end()
+
+
+def serialization_handler(obj):
+    '''Default for json.dumps() of game objects.'''
+    if isinstance(obj, datetime.datetime):
+        return obj.strftime('%Y-%m-%d %H:%M:%S')
+    elif isinstance(obj, Move):
+        return collections.OrderedDict(obj.items())
+    else:
+        return str(obj)
+
+
 def parse_datetime(stamp):
     for fmt in ('%Y-%m-%d %H:%M:%S',
                 '%Y-%m-%d %H:%M',
@@ -209,8 +751,7 @@ def parse_datetime(stamp):
     return None
 
 def parse_gcg_event(line):
-    logging.debug('parsing: ' + line)
-    line = line.strip().strip('\n').strip()
+    '''Parse a move line (one starting with ">") from a .GCG file.'''
     tokens = line.split()
     player_key = None
     rack = None
@@ -224,89 +765,77 @@ def parse_gcg_event(line):
     coords = None
     if len(tokens) >= 1:
         player_key = tokens[0][1:-1]
-    logging.debug('player_key: ' + player_key)
     if len(tokens) >= 6:
         move_type = 'regular play'
         board_changed = True
-        logging.debug(move_type)
-        rack, coords, word, score, total = tokens[1:6]
+        rack, coords, word, score = tokens[1:5]
         coords = coords.lower()
-        if not '~' in coords:
-            logging.debug('coords: ' + coords)
-            if coords[0] in columns:
+        match = _gcg_coords_re.match(coords)
+        if match:
+            column, row, row2, column2 = match.groups()
+            if column:
                 direction = 'vertical'
-                x_adj = 0
-                y_adj = -1
+                x_adj, y_adj = 0, -1
             else:
-                try:
-                    assert coords[-1] in columns
-                except AssertionError:
-                    direction = None
-                else:
-                    direction = 'horizontal'
-                    x_adj = 1
-                    y_adj = 0
-        logging.debug(str(direction))
-        if not direction is None:
-            def get_x(coords):
-                column = re.search('[a-z]', coords).group()
-                return columns.index(column)
-                
-            def get_y(y):
-                row = re.search('[0-9]+', coords).group()
-                return 14 - (int(row) - 1)
-                
-            start = [get_x(coords), get_y(coords)]
-            coordinates = [start]
-            for i in range(1, len(word)):
-                coordinates.append(
-                    (coordinates[-1][0] + x_adj, coordinates[-1][1] + y_adj))
-                
+                direction = 'horizontal'
+                x_adj, y_adj = 1, 0
+                column, row = column2, row2
+            x = _gcg_columns[column]
+            y = _gcg_rows.get(row)
+            if y is None:
+                y = 15 - int(row)
+            start = [x, y]
+            coordinates = [start] + [(x + i * x_adj, y + i * y_adj)
+                                     for i in range(1, len(word))]
     elif len(tokens) == 5:
-        rack, special, score, total = tokens[1:]
-        if special == '--':
-            move_type = 'phoney withdraw'
-            board_changed = True
-            logging.debug(move_type)
-        elif special == '(challenge)':
-            move_type = 'acceptable challenge'
-            logging.debug(move_type)
-        elif special == '(time)':
-            move_type = 'time penalty'
-            logging.debug(move_type)
-        elif special.startswith('(') and special.endswith(')'):
-            move_type = 'last rack penalty'
-            logging.debug(move_type)
-        elif special == '-':
-            move_type = 'pass'
-            logging.debug(move_type)
-        elif special.startswith('-'):
-            move_type = 'tile exchange'
-            logging.debug(move_type)
+        rack, special, score = tokens[1:4]
+        move_type, board_changed = _gcg_specials.get(special, (None, False))
+        if move_type is None:
+            if special.startswith('(') and special.endswith(')'):
+                move_type = 'last rack penalty'
+            elif special.startswith('-'):
+                move_type = 'tile exchange'
     elif len(tokens) == 4:
         move_type = 'last rack bonus'
-        logging.debug(move_type)
-        rack, score, total = tokens[1:]
+        rack, score = tokens[1:3]
     else:
         move_type = 'unspecified'
-    if '~' in str(rack):
+    if rack is not None and '~' in rack:
         rack = None
-    if '~' in str(word):
+    if word is not None and '~' in word:
         word = None
-    if '~' in str(score):
+    if score is not None and '~' in score:
         score = 0
-    return {'player': player_key,
-            'rack': rack,
-            'word': word,
-            'start': start,
-            'coords': coords,
-            'coordinates': coordinates,
-            'direction': direction,
-            'score': int(score),
-            'move_type': move_type,
-            'board_changed': board_changed}
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('parsed %r as %s by %s', line, move_type, player_key)
+    return Move(player=player_key, rack=rack, word=word, start=start,
+                coords=coords, coordinates=coordinates, direction=direction,
+                score=int(score), move_type=move_type,
+                board_changed=board_changed)
+
+
+def get_gcg_event(move, total):
+    '''Return the .GCG line for *move*, the inverse of parse_gcg_event().'''
+    rack = move['rack'] or '~'
+    move_type = move['move_type']
+    if move_type == 'regular play':
+        coords = '~'
+        if move['coords'] and move['direction']:
+            coords = move['coords'].upper()
+        event = '%s %s' % (coords, move['word'] or '~')
+    elif move_type == 'last rack bonus':
+        return '>%s: %s %+d %d' % (move['player'], rack, move['score'],
+                                   total)
+    elif move_type == 'tile exchange':
+        event = '-~'
+    elif move_type == 'last rack penalty':
+        event = '(%s)' % rack
+    else:
+        event = _gcg_special_events.get(move_type, '~')
+    return '>%s: %s %s %+d %d' % (move['player'], rack, event, move['score'],
+                                  total)
+
 
-                    
 def remove_substr(s, substr):
     return s.replace(substr, '').strip('\n').strip().strip('\n')
 
@@ -322,27 +851,29 @@ def get_blank_board(size):
     return rows
 
     
+_ascii_head = ['   ABCDEFGHIJKLMNO ', '  +---------------+']
+_ascii_foot = _ascii_head[::-1]
+_ascii_left = [str(n).rjust(2) + '|' for n in range(1, 16)]
+_ascii_right = ['|' + str(n).ljust(2) for n in range(1, 16)]
+
+
 def get_ascii_board(board, labels=True):
-    left = lambda n: str(n).rjust(2) + '|'
-    right = lambda n: '|' + str(n).ljust(2)
+    '''Return a board as text. See render.py for boards with bonus
+    squares.'''
     letters = [''.join(row) for row in board[::-1]]
     if labels:
-        letters = (
-            ['   ABCDEFGHIJKLMNO ',
-             '  +---------------+'] +
-            [left(n) + r + right(n) for n, r in zip(range(1, 16), letters)] +
-            ['  +---------------+',
-             '   ABCDEFGHIJKLMNO '])
+        letters = (_ascii_head +
+                   [l + r + rr for l, r, rr in zip(_ascii_left, letters,
+                                                  _ascii_right)] +
+                   _ascii_foot)
     return '\n'.join(letters)
 
 
 def get_html_table_board(board):
-    out = '<table class=\'scrabble-board\'>\n'
-    for row in board[::-1]:
-        out += '\t<tr>\n\t\t'
-        for letter in row:
-            out += '<td>%s</td>' % letter
-        out += '\n\t</tr>\n'
-    out += '</table>'
-    return out
+    '''Return a board as an HTML table. See render.py for boards with bonus
+    squares.'''
+    rows = ['\t<tr>\n\t\t%s\n\t</tr>\n' %
+            ''.join(['<td>%s</td>' % letter for letter in row])
+            for row in board[::-1]]
+    return '<table class=\'scrabble-board\'>\n%s</table>' % ''.join(rows)
                 
@@ -3,6 +3,7 @@ Crossword Game Stats Google App Engine handlers and models.
 '''
 
 import datetime
+import gzip
 import json
 import logging
 import os
@@ -11,8 +12,11 @@ try:
 except ImportError:
     import pickle
 import string
+import StringIO
 import sys
 import traceback
+import urllib
+import zipfile
 
 import jinja2
 from google.appengine.api import images
@@ -22,10 +26,24 @@ from google.appengine.ext import db
 from google.appengine.ext.webapp import blobstore_handlers
 import webapp2
 
+import cache
 import gae
 import game
+import importer
+import openings
+import profiling
+import render
+import scoring
+import search
+import stats
+import tasks
 
 
+# game.py logs every move it parses at DEBUG, which App Engine would
+# otherwise format and keep for every request.
+logging.getLogger('game').setLevel(logging.INFO)
+profiling.install_hooks()
+
 path = os.path.join(os.path.dirname(__file__), 'html')
 jinja_environment = jinja2.Environment(
         loader=jinja2.FileSystemLoader(path))
@@ -44,6 +62,33 @@ class RequestHandler(webapp2.RequestHandler):
 
     def log(self, msg):
         self.debug += '\n' + str(msg)
+        logging.debug(msg)
+
+    def dispatch(self):
+        '''Handle the request inside profiling.profile_request(), with
+        cProfile if an admin asked for it.'''
+        route = getattr(self.request.route, 'template', self.request.path)
+        run_profiler = bool(self.request.get(profiling.profile_arg) and
+                            users.is_current_user_admin())
+        with profiling.profile_request(route, run_profiler):
+            webapp2.RequestHandler.dispatch(self)
+
+    def get_pager(self, next_cursor, sort=None, sorts=False, **params):
+        '''Return links to the next page and to other sort orders of a
+        paged game list.'''
+        path = self.request.path
+        params = dict((k, v) for k, v in params.items() if v)
+        pager = JinjaBunch(sort=sort, next_url=None, sort_urls=[])
+        if next_cursor:
+            pager.next_url = path + '?' + urllib.urlencode(
+                    dict(params, sort=sort or '', cursor=next_cursor))
+        if sorts:
+            for name, label in sort_labels:
+                pager.sort_urls.append(JinjaBunch(
+                        label=label, current=(name == sort),
+                        url=path + '?' + urllib.urlencode(
+                            dict(params, sort=name))))
+        return pager
 
     def finish_render(self, template_name, **kwargs):
         self.response.headers['Context-Type'] = 'text/html'
@@ -57,8 +102,24 @@ class RequestHandler(webapp2.RequestHandler):
                     'logout_url': users.create_logout_url('/')
                     })
         template_values.update(kwargs)
-        template = jinja_environment.get_template(template_name)
-        self.response.out.write(template.render(template_values))
+        with profiling.timed('render'):
+            template = jinja_environment.get_template(template_name)
+            html = template.render(template_values)
+        self.response.out.write(html)
+
+    def render_fragment(self, template_name, **kwargs):
+        '''Return a template rendered on its own, for caching.'''
+        with profiling.timed('render'):
+            return jinja_environment.get_template(template_name).render(
+                    kwargs)
+
+
+sort_labels = [('date_played', 'Date played'),
+               ('date_played_asc', 'Date played (oldest first)'),
+               ('margin', 'Margin'),
+               ('margin_asc', 'Margin (smallest first)'),
+               ('total_score', 'Total score'),
+               ('total_score_asc', 'Total score (lowest first)')]
 
 
 class SignIn(RequestHandler):
@@ -76,45 +137,149 @@ class Home(RequestHandler):
     '''Handler for the main page.'''
     def get(self):
         user = users.get_current_user()
-        q = gae.GAEGame.all()
-        q.filter('uploader_id =', user.user_id())
-        q.filter('trashed = ', False)
-        games = q.run(batch_size=1000)
-        games2 = []
-        for game in games:
-            if 'pip' in game.players:
-                games2.append(game)
-        #self.log(str(type(games)).replace('>', '&gt;').replace('<', '&lt;'))
-        self.finish_render('index.html', title='List of games', games=games2,
+        filters = [('trashed =', False)]
+        sort = self.request.get('sort', gae.default_sort)
+        player = self.request.get('player')
+        if player:
+            # Only the default order has an index with a player filter.
+            filters.append(('players =', player))
+            sort = gae.default_sort
+        summary = gae.UserSummary.get_for_user(user.user_id())
+        tasks.start_refresh_if_needed(user.user_id(), summary)
+        cursor = self.request.get('cursor')
+
+        def render():
+            games, next_cursor = gae.GAEGame.get_page(
+                    user.user_id(), filters, sort, cursor)
+            pager = self.get_pager(next_cursor, sort, sorts=not player,
+                                   player=player)
+            return self.render_fragment('game-list.html', games=games,
+                                        pager=pager)
+
+        render_cache = cache.get_render_cache()
+        game_list = render_cache.get_or_render(
+                render_cache.user_key(user.user_id(), 'home', sort, player,
+                                      cursor),
+                render)
+        self.finish_render('index.html', title='List of games',
+                           game_list=game_list, summary=summary,
                            trash_or_delete='Move to Trash')
 
 
 class ExportJSON(RequestHandler):
-    '''Export games as JSON'''
+    '''Export games as JSON.
+
+    Request arguments:
+        - *format*: 'json' (default) for the export JSON format that Import
+          reads, 'ndjson' for one game JSON object per line, or 'gcg_zip'
+          for a zip file of .GCG files.
+        - *gzip*: if set, the JSON or NDJSON is gzip compressed.
+        - *limit*: the most games to export (default export_limit).
+        - *cursor*: carry on from an earlier export. When there are more
+          games to export, the X-Export-Cursor response header has the
+          cursor for the next chunk.
+    '''
+    batch_size = 200
+    export_limit = 5000
+
     def get(self):
         user = users.get_current_user()
+        format = self.request.get('format', 'json')
+        self.next_cursor = None
+        try:
+            limit = int(self.request.get('limit', self.export_limit))
+        except ValueError:
+            limit = self.export_limit
+        games = self.iter_games(user.user_id(), self.request.get('cursor'),
+                                limit)
+        headers = self.response.headers
+        if format == 'gcg_zip':
+            headers['Content-Type'] = 'application/zip'
+            headers['Content-Disposition'] = 'attachment; filename=games.zip'
+            self.write_gcg_zip(games)
+        else:
+            out = self.response.out
+            if format == 'ndjson':
+                headers['Content-Type'] = 'application/x-ndjson'
+                filename = 'games.ndjson'
+            else:
+                headers['Content-Type'] = 'application/json'
+                filename = 'games.json'
+            if self.request.get('gzip'):
+                headers['Content-Type'] = 'application/gzip'
+                filename += '.gz'
+                out = gzip.GzipFile(filename=filename[:-3], mode='wb',
+                                    fileobj=out)
+            headers['Content-Disposition'] = 'attachment; filename=' + filename
+            if format == 'ndjson':
+                self.write_ndjson(games, out)
+            else:
+                self.write_json(games, out)
+            if out is not self.response.out:
+                out.close()
+        if self.next_cursor:
+            headers['X-Export-Cursor'] = self.next_cursor
+
+    def iter_games(self, user_id, cursor, limit):
+        '''Yield up to *limit* games, fetching batch_size at a time.
+
+        Sets self.next_cursor if there are more games to export.
+        '''
+        self.next_cursor = None
         q = gae.GAEGame.all()
-        q.filter('uploader_id =', user.user_id())
+        q.filter('uploader_id =', user_id)
         q.filter('trashed =', False)
-        games = q.run(batch_size=1000)
-        data = []
+        count = 0
+        while count < limit:
+            if cursor:
+                q.with_cursor(cursor)
+            n = min(self.batch_size, limit - count)
+            games = q.fetch(n)
+            for game in games:
+                yield game
+            count += len(games)
+            cursor = q.cursor()
+            if len(games) < n:
+                return
+        self.next_cursor = cursor
+
+    def write_json(self, games, out):
+        out.write('[')
+        separator = '\n'
+        for game in games:
+            out.write(separator + json.dumps({'type': 'single_game_JSON',
+                                              'data': game.json_serialisation}))
+            separator = ',\n'
+        out.write('\n]\n')
 
-        def escape(string, chars='[]{}'):
-            for char in chars:
-                string = string.replace(char, chr(92) + char)
-            return string
+    def write_ndjson(self, games, out):
+        # The stored JSON never has line breaks, so it can be written as is.
+        for game in games:
+            out.write(game.json_serialisation + '\n')
 
+    def write_gcg_zip(self, games):
+        buf = StringIO.StringIO()
+        zf = zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED)
         for game in games:
-            gdata = {'type': 'single_game_JSON',
-                     'data': game.json_serialisation}
-            data.append(gdata)
-        self.response.headers['Context-Type'] = 'text/html'
-        self.response.out.write(json.dumps(data, indent=2))
+            date = 'undated'
+            if game.date_played:
+                date = game.date_played.strftime('%Y-%m-%d')
+            name = '%s_%s_%s.gcg' % (date, '_'.join(game.players), game.key())
+            zf.writestr(name.encode('ascii', 'replace'),
+                        game.get_game().gcg.encode('utf-8'))
+        zf.close()
+        self.response.out.write(buf.getvalue())
 
 
 class Move(JinjaBunch):
     @property
     def _t_bonuses(self):
+        return ', '.join(self.get('bonuses', []))
+
+    @property
+    def _t_score_check(self):
+        if self.get('mismatch'):
+            return 'scores %d from the board' % self['computed_score']
         return ''
 
     @property
@@ -142,13 +307,55 @@ class ShowGame(RequestHandler):
             else:
                 title = 'Game'
 
-            moves = []
-            for i, move in enumerate(g._moves):
-                m = Move(move_number=i, **move)
-                m.total_score = sum([mi['score'] for mi in g._moves[:i + 1] if mi['player'] == move['player']])
-                moves.append(m)
-
-            self.finish_render('game.html', title=title, moves=moves)
+            def render():
+                moves = []
+                scores = scoring.score_game(g)
+                running_totals = gae_game.get_stats().running_totals
+                for i, move in enumerate(g._moves):
+                    m = Move(move_number=i, bonuses=scores[i]['bonuses'],
+                             computed_score=scores[i]['score'],
+                             mismatch=scores[i]['mismatch'], **move)
+                    m.total_score = running_totals[i]
+                    moves.append(m)
+                return self.render_fragment(
+                        'game-moves.html', moves=moves, key=gae_game.key(),
+                        board=render.render_final_board(g))
+
+            render_cache = cache.get_render_cache()
+            moves_html = render_cache.get_or_render(
+                    render_cache.make_key('game', gae_game.key(),
+                                          gae_game.date_modified),
+                    render)
+            self.finish_render('game.html', title=title,
+                               moves_html=moves_html)
+
+
+class GameReplay(RequestHandler):
+    '''The board replay of a game as JSON (see render.get_replay_data()),
+    for the board on the game page.
+
+    The ETag changes with the game's date_modified, so browsers fetch each
+    game once and then get 304 Not Modified.
+    '''
+    def get(self):
+        user = users.get_current_user()
+        key = self.request.get('key')
+        gae_game = db.get(key)
+        if gae_game is None or gae_game.uploader_id != user.user_id():
+            self.error(404)
+            return
+        etag = '"%s"' % stats.json_hash('%s %s %s' % (
+                key, gae_game.date_modified,
+                os.environ.get('CURRENT_VERSION_ID', '')))
+        self.response.headers['ETag'] = etag
+        self.response.headers['Cache-Control'] = 'private, no-cache'
+        if etag in self.request.headers.get('If-None-Match', ''):
+            self.response.set_status(304)
+            return
+        data = render.get_replay_data(gae_game.get_game(),
+                                      gae_game.get_stats().running_totals)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json.dumps(data, separators=(',', ':')))
 
 
 class Import(RequestHandler):
@@ -156,26 +363,16 @@ class Import(RequestHandler):
         user = users.get_current_user()
         if 'import_batch' in self.request.arguments():
             import_batch = self.request.get('import_batch')
-            q = gae.GAEGame.all()
-            q.filter('uploader_id = ', user.user_id())
-            q.filter('import_batch = ', import_batch)
-            games = q.run(batch_size=1000)
+            games, next_cursor = gae.GAEGame.get_page(
+                    user.user_id(), [('import_batch =', import_batch)],
+                    cursor=self.request.get('cursor'))
+            pager = self.get_pager(next_cursor, import_batch=import_batch)
             self.finish_render('index.html', title='Imported at %s' % import_batch,
-                               games=games)
+                               games=games, pager=pager)
         else:
-            import_batches = {}
-            q = gae.GAEGame.all()
-            q.filter('uploader_id = ', user.user_id())
-            games = q.run(batch_size=1000)
-            for gae_game in games:
-                ib = gae_game.import_batch
-                if ib not in import_batches:
-                    import_batches[ib] = 1
-                else:
-                    import_batches[ib] += 1
-
+            summary = gae.UserSummary.get_for_user(user.user_id())
             ib_jinja = []
-            for dt, count in import_batches.items():
+            for dt, count in sorted(summary.import_batches.items()):
                 ib_jinja.append(JinjaBunch(dt=dt, count=count))
             self.finish_render('import.html', title='Import game', import_batches=ib_jinja)
                 
@@ -188,39 +385,45 @@ class Import(RequestHandler):
         format = self.request.get('format')
         text = self.request.get('text')
 
-        if format != 'export_JSON':
-            text = json.dumps([{'type': format, 'data': text}])
-
-        try:
-            data_object = json.loads(text)
-            for i, game_object in enumerate(data_object):
-                try:
-                    g = game.Game(**{game_object['type'] + '_txt': game_object['data']})
-                    gae_game = gae.GAEGame(uploader_id=user.user_id(), import_batch=import_batch)
-                    gae_game.set_game(g)
-                except:
-                    exc_type, exc_value, exc_traceback = sys.exc_info()
-                    # self.log('Error importing game: \n%s' % ''.join(traceback.format_tb(exc_traceback)))
-                    self.log('Error importing game #%d' % i)
-                else:
-                    gae_game.put()
-            q = gae.GAEGame.all()
-            q.filter('uploader_id =', user.user_id())
-            q.filter('import_batch = ', import_batch)
-            games = q.run(batch_size=1000)
-            self.finish_render('index.html', title='Finished importing games', games=games)
-        except:
-            self.finish_render('index.html', title='Error importing games', debug=''.join(traceback.format_tb(exc_traceback)))
+        if format == 'export_JSON':
+            try:
+                data_object = json.loads(text)
+            except ValueError as e:
+                self.finish_render('index.html', title='Error importing games',
+                                   debug='Export JSON could not be read: %s' % e)
+                return
+        elif format == 'export_NDJSON':
+            data_object = [{'type': 'single_game_JSON', 'data': line}
+                           for line in text.splitlines() if line.strip()]
+        else:
+            data_object = [{'type': format, 'data': text}]
+
+        results, imported = importer.import_games(
+                data_object, user.user_id(), import_batch,
+                duplicates=self.request.get('duplicates', 'skip'))
+        if imported:
+            gae.update_user_summary(user.user_id(), 'add', imported)
+            cache.get_render_cache().invalidate_user(user.user_id())
+        counts = JinjaBunch(ok=0, error=0, duplicate=0)
+        for result in results:
+            counts[result['status']] += 1
+        problems = [r for r in results if r['status'] != 'ok']
+        self.finish_render('index.html', title='Finished importing games',
+                           games=imported, import_counts=counts,
+                           import_problems=problems)
 
 
 class Trash(RequestHandler):
     def get(self):
         user = users.get_current_user()
-        q = gae.GAEGame.all()
-        q.filter('uploader_id =', user.user_id())
-        q.filter('trashed =', True)
-        games = q.run(batch_size=1000)
-        self.finish_render('trash.html', title='Trash', games=games)
+        sort = self.request.get('sort', gae.default_sort)
+        games, next_cursor = gae.GAEGame.get_page(
+                user.user_id(), [('trashed =', True)], sort,
+                self.request.get('cursor'))
+        pager = self.get_pager(next_cursor, sort, sorts=True)
+        summary = gae.UserSummary.get_for_user(user.user_id())
+        self.finish_render('trash.html', title='Trash', games=games,
+                           summary=summary, pager=pager)
 
         
 class MoveToTrash(RequestHandler):
@@ -228,8 +431,14 @@ class MoveToTrash(RequestHandler):
         user = users.get_current_user()
         key = self.request.get('key')
         gae_game = db.get(key)
-        gae_game.trashed = True
-        gae_game.put()
+        if gae_game is None or gae_game.uploader_id != user.user_id():
+            self.error(404)
+            return
+        if not gae_game.trashed:
+            gae_game.trashed = True
+            gae_game.put()
+            gae.update_user_summary(user.user_id(), 'trash', [gae_game])
+            cache.get_render_cache().invalidate_user(user.user_id())
         self.redirect('/app')
  
  
@@ -238,7 +447,13 @@ class Delete(RequestHandler):
         user = users.get_current_user()
         key = self.request.get('key')
         gae_game = db.get(key)
+        if gae_game is None or gae_game.uploader_id != user.user_id():
+            self.error(404)
+            return
         db.delete(key)
+        gae.remove_fingerprint(gae_game)
+        gae.update_user_summary(user.user_id(), 'remove', [gae_game])
+        cache.get_render_cache().invalidate_user(user.user_id())
         self.redirect('/app')
 
 
@@ -247,26 +462,96 @@ class Restore(RequestHandler):
         user = users.get_current_user()
         key = self.request.get('key')
         gae_game = db.get(key)
-        gae_game.trashed = False
-        gae_game.put()
+        if gae_game is None or gae_game.uploader_id != user.user_id():
+            self.error(404)
+            return
+        if gae_game.trashed:
+            gae_game.trashed = False
+            gae_game.put()
+            gae.update_user_summary(user.user_id(), 'restore', [gae_game])
+            cache.get_render_cache().invalidate_user(user.user_id())
         self.redirect('/app/trash')
 
 
 class RefreshAllGames(RequestHandler):
+    '''Start reprocessing all of the user's games in the background.'''
     def get(self):
         user = users.get_current_user()
-        q = gae.GAEGame.all()
-        q.filter('uploader_id =', user.user_id())
-        games = q.run(batch_size=1000)
-        for gae_game in games:
-            g = gae_game.get_game()
-            gae_game.delete()
-            
-            gae_game_new = gae.GAEGame(uploader_id=user.user_id())
-            gae_game_new.set_game(g)
-            gae_game_new.put()
-            
-        self.redirect('/')
+        job = tasks.start_refresh(user.user_id())
+        self.redirect('/app/refresh/status?key=%s' % job.key())
+
+
+class RefreshStatus(RequestHandler):
+    def get(self):
+        user = users.get_current_user()
+        job = db.get(self.request.get('key'))
+        if job is None or job.uploader_id != user.user_id():
+            self.redirect('/app')
+        else:
+            self.finish_render('refresh.html', title='Refreshing games',
+                               job=job)
+
+
+class RunTask(RequestHandler):
+    '''Runs tasks POSTed by the task queue (see tasks.py).'''
+    def post(self):
+        params = dict((arg, self.request.get(arg))
+                      for arg in self.request.arguments() if arg != 'task')
+        tasks.run_task(self.request.get('task'), params, tasks.queue)
+
+
+class Search(RequestHandler):
+    '''Find moves by word, letter, square, bonus and move type (see
+    search.py for the query terms).'''
+    max_games = 100
+
+    def get(self):
+        user = users.get_current_user()
+        query = self.request.get('q').strip()
+        results = []
+        more = False
+        if query:
+            found, more = gae.search_games(user.user_id(),
+                                           search.parse_query(query),
+                                           self.max_games)
+            for gae_game, moves in found:
+                results.append(JinjaBunch(
+                        game=gae_game,
+                        moves=', '.join(str(m) for m in moves)))
+        self.finish_render('search.html', title='Search', query=query,
+                           results=results, more=more)
+
+
+class Openings(RequestHandler):
+    '''Explore the opening plays of the user's games (see openings.py).
+
+    Request arguments:
+        - *position*: a position hash from openings.position_key(); the
+          empty board by default.
+    '''
+    max_games = 100
+
+    def get(self):
+        user = users.get_current_user()
+        try:
+            position = int(self.request.get('position', '0'), 16)
+        except ValueError:
+            position = 0
+        tree = gae.get_opening_tree(user.user_id())
+        plays = []
+        for play in tree.next_plays(position):
+            plays.append(JinjaBunch(
+                    url='/app/openings?position=%s' % openings.position_key(
+                        play['position']),
+                    **play))
+        games = []
+        if position:
+            games = gae.find_position_games(user.user_id(), position,
+                                            self.max_games)
+        self.finish_render('openings.html', title='Openings',
+                           position=position,
+                           count=tree.positions.get(position, 0),
+                           plays=plays, games=games)
 
 
 class Settings(RequestHandler):
@@ -281,6 +566,42 @@ class Settings(RequestHandler):
         self.redirect('/app')
 
 
+class Profiling(RequestHandler):
+    '''Admin page with the p50 and p95 timings of each route on this
+    instance, the latest cProfile results (see profiling.py) and the hits
+    and misses of the render cache.'''
+    def get(self):
+        routes = []
+        for summary in profiling.get_route_summaries():
+            route = JinjaBunch(route=summary['route'],
+                               count=summary['count'],
+                               samples=summary['samples'], timings=[])
+            for category in profiling.categories + ('entities',):
+                route.timings.append(JinjaBunch(
+                        p50=summary['p50'][category],
+                        p95=summary['p95'][category]))
+            routes.append(route)
+        self.finish_render('profiling.html', title='Profiling',
+                           routes=routes,
+                           render_cache=cache.get_render_cache(),
+                           categories=profiling.categories,
+                           profiles=profiling.get_profiles(),
+                           sample_rate=profiling.sample_rate,
+                           profile_arg=profiling.profile_arg)
+
+    def post(self):
+        if self.request.get('reset'):
+            profiling.reset()
+            render_cache = cache.get_render_cache()
+            render_cache.hits = render_cache.misses = 0
+        try:
+            sample_rate = float(self.request.get('sample_rate', 0))
+        except ValueError:
+            sample_rate = 0.
+        profiling.sample_rate = min(max(sample_rate, 0.), 1.)
+        self.redirect('/app/admin/profiling')
+
+
 class Photos(RequestHandler):
     def get(self):
         user = users.get_current_user()
@@ -321,6 +642,7 @@ app = webapp2.WSGIApplication(
         [('/', SignIn),
          ('/app', Home),
          ('/app/game', ShowGame),
+         ('/app/game/replay', GameReplay),
          ('/app/import', Import),
          ('/app/export/json', ExportJSON),
          ('/app/trash', Trash),
@@ -328,7 +650,12 @@ app = webapp2.WSGIApplication(
          ('/app/delete', Delete),
          ('/app/restore', Restore),
          ('/app/refresh', RefreshAllGames),
+         ('/app/refresh/status', RefreshStatus),
+         (tasks.task_url, RunTask),
+         ('/app/search', Search),
+         ('/app/openings', Openings),
          ('/app/settings', Settings),
+         ('/app/admin/profiling', Profiling),
          ('/app/photos', Photos),
          ('/app/photos/add', AddPhoto),
          ('/app/photos/upload', PhotoUploadHandler)
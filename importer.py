@@ -0,0 +1,109 @@
+'''
+Crossword Game Stats import pipeline.
+'''
+
+from google.appengine.ext import db
+
+import gae
+import game
+
+
+put_batch_size = 200
+
+
+def validate(g):
+    '''Return a description of what is wrong with Game *g*, or None.'''
+    if not g._players:
+        return 'no players'
+    if not g._moves:
+        return 'no moves'
+    for i, move in enumerate(g._moves):
+        if not move['player'] in g._players:
+            return 'move %d is by unknown player %r' % (i, move['player'])
+    return None
+
+
+def import_games(data_object, uploader_id, import_batch, duplicates='skip'):
+    '''Parse, check and store the games in *data_object*.
+
+    Entities are written with asynchronous batched puts of put_batch_size
+    games while parsing carries on. Each batch is first checked against
+    the user's stored games with one lookup of their fingerprints (see
+    stats.fingerprint()). A game already stored is skipped if
+    *duplicates* is 'skip', or stored with the key of the earlier game in
+    its duplicate_game_keys if it is 'link'. A game repeated within
+    *data_object* is always skipped.
+
+    Returns (results, entities): a result dictionary for each game read
+    and the GAEGame entities stored. Each result has the game's 'number',
+    the 'source' index in *data_object*, a 'status' ('ok', 'error' or
+    'duplicate'), a 'message', the 'line' of a parse error and the stored
+    'game'.
+    '''
+    results = []
+    entities = []
+    batch = []
+    rpcs = []
+    seen = {}
+
+    def flush():
+        stored = gae.find_duplicates(
+                uploader_id, [r['game'].fingerprint for r in batch])
+        to_put = []
+        for result in batch:
+            game_key = stored.get(result['game'].fingerprint)
+            if game_key is None:
+                to_put.append(result)
+            elif duplicates == 'link':
+                result['game'].duplicate_game_keys = [game_key]
+                result['message'] = 'linked to the game already stored'
+                to_put.append(result)
+            else:
+                result.update(status='duplicate', game=None,
+                              message='already stored')
+        if to_put:
+            rpcs.append((db.put_async([r['game'] for r in to_put]), to_put))
+        del batch[:]
+
+    games = game.iter_import_games(data_object)
+    for number, (source, g) in enumerate(games, 1):
+        result = {'number': number, 'source': source, 'status': 'ok',
+                  'message': '', 'line': None, 'game': None}
+        results.append(result)
+        if isinstance(g, Exception):
+            result.update(status='error', message=getattr(g, 'msg', str(g)),
+                          line=getattr(g, 'lineno', None))
+            continue
+        problem = validate(g)
+        if problem:
+            result.update(status='error', message=problem)
+            continue
+        try:
+            gae_game = gae.GAEGame(uploader_id=uploader_id,
+                                   import_batch=import_batch)
+            gae_game.set_game(g)
+        except Exception as e:
+            result.update(status='error', message=str(e))
+            continue
+        if gae_game.fingerprint in seen:
+            result.update(status='duplicate', message='same as game %d' %
+                          seen[gae_game.fingerprint])
+            continue
+        seen[gae_game.fingerprint] = number
+        result['game'] = gae_game
+        batch.append(result)
+        if len(batch) >= put_batch_size:
+            flush()
+    if batch:
+        flush()
+    for rpc, batch_results in rpcs:
+        try:
+            rpc.get_result()
+        except Exception as e:
+            for result in batch_results:
+                result.update(status='error', game=None,
+                              message='not saved: %s' % e)
+        else:
+            entities.extend(result['game'] for result in batch_results)
+    gae.index_fingerprints(entities)
+    return results, entities
@@ -1,4 +1,53 @@
 // Hides mobile browser's address bar when page is done loading.
 window.addEventListener('load', function(e) {
     setTimeout(function() { window.scrollTo(0, 1); }, 1);
-}, false);
\ No newline at end of file
+}, false);
+
+// Move-by-move board replay on the game page. The page has the board at
+// the end of the game; the moves come from /app/game/replay (see
+// render.get_replay_data) and are replayed on the table's squares.
+$(document).ready(function() {
+    var container = $('#board-replay');
+    if (!container.length) {
+        return;
+    }
+    $.getJSON(container.data('url'), function(replay) {
+        var squares = container.find('td');
+        var moves = replay.moves;
+        var current = moves.length - 1;
+        function show(n) {
+            current = Math.max(-1, Math.min(moves.length - 1, n));
+            squares.text('');
+            for (var i = 0; i <= current; i++) {
+                $.each(moves[i].tiles, function(j, tile) {
+                    squares.eq(tile[0] * replay.size + tile[1]).text(tile[2]);
+                });
+            }
+            var label = 'Start';
+            if (current >= 0) {
+                var move = moves[current];
+                label = 'Move ' + current + ': ' + move.player + ' ' +
+                    move.score + ' (' + move.total + ')';
+            }
+            container.find('.replay-move').text(label);
+            $('#data tbody tr').removeClass('replay-current')
+                .filter('[data-move=' + current + ']')
+                .addClass('replay-current');
+        }
+        container.find('.replay-prev').css('visibility', 'visible')
+            .click(function(e) {
+                e.preventDefault();
+                show(current - 1);
+            });
+        container.find('.replay-next').css('visibility', 'visible')
+            .click(function(e) {
+                e.preventDefault();
+                show(current + 1);
+            });
+        // Clicking a move shows the board as it was after that move.
+        $('#data').on('click', 'tbody tr', function() {
+            show($(this).data('move'));
+        });
+        show(current);
+    });
+});
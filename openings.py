@@ -0,0 +1,154 @@
+'''
+Crossword Game Stats opening trees, from the board position hashes of
+board.BoardReplay.
+'''
+
+import board
+import stats
+
+
+# Number of plays of each game counted in an opening tree.
+default_depth = 6
+
+
+def position_key(position):
+    '''Return a position hash as the string stored in the datastore.'''
+    return '%016x' % position
+
+
+def get_opening_plays(g, depth=default_depth):
+    '''Return the first *depth* plays of game *g* that stayed on the board.
+
+    Returns a list of (position before, position after, move number).
+    Plays that were withdrawn are left out, and the replay stops as soon
+    as the first *depth* plays are settled.
+    '''
+    replay = board.BoardReplay()
+    plays = []
+    for i, move in enumerate(g._moves):
+        before = replay.hash
+        replay.append(move)
+        if replay.hash == before:
+            continue
+        if move['move_type'] == 'phoney withdraw':
+            if plays:
+                plays.pop()
+        else:
+            plays.append((before, replay.hash, i))
+            if len(plays) > depth:
+                # Only the last play can still be withdrawn.
+                break
+    return plays[:depth]
+
+
+def get_play_label(move):
+    '''Return a short description of a play, such as "8H QUIZ".'''
+    if move['coords']:
+        return '%s %s' % (move['coords'].upper(), move['word'])
+    return move['word'] or ''
+
+
+def get_opening_results(g, game_stats=None, depth=default_depth):
+    '''Return the opening plays of game *g* and how the game turned out for
+    their movers, with its stats.GameStats if they are to hand.
+
+    Returns a list of (position before, position after, play label, move
+    score, final margin of the mover over their best opponent).
+    '''
+    if game_stats is None:
+        game_stats = stats.get_game_stats(g)
+    finals = dict((player, p['score'])
+                  for player, p in game_stats.per_player.items())
+    results = []
+    for before, after, i in get_opening_plays(g, depth):
+        move = g._moves[i]
+        score = finals.get(move['player'], 0)
+        others = [s for player, s in finals.items()
+                  if player != move['player']]
+        margin = score - max(others) if others else 0
+        results.append((before, after, get_play_label(move), move['score'],
+                        margin))
+    return results
+
+
+def encode_play(ply, before, after, label, score, margin):
+    '''Return one of get_opening_results(), the *ply*th play of its game,
+    as a string to store in the datastore.'''
+    return '%d:%016x:%016x:%d:%d:%s' % (ply, before, after, score, margin,
+                                        label)
+
+
+def decode_play(txt):
+    '''Return (ply, before, after, label, score, margin) from
+    encode_play().'''
+    ply, before, after, score, margin, label = txt.split(':', 5)
+    return (int(ply), int(before, 16), int(after, 16), label, int(score),
+            int(margin))
+
+
+class OpeningTree(object):
+    '''Opening plays of many games and how the games turned out.
+
+    Nodes are board positions, so plays that transpose into the same
+    position share a node. The root, the empty board, is position 0 and
+    counts the games with at least one play.
+
+    Attributes:
+        - *depth*: number of plays of each game counted.
+        - *positions*: {position: number of games that reached it}.
+        - *plays*: {(position, next position): dictionary with the 'move'
+          label, the 'count' of games, the mover's 'wins' (a tie is half a
+          win), total move 'score' and total final 'margin' of the mover
+          over their best opponent}.
+        - *children*: {position: list of the next positions played}.
+    '''
+    def __init__(self, depth=default_depth):
+        self.depth = depth
+        self.positions = {}
+        self.plays = {}
+        self.children = {}
+
+    def add(self, g, game_stats=None):
+        '''Add game *g*, with its stats.GameStats if they are to hand.'''
+        for ply, result in enumerate(get_opening_results(g, game_stats,
+                                                         self.depth)):
+            self.add_play(ply, *result)
+
+    def add_play(self, ply, before, after, label, score, margin):
+        '''Add the *ply*th play of a game, given as one of
+        get_opening_results().'''
+        if ply >= self.depth:
+            return
+        if ply == 0:
+            self.positions[0] = self.positions.get(0, 0) + 1
+        play = self.plays.get((before, after))
+        if play is None:
+            play = self.plays[before, after] = {
+                    'move': label, 'count': 0, 'wins': 0., 'score': 0,
+                    'margin': 0}
+            self.children.setdefault(before, []).append(after)
+        play['count'] += 1
+        play['wins'] += (margin > 0) + (margin == 0) * 0.5
+        play['score'] += score
+        play['margin'] += margin
+        self.positions[after] = self.positions.get(after, 0) + 1
+
+    def next_plays(self, position=0):
+        '''Return the plays made from *position*, most common first.
+
+        Each is a dictionary with the 'move' label, the 'position' it
+        leads to, its 'count' and the mover's 'win_rate',
+        'average_score' and 'average_margin'.
+        '''
+        plays = []
+        for after in self.children.get(position, ()):
+            play = self.plays[position, after]
+            count = play['count']
+            plays.append({'move': play['move'],
+                          'position': after,
+                          'count': count,
+                          'win_rate': play['wins'] / count,
+                          'average_score': float(play['score']) / count,
+                          'average_margin': float(play['margin']) / count})
+        plays.sort(key=lambda p: (-p['count'], p['move']))
+        return plays
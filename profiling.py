@@ -0,0 +1,253 @@
+'''
+Crossword Game Stats request profiling.
+
+Each request handled inside profile_request() gets a RequestProfile with
+the time spent in the datastore (measured by App Engine API proxy hooks,
+see install_hooks()), the number of entities read and written, and the
+time spent decoding JSON and rendering templates (measured by the code
+that does them, with timed()). Finished profiles are logged and added to
+the RouteStats of their route, which the admin profiling page shows.
+
+A request can also be run under cProfile, either by an admin adding
+*profile_arg* to its URL or for a sample of *sample_rate* of all
+requests. The statistics are kept for the admin page.
+
+Profiles are only held in the memory of each instance.
+'''
+
+import collections
+import contextlib
+import cProfile
+import logging
+import pstats
+import random
+import threading
+import time
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+# Timings of a RequestProfile, in the order they are shown.
+categories = ('total', 'datastore', 'json_decode', 'render')
+
+# Request argument to profile a request with cProfile.
+profile_arg = '_profile'
+
+# Fraction of requests profiled with cProfile (set on the admin page).
+sample_rate = 0.
+
+# Most requests kept for the percentiles of each route.
+max_samples = 1000
+
+# Most cProfile results kept.
+max_profiles = 20
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_lock = threading.Lock()
+_routes = {}
+_profiles = collections.deque(maxlen=max_profiles)
+
+
+class RequestProfile(object):
+    '''Where the time of one request went.
+
+    Attributes:
+        - *route*: the route template of the request.
+        - *seconds*: {category: seconds} for each of *categories*.
+        - *datastore_calls*: number of datastore RPCs.
+        - *entities*: number of entities read or written.
+    '''
+    def __init__(self, route):
+        self.route = route
+        self.seconds = dict((category, 0.) for category in categories)
+        self.datastore_calls = 0
+        self.entities = 0
+        self._rpc_starts = {}
+
+    def __str__(self):
+        return '%s %s datastore_calls=%d entities=%d' % (
+                self.route, ' '.join('%s=%.1fms' % (c, self.seconds[c] * 1000)
+                                     for c in categories),
+                self.datastore_calls, self.entities)
+
+
+def percentile(values, fraction):
+    '''Return the *fraction* percentile of sorted *values* (nearest
+    rank).'''
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class RouteStats(object):
+    '''The most recent *max_samples* profiles of a route.
+
+    Attributes:
+        - *count*: number of requests profiled since the instance started.
+    '''
+    def __init__(self, route):
+        self.route = route
+        self.count = 0
+        self._samples = collections.deque(maxlen=max_samples)
+
+    def add(self, profile):
+        self.count += 1
+        self._samples.append((dict(profile.seconds), profile.entities))
+
+    def summary(self):
+        '''Return a dictionary with the 'route', 'count' and number of
+        'samples', the 'p50' and 'p95' milliseconds of each of
+        *categories*, and the 'p50' and 'p95' numbers of 'entities'.'''
+        samples = list(self._samples)
+        summary = {'route': self.route, 'count': self.count,
+                   'samples': len(samples), 'p50': {}, 'p95': {}}
+        for category in categories:
+            values = sorted(seconds[category] * 1000
+                            for seconds, entities in samples)
+            summary['p50'][category] = percentile(values, 0.5)
+            summary['p95'][category] = percentile(values, 0.95)
+        entities = sorted(e for seconds, e in samples)
+        summary['p50']['entities'] = percentile(entities, 0.5)
+        summary['p95']['entities'] = percentile(entities, 0.95)
+        return summary
+
+
+def get_current():
+    '''Return the RequestProfile of the request being handled, or None.'''
+    return getattr(_local, 'profile', None)
+
+
+@contextlib.contextmanager
+def timed(category):
+    '''Add the time spent in the block to *category* of the current
+    request, if there is one.'''
+    profile = get_current()
+    if profile is None:
+        yield
+        return
+    t0 = time.time()
+    try:
+        yield
+    finally:
+        profile.seconds[category] += time.time() - t0
+
+
+@contextlib.contextmanager
+def profile_request(route, run_profiler=False):
+    '''Profile the request handled in the block. Runs it under cProfile if
+    *run_profiler* is true or it is chosen at the *sample_rate*.'''
+    profile = RequestProfile(route)
+    profiler = None
+    if run_profiler or (sample_rate and random.random() < sample_rate):
+        profiler = cProfile.Profile()
+    _local.profile = profile
+    t0 = time.time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield profile
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        profile.seconds['total'] = time.time() - t0
+        _local.profile = None
+        record(profile, profiler)
+
+
+def record(profile, profiler=None):
+    '''Log a finished RequestProfile and add it to the statistics.'''
+    logger.info('profile: %s', profile)
+    with _lock:
+        route_stats = _routes.get(profile.route)
+        if route_stats is None:
+            route_stats = _routes[profile.route] = RouteStats(profile.route)
+        route_stats.add(profile)
+    if profiler is not None:
+        out = StringIO()
+        stats = pstats.Stats(profiler, stream=out)
+        stats.sort_stats('cumulative').print_stats(40)
+        _profiles.appendleft({'route': profile.route,
+                              'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                              'summary': str(profile),
+                              'stats': out.getvalue()})
+
+
+def get_route_summaries():
+    '''Return RouteStats.summary() of each route, slowest p95 first.'''
+    with _lock:
+        summaries = [s.summary() for s in _routes.values()]
+    summaries.sort(key=lambda s: -(s['p95']['total'] or 0))
+    return summaries
+
+
+def get_profiles():
+    '''Return the most recent cProfile results, newest first, as
+    dictionaries with the 'route', 'time', profile 'summary' and the
+    'stats' text.'''
+    return list(_profiles)
+
+
+def reset():
+    '''Forget the statistics and profiles of this instance.'''
+    with _lock:
+        _routes.clear()
+        _profiles.clear()
+
+
+def _count_entities(call, request, response):
+    if call == 'Get':
+        return response.entity_size()
+    if call in ('RunQuery', 'Next'):
+        return response.result_size()
+    if call == 'Put':
+        return request.entity_size()
+    if call == 'Delete':
+        return request.key_size()
+    return 0
+
+
+def _datastore_pre_call(service, call, request, response):
+    profile = get_current()
+    if profile is not None:
+        profile._rpc_starts[id(response)] = time.time()
+
+
+def _datastore_post_call(service, call, request, response):
+    profile = get_current()
+    if profile is None:
+        return
+    t0 = profile._rpc_starts.pop(id(response), None)
+    if t0 is not None:
+        # Asynchronous calls count from when they were made to when they
+        # finished, which can overlap with other work.
+        profile.seconds['datastore'] += time.time() - t0
+    profile.datastore_calls += 1
+    try:
+        profile.entities += _count_entities(call, request, response)
+    except AttributeError:
+        pass
+
+
+_hooks_installed = False
+
+
+def install_hooks():
+    '''Time datastore calls with App Engine API proxy hooks. Does nothing
+    outside App Engine or if the hooks are already installed.'''
+    global _hooks_installed
+    if _hooks_installed:
+        return
+    try:
+        from google.appengine.api import apiproxy_stub_map
+    except ImportError:
+        return
+    apiproxy = apiproxy_stub_map.apiproxy
+    apiproxy.GetPreCallHooks().Append('profiling_pre', _datastore_pre_call,
+                                      'datastore_v3')
+    apiproxy.GetPostCallHooks().Append('profiling_post',
+                                       _datastore_post_call, 'datastore_v3')
+    _hooks_installed = True
@@ -0,0 +1,209 @@
+'''
+Crossword Game Stats board rendering as ASCII, HTML and SVG.
+
+A BoardRenderer works out everything that doesn't depend on the tiles
+(labels, bonus squares, markup) once for a layout, so that rendering a
+board only fills in the occupied squares and joins the parts.
+'''
+
+import string
+
+import board
+import game
+import scoring
+import stats
+
+
+# ASCII characters for empty bonus squares.
+ascii_bonuses = {'TW': '=', 'DW': '-', 'TL': '"', 'DL': "'", '': ' '}
+
+# Width of a square in SVG user units.
+svg_square = 20
+
+_renderers = {}
+
+
+def get_renderer(tile_bonuses=str(game.scrabble_board)):
+    '''Return the BoardRenderer of a tile_bonuses layout, which is only
+    made once.'''
+    key = str(tile_bonuses)
+    if not key in _renderers:
+        _renderers[key] = BoardRenderer(tile_bonuses)
+    return _renderers[key]
+
+
+def get_letters(board_or_cells, alphabet=None):
+    '''Return a flat list of letters indexed by cell from a board.
+
+    *board_or_cells* is a list of rows (as from Game.get_boards()), or a
+    board from board.BoardReplay.board_at() with the replay's *alphabet*.
+    '''
+    if alphabet is not None:
+        return [alphabet[c] for c in board_or_cells]
+    return [letter for row in board_or_cells for letter in row]
+
+
+def escape(letter):
+    return letter.replace('&', '&amp;').replace('<', '&lt;')
+
+
+class BoardRenderer(object):
+    '''Renders boards with the bonus squares of a layout.
+
+    The render methods take a flat list of letters indexed by cell, as
+    from get_letters(), with ' ' for an empty square.
+    '''
+    def __init__(self, tile_bonuses=str(game.scrabble_board)):
+        self.labels = scoring.get_multipliers(tile_bonuses)[2]
+        self.size = size = int(len(self.labels) ** 0.5)
+        columns = string.ascii_uppercase[:size]
+        # Cells in display order: row 1 (the highest y) first.
+        self.order = [y * size + x for y in range(size - 1, -1, -1)
+                      for x in range(size)]
+
+        self._ascii_empty = [ascii_bonuses.get(l, ' ') for l in self.labels]
+        border = '  +' + '-' * size + '+'
+        self._ascii_head = ['   ' + columns + ' ', border]
+        self._ascii_foot = [border, '   ' + columns + ' ']
+        self._ascii_left = ['%2d|' % (r + 1) for r in range(size)]
+        self._ascii_right = ['|%-2d' % (r + 1) for r in range(size)]
+
+        self._html_open = ["<td class='%s'>" % l.lower() if l else '<td>'
+                           for l in self.labels]
+        self._html_empty = [o + '</td>' for o in self._html_open]
+
+        width = svg_square * size
+        parts = ["<svg xmlns='http://www.w3.org/2000/svg' "
+                 "class='scrabble-board' viewBox='0 0 %d %d'>" % (width, width),
+                 "<rect class='square' width='%d' height='%d'/>" % (width,
+                                                                    width)]
+        self._svg_xy = [None] * (size * size)
+        for r, cell in enumerate(self.order):
+            x, y = (r % size) * svg_square, (r // size) * svg_square
+            self._svg_xy[cell] = (x, y)
+            if self.labels[cell]:
+                parts.append("<rect class='%s' x='%d' y='%d' width='%d' "
+                             "height='%d'/>" % (self.labels[cell].lower(), x,
+                                                y, svg_square, svg_square))
+        for i in range(size + 1):
+            parts.append("<path class='grid' d='M0 %d H%d M%d 0 V%d'/>" % (
+                    i * svg_square, width, i * svg_square, width))
+        self._svg_head = ''.join(parts)
+
+    def ascii(self, letters, labels=True):
+        '''Return the board as text, one line per row.'''
+        size = self.size
+        empty = self._ascii_empty
+        chars = [empty[cell] if letters[cell] == ' ' else letters[cell]
+                 for cell in self.order]
+        rows = [''.join(chars[r * size:(r + 1) * size]) for r in range(size)]
+        if labels:
+            rows = (self._ascii_head +
+                    [l + row + r for l, row, r in zip(self._ascii_left, rows,
+                                                      self._ascii_right)] +
+                    self._ascii_foot)
+        return '\n'.join(rows)
+
+    def html(self, letters):
+        '''Return the board as an HTML table. Squares have the class of
+        their bonus (tw, dw, tl or dl) and blanks are in lower case.'''
+        size = self.size
+        parts = ["<table class='scrabble-board'>"]
+        for r in range(size):
+            parts.append('<tr>')
+            for cell in self.order[r * size:(r + 1) * size]:
+                letter = letters[cell]
+                if letter == ' ':
+                    parts.append(self._html_empty[cell])
+                else:
+                    parts.append(self._html_open[cell])
+                    parts.append(escape(letter))
+                    parts.append('</td>')
+            parts.append('</tr>')
+        parts.append('</table>')
+        return ''.join(parts)
+
+    def svg(self, letters):
+        '''Return the board as a small SVG image.'''
+        half = svg_square // 2
+        parts = [self._svg_head]
+        for cell, letter in enumerate(letters):
+            if letter == ' ':
+                continue
+            x, y = self._svg_xy[cell]
+            parts.append("<rect class='tile' x='%d' y='%d' width='%d' "
+                         "height='%d'/><text x='%d' y='%d'>%s</text>" % (
+                             x + 1, y + 1, svg_square - 2, svg_square - 2,
+                             x + half, y + half + 5, escape(letter)))
+        parts.append('</svg>')
+        return ''.join(parts)
+
+    def render(self, letters, format='html'):
+        return getattr(self, format)(letters)
+
+
+def iter_game_boards(g, size=15):
+    '''Yield (move number, letters) after each move of game *g* that
+    changed the board, with letters as from get_letters(). The same list
+    is updated and yielded each time.'''
+    replay = board.BoardReplay(size=size)
+    alphabet = replay.alphabet
+    letters = [' '] * (replay.size * replay.size)
+    for i, move in enumerate(g._moves):
+        replay.append(move)
+        delta = replay.deltas[-1]
+        if not delta:
+            continue
+        for cell, old, new in delta:
+            letters[cell] = alphabet[new]
+        yield i, letters
+
+
+def render_final_board(g, format='html'):
+    '''Return the board at the end of game *g*.'''
+    renderer = get_renderer(g._metadata.get('tile_bonuses',
+                                            str(game.scrabble_board)))
+    letters = [' '] * (renderer.size * renderer.size)
+    for i, letters in iter_game_boards(g, renderer.size):
+        pass
+    return renderer.render(letters, format)
+
+
+def get_replay_data(g, running_totals=None):
+    '''Return the move-by-move board replay of game *g* for the client (see
+    js/base.js).
+
+    A dictionary with the 'size' of the board, its bonus square 'layout'
+    (rows of tile_bonuses characters, row 1 first) and for each move its
+    'player', 'type', 'score', the mover's running 'total' and the
+    'tiles' it changed as [row, column, letter], with row 0 the top row
+    and '' for a tile taken back. *running_totals* are as in
+    stats.GameStats.
+    '''
+    tile_bonuses = g._metadata.get('tile_bonuses', str(game.scrabble_board))
+    rows = scoring.get_bonus_rows(tile_bonuses)
+    size = len(rows)
+    if running_totals is None:
+        running_totals = stats.get_game_stats(g).running_totals
+    replay = board.BoardReplay(size=size)
+    alphabet = replay.alphabet
+    moves = []
+    for i, move in enumerate(g._moves):
+        replay.append(move)
+        moves.append({'player': move['player'],
+                      'type': move['move_type'],
+                      'score': move['score'],
+                      'total': running_totals[i],
+                      'tiles': [[size - 1 - cell // size, cell % size,
+                                 alphabet[new].strip()]
+                                for cell, old, new in replay.deltas[-1]]})
+    return {'size': size, 'layout': rows, 'moves': moves}
+
+
+def render_game(g, format='html'):
+    '''Return [(move number, rendered board)] for each move of game *g* that
+    changed the board.'''
+    renderer = get_renderer(g._metadata.get('tile_bonuses',
+                                            str(game.scrabble_board)))
+    return [(i, renderer.render(letters, format))
+            for i, letters in iter_game_boards(g, renderer.size)]
@@ -0,0 +1,225 @@
+'''
+Crossword Game Stats move scoring from the board and its bonus squares.
+
+Run with ``python scoring.py FILE [...]`` to check the recorded scores of
+the games in .GCG files against the board.
+'''
+
+import argparse
+import ast
+import io
+import logging
+
+import board
+import game
+
+
+tile_values = {
+    'english': {'A': 1, 'B': 3, 'C': 3, 'D': 2, 'E': 1, 'F': 4, 'G': 2,
+                'H': 4, 'I': 1, 'J': 8, 'K': 5, 'L': 1, 'M': 3, 'N': 1,
+                'O': 1, 'P': 3, 'Q': 10, 'R': 1, 'S': 1, 'T': 1, 'U': 1,
+                'V': 4, 'W': 4, 'X': 8, 'Y': 4, 'Z': 10},
+    'french': {'A': 1, 'B': 3, 'C': 3, 'D': 2, 'E': 1, 'F': 4, 'G': 2,
+               'H': 4, 'I': 1, 'J': 8, 'K': 10, 'L': 1, 'M': 2, 'N': 1,
+               'O': 1, 'P': 3, 'Q': 8, 'R': 1, 'S': 1, 'T': 1, 'U': 1,
+               'V': 4, 'W': 10, 'X': 10, 'Y': 10, 'Z': 10},
+    }
+
+# Characters used in Game._metadata['tile_bonuses']:
+# (letter multiplier, word multiplier, label).
+bonus_squares = {' ': (1, 1, ''),
+                 'l': (2, 1, 'DL'),
+                 'L': (3, 1, 'TL'),
+                 'w': (1, 2, 'DW'),
+                 'W': (1, 3, 'TW')}
+
+bingo_bonus = 50
+
+logger = logging.getLogger(__name__)
+
+_layouts = {}
+
+
+def get_bonus_rows(tile_bonuses):
+    '''Return the rows of a tile_bonuses layout, top row (row 1) first.
+
+    *tile_bonuses* can be a list of rows, the rows joined by newlines or
+    the string form of a list of rows (which is how Game stores it).
+    '''
+    if isinstance(tile_bonuses, (list, tuple)):
+        return list(tile_bonuses)
+    if tile_bonuses.lstrip().startswith('['):
+        return list(ast.literal_eval(tile_bonuses))
+    return tile_bonuses.strip('\n').split('\n')
+
+
+def get_multipliers(tile_bonuses):
+    '''Return (letter multipliers, word multipliers, labels) for a layout.
+
+    Each is a flat list indexed by board cell, y * size + x, as used by
+    board.BoardReplay. The result is cached for each layout.
+    '''
+    key = str(tile_bonuses)
+    if key not in _layouts:
+        rows = get_bonus_rows(tile_bonuses)
+        size = len(rows)
+        letter_mult = [1] * (size * size)
+        word_mult = [1] * (size * size)
+        labels = [''] * (size * size)
+        for r, row in enumerate(rows):
+            y = size - 1 - r
+            for x, char in enumerate(row.ljust(size)):
+                cell = y * size + x
+                letter_mult[cell], word_mult[cell], labels[cell] = (
+                        bonus_squares.get(char, bonus_squares[' ']))
+        _layouts[key] = (letter_mult, word_mult, labels)
+    return _layouts[key]
+
+
+class Scorer(object):
+    '''Scores moves against the board of a BoardReplay.
+
+    Call score_move() with each move of a game in turn: the move is scored
+    against the board as it was before the move and then played on it.
+
+    The multipliers are looked up in the flat get_multipliers() lists one
+    tile at a time rather than with array operations: a play touches a few
+    dozen cells at most, fewer than it takes for NumPy's per-call overhead
+    to pay off, and a game is still scored in one pass over the board.
+    '''
+    def __init__(self, tile_bonuses, language='english'):
+        self.letter_mult, self.word_mult, self.labels = get_multipliers(
+                tile_bonuses)
+        self.size = int(len(self.labels) ** 0.5)
+        self.values = tile_values.get(language, tile_values['english'])
+        self.replay = board.BoardReplay(size=self.size)
+
+    def value(self, letter):
+        if letter.islower():
+            return 0
+        return self.values.get(letter, 0)
+
+    def score_move(self, move):
+        '''Score *move* and then play it.
+
+        Returns a dictionary with the computed 'score' (None if the move
+        can't be scored from the board), the 'bonuses' used by the tiles
+        it placed, the board cells of the tiles 'placed' and whether the
+        score is a 'mismatch' with the recorded one.
+        '''
+        result = {'score': None, 'bonuses': [], 'placed': [],
+                  'mismatch': False}
+        if (move['move_type'] == 'regular play' and move['word'] and
+                move['coordinates'] and move['direction']):
+            result.update(self._score_play(move))
+            result['mismatch'] = (result['score'] is not None and
+                                  result['score'] != move['score'])
+        self.replay.append(move)
+        return result
+
+    def _score_play(self, move):
+        size = self.size
+        cells = self.replay.cells
+        alphabet = self.replay.alphabet
+        placed = {}
+        for letter, (x, y) in zip(move['word'], move['coordinates']):
+            if letter == '.' or not (0 <= x < size and 0 <= y < size):
+                continue
+            cell = y * size + x
+            if not cells[cell]:
+                placed[cell] = letter
+        if not placed:
+            return {}
+
+        def letter_at(x, y):
+            if not (0 <= x < size and 0 <= y < size):
+                return None
+            cell = y * size + x
+            if cell in placed:
+                return placed[cell]
+            if cells[cell]:
+                return alphabet[cells[cell]]
+            return None
+
+        def score_word(x, y, dx, dy):
+            while letter_at(x - dx, y - dy) is not None:
+                x, y = x - dx, y - dy
+            total = 0
+            word_mult = 1
+            length = 0
+            letter = letter_at(x, y)
+            while letter is not None:
+                cell = y * size + x
+                if cell in placed:
+                    total += self.value(letter) * self.letter_mult[cell]
+                    word_mult *= self.word_mult[cell]
+                else:
+                    total += self.value(letter)
+                length += 1
+                x, y = x + dx, y + dy
+                letter = letter_at(x, y)
+            if length < 2:
+                return 0
+            return total * word_mult
+
+        if move['direction'] == 'horizontal':
+            dx, dy = 1, 0
+        else:
+            dx, dy = 0, -1
+        x, y = move['coordinates'][0]
+        score = score_word(x, y, dx, dy)
+        for cell in placed:
+            y, x = divmod(cell, size)
+            score += score_word(x, y, dy, dx)
+        if len(placed) == 7:
+            score += bingo_bonus
+        bonuses = [self.labels[cell] for cell in sorted(placed)
+                   if self.labels[cell]]
+        return {'score': score, 'bonuses': bonuses, 'placed': sorted(placed)}
+
+
+def score_game(g):
+    '''Score every move of game *g* in one pass.
+
+    Returns a list of Scorer.score_move() results, one for each move.
+    '''
+    scorer = Scorer(g._metadata['tile_bonuses'],
+                    g._metadata.get('language', 'english'))
+    return [scorer.score_move(move) for move in g._moves]
+
+
+def audit(games):
+    '''Yield (game, move number, result) for each move that doesn't score
+    what the game says it did.'''
+    for g in games:
+        for i, result in enumerate(score_game(g)):
+            if result['mismatch']:
+                yield g, i, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('files', nargs='+', metavar='FILE',
+                        help='.GCG files of one or more games')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    n_games = n_mismatches = 0
+    for filename in args.files:
+        with io.open(filename, encoding='utf-8', errors='replace') as f:
+            games = list(game.GCGReader(f))
+        for index, g in enumerate(games):
+            for g, i, result in audit([g]):
+                move = g._moves[i]
+                logger.warning('%s: game %d move %d: %s played %s for %s, '
+                               'scored %s from the board', filename, index,
+                               i, move['player'], move['word'],
+                               move['score'], result['score'])
+                n_mismatches += 1
+        n_games += len(games)
+    logger.info('%d games, %d moves with a score that differs from the '
+                'board', n_games, n_mismatches)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+'''
+Crossword Game Stats search of the words and moves of many games.
+
+Each move of a game is described by terms:
+    - *word:QI*: the whole word formed along the line of play, including
+      letters played through, in upper case.
+    - *letter:Q*: each letter of that word (upper case).
+    - *square:h8*: each square a tile was placed on.
+    - *bonus:TL*: each bonus square used (TL, DL, TW, DW) and *bonus:bingo*
+      for a play of seven tiles.
+    - *blank*: the play used a blank.
+    - *type:tile_exchange*: the move type (see game.move_types), with
+      spaces replaced by "_".
+
+A query is a list of terms which must all describe the same move. The
+prefixes are case insensitive and the values are matched in the case they
+are indexed in (upper case, except for move types and squares). A term
+can have the wildcards "*" (any letters) and "?" (one letter), so
+"word:QU*" finds words starting with QU and "word:?I" two letter words
+ending in I.
+'''
+
+import array
+import bisect
+import re
+import string
+
+import game
+import scoring
+
+
+# Moves after this many in a game aren't indexed by SearchIndex.
+max_moves = 1024
+
+
+def get_move_terms(g):
+    '''Return {term: [move numbers]} for the moves of Game *g*.'''
+    scorer = scoring.Scorer(g._metadata['tile_bonuses'],
+                            g._metadata.get('language', 'english'))
+    size = scorer.size
+    cells = scorer.replay.cells
+    alphabet = scorer.replay.alphabet
+    term_moves = {}
+
+    def add(term, i):
+        moves = term_moves.setdefault(term, [])
+        if not moves or moves[-1] != i:
+            moves.append(i)
+
+    for i, move in enumerate(g._moves):
+        if move['move_type']:
+            add(get_type_term(move['move_type']), i)
+        result = scorer.score_move(move)
+        if not result['placed']:
+            continue
+        word = []
+        for x, y in move['coordinates']:
+            if 0 <= x < size and 0 <= y < size and cells[y * size + x]:
+                word.append(alphabet[cells[y * size + x]])
+        word = ''.join(word).upper()
+        add('word:' + word, i)
+        for letter in set(word):
+            add('letter:' + letter, i)
+        for cell in result['placed']:
+            y, x = divmod(cell, size)
+            add('square:%s%d' % (string.ascii_lowercase[x], size - y), i)
+            if alphabet[cells[cell]].islower():
+                add('blank', i)
+        for bonus in result['bonuses']:
+            add('bonus:' + bonus, i)
+        if len(result['placed']) == 7:
+            add('bonus:bingo', i)
+    return term_moves
+
+
+def get_type_term(move_type):
+    '''Return the term of a move type, such as "type:tile_exchange".'''
+    return 'type:' + move_type.replace(' ', '_')
+
+
+# Prefixes whose values are indexed in lower case.
+_lower_case_prefixes = ('type', 'square')
+
+
+def parse_query(txt):
+    '''Split a query string into terms, normalizing their case. "QI" is
+    short for "word:QI".'''
+    terms = []
+    for token in txt.split():
+        if token.lower() == 'blank':
+            terms.append('blank')
+            continue
+        if not ':' in token:
+            token = 'word:' + token
+        prefix, value = token.split(':', 1)
+        prefix = prefix.lower()
+        if (prefix in _lower_case_prefixes or
+                (prefix == 'bonus' and value.lower() == 'bingo')):
+            value = value.lower()
+        else:
+            value = value.upper()
+        terms.append(prefix + ':' + value)
+    return terms
+
+
+def _wildcard_re(term):
+    return re.compile('^' + re.escape(term).replace('\\*', '.*')
+                      .replace('\\?', '.') + '$')
+
+
+class SearchIndex(object):
+    '''Inverted index from terms to the moves of many games.
+
+    Each term's postings are an array of game index * max_moves + move
+    number, in order, so that queries are binary searches rather than
+    scans of the games.
+
+    Attributes:
+        - *game_ids*: the ids of the games added, by game index.
+    '''
+    def __init__(self):
+        self.game_ids = []
+        self._postings = {}
+        self._sorted_terms = None
+
+    def __len__(self):
+        return len(self.game_ids)
+
+    def add_game(self, game_id, term_moves):
+        '''Add a game given its get_move_terms() dictionary.'''
+        base = len(self.game_ids) * max_moves
+        self.game_ids.append(game_id)
+        for term, moves in term_moves.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = array.array('i')
+                self._sorted_terms = None
+            postings.extend(base + i for i in moves if i < max_moves)
+
+    def add(self, game_id, g):
+        self.add_game(game_id, get_move_terms(g))
+
+    @property
+    def terms(self):
+        '''All of the terms, sorted.'''
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._postings)
+        return self._sorted_terms
+
+    def expand(self, term):
+        '''Return the terms matched by *term*, which can have wildcards.'''
+        if not '*' in term and not '?' in term:
+            return [term] if term in self._postings else []
+        prefix = re.split('[*?]', term, 1)[0]
+        terms = self.terms
+        start = bisect.bisect_left(terms, prefix)
+        end = bisect.bisect_left(terms, prefix + u'\uffff')
+        if term == prefix + '*':
+            return terms[start:end]
+        pattern = _wildcard_re(term)
+        return [t for t in terms[start:end] if pattern.match(t)]
+
+    def _term_postings(self, term):
+        terms = self.expand(term)
+        if len(terms) == 1:
+            return self._postings[terms[0]]
+        merged = set()
+        for t in terms:
+            merged.update(self._postings[t])
+        return sorted(merged)
+
+    def search(self, terms):
+        '''Return a list of (game id, move number) of the moves described by
+        all of *terms*.'''
+        if isinstance(terms, game.string_types):
+            terms = parse_query(terms)
+        if not terms:
+            return []
+        postings = sorted((self._term_postings(t) for t in terms), key=len)
+        found = []
+        for posting in postings[0]:
+            for other in postings[1:]:
+                j = bisect.bisect_left(other, posting)
+                if j == len(other) or other[j] != posting:
+                    break
+            else:
+                found.append(posting)
+        return [(self.game_ids[p // max_moves], p % max_moves) for p in found]
+
+    def count(self, term):
+        '''Return the number of moves matching *term*.'''
+        return len(self._term_postings(term))
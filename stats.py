@@ -0,0 +1,166 @@
+'''
+Crossword Game Stats per-game summary statistics.
+'''
+
+import hashlib
+import json
+
+import cache
+
+
+# Moves that are turns of their own, as opposed to adjustments to the score
+# at the end of the game or after a challenge.
+turn_move_types = ('regular play', 'tile exchange', 'pass')
+
+# Moves that change the score of the mover's last turn, which fingerprint()
+# adds to that turn.
+turn_adjustment_move_types = ('phoney withdraw', 'acceptable challenge')
+
+_cache = cache.LRUCache(1024)
+
+
+class GameStats(object):
+    '''Summary statistics of a game, built in one pass over its moves.
+
+    Attributes:
+        - *players*: list of player keys.
+        - *running_totals*: the mover's total score after each move.
+        - *per_player*: dictionary of statistics for each player: 'score',
+          'turns', 'average' (points per turn), 'bingos', 'exchanges',
+          'passes', and the 'best_move' number and 'best_score'.
+        - *margin*, *winner*: as stored on gae.GAEGame.
+    '''
+    def __init__(self, g=None):
+        self.players = []
+        self.running_totals = []
+        self.per_player = {}
+        self.margin = None
+        self.winner = None
+        if g is not None:
+            self.read_game(g)
+
+    def _player(self, player):
+        if not player in self.per_player:
+            self.players.append(player)
+            self.per_player[player] = {
+                    'score': 0, 'turns': 0, 'average': 0., 'bingos': 0,
+                    'exchanges': 0, 'passes': 0, 'best_move': None,
+                    'best_score': None}
+        return self.per_player[player]
+
+    def read_game(self, g):
+        for player in g._players:
+            self._player(player)
+        last_play = None
+        for i, move in enumerate(g._moves):
+            p = self._player(move['player'])
+            p['score'] += move['score']
+            self.running_totals.append(p['score'])
+            move_type = move['move_type']
+            if move_type in turn_move_types:
+                p['turns'] += 1
+            if move_type == 'regular play':
+                bingo = (move['word'] is not None and
+                         len(move['word']) - move['word'].count('.') == 7)
+                p['bingos'] += bingo
+                last_play = (p, bingo, (p['best_move'], p['best_score']))
+                if p['best_score'] is None or move['score'] > p['best_score']:
+                    p['best_move'] = i
+                    p['best_score'] = move['score']
+            elif move_type == 'phoney withdraw' and last_play is not None:
+                # The withdrawn play is no longer a bingo or a best move.
+                played, bingo, best = last_play
+                played['bingos'] -= bingo
+                played['best_move'], played['best_score'] = best
+                last_play = None
+            elif move_type == 'tile exchange':
+                p['exchanges'] += 1
+            elif move_type == 'pass':
+                p['passes'] += 1
+        for p in self.per_player.values():
+            if p['turns']:
+                p['average'] = float(p['score']) / p['turns']
+        scores = [self.per_player[player]['score'] for player in self.players]
+        if scores:
+            sorted_scores, sorted_players = zip(
+                    *sorted(zip(scores, self.players), key=lambda x: x[0]))
+            if len(sorted_scores) > 1:
+                self.margin = sorted_scores[-1] - sorted_scores[-2]
+            self.winner = sorted_players[-1]
+
+    @property
+    def scores(self):
+        return [self.per_player[player]['score'] for player in self.players]
+
+    @property
+    def json(self):
+        return json.dumps({'players': self.players,
+                           'running_totals': self.running_totals,
+                           'per_player': self.per_player,
+                           'margin': self.margin,
+                           'winner': self.winner})
+
+    def read_json(self, txt):
+        jsondict = json.loads(txt)
+        self.players = jsondict['players']
+        self.running_totals = jsondict['running_totals']
+        self.per_player = jsondict['per_player']
+        self.margin = jsondict['margin']
+        self.winner = jsondict['winner']
+
+
+def json_hash(txt):
+    '''Return the hash used to memoize the statistics of a game's JSON.'''
+    if not isinstance(txt, bytes):
+        txt = txt.encode('utf-8')
+    return hashlib.sha1(txt).hexdigest()
+
+
+def fingerprint(g):
+    '''Return a hash identifying game *g* by the scores of its turns.
+
+    Import formats differ in how they name the players, the order they
+    list moves in and whether a phoney withdrawn or a challenge bonus is a
+    move of its own, so the hash is of each player's turn scores (with the
+    *turn_adjustment_move_types* added to the turn they adjust), sorted,
+    leaving out the player names and the end of game adjustments, which
+    formats also record differently. The same game read from a .GCG file,
+    custom text or JSON then has the same fingerprint.
+    '''
+    turns = dict((player, []) for player in g._players)
+    for move in g._moves:
+        player_turns = turns.setdefault(move['player'], [])
+        if move['move_type'] in turn_move_types:
+            player_turns.append(move['score'])
+        elif move['move_type'] in turn_adjustment_move_types:
+            if player_turns:
+                player_turns[-1] += move['score']
+            else:
+                player_turns.append(move['score'])
+    txt = json.dumps(sorted(turns.values()), separators=(',', ':'))
+    return hashlib.sha1(txt.encode('utf-8')).hexdigest()
+
+
+def get_game_stats(g, json_txt=None):
+    '''Return the GameStats of game *g*, memoized on the hash of its JSON.
+
+    Pass *json_txt* if g.json has already been generated.
+    '''
+    if json_txt is None:
+        json_txt = g.json
+    key = json_hash(json_txt)
+    game_stats = _cache.get(key)
+    if game_stats is None:
+        game_stats = GameStats(g)
+        _cache[key] = game_stats
+    return game_stats
+
+
+def load_game_stats(key, stats_json):
+    '''Return the GameStats stored as *stats_json* for the JSON hash *key*.'''
+    game_stats = _cache.get(key)
+    if game_stats is None:
+        game_stats = GameStats()
+        game_stats.read_json(stats_json)
+        _cache[key] = game_stats
+    return game_stats
@@ -0,0 +1,365 @@
+'''
+Crossword Game Stats local game store.
+
+A GameStore keeps games on disk outside App Engine in two files:
+
+    PATH.dat    a header (*magic* and *version*) followed by the records
+                of the games, each a record header (game id and length)
+                and the game's compact encoding (see compact.py). Records
+                are only ever appended.
+    PATH.idx    an index entry for each game id, in order: the offset and
+                length of the game's latest record and its flags (trashed
+                or deleted). If it is lost it is rebuilt from the record
+                headers, without the flags.
+
+The data file is memory-mapped, so opening a game by id reads just its
+record, and scans read the records in file order. Trashing, restoring and
+deleting a game only rewrite its index entry; compact() rewrites the data
+file without the records of deleted (and optionally trashed) games.
+
+Run with ``python store.py COMMAND STORE ...`` to import or export games
+in the export JSON format, compact a store or describe it.
+'''
+
+import argparse
+import io
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+
+import compact
+import game
+
+
+magic = b'CGSSTORE'
+version = 1
+
+flag_trashed = 1
+flag_deleted = 2
+
+_header = struct.Struct('<8sB')
+_record_header = struct.Struct('<II')
+_index_entry = struct.Struct('<QIB')
+
+logger = logging.getLogger(__name__)
+
+
+class StoreError(Exception):
+    pass
+
+
+class GameStore(object):
+    '''Games stored on disk at *path* (without the .dat or .idx extension),
+    which are created if they don't exist.
+
+    Game ids are consecutive integers from 0, in the order the games were
+    added, and stay the same after compaction. Use as a context manager or
+    call close().
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.data_path = path + '.dat'
+        self.index_path = path + '.idx'
+        self._offsets = []
+        self._lengths = []
+        self._flags = bytearray()
+        self._mmap = None
+        self._open()
+
+    def _open(self):
+        if not os.path.exists(self.data_path):
+            with open(self.data_path, 'wb') as f:
+                f.write(_header.pack(magic, version))
+            with open(self.index_path, 'wb'):
+                pass
+        self._data = open(self.data_path, 'r+b')
+        store_magic, store_version = _header.unpack(
+                self._data.read(_header.size))
+        if store_magic != magic or store_version != version:
+            raise StoreError('%s is not a version %d game store' % (
+                    self.data_path, version))
+        if not os.path.exists(self.index_path):
+            self._rebuild_index()
+        self._data.seek(0, os.SEEK_END)
+        data_size = self._data.tell()
+        with open(self.index_path, 'rb') as f:
+            index = f.read()
+        n = len(index) // _index_entry.size
+        for i in range(n):
+            offset, length, flags = _index_entry.unpack_from(
+                    index, i * _index_entry.size)
+            if offset + length > data_size:
+                # A record that was never completely written.
+                logger.warning('%s: dropping %d incomplete games',
+                               self.index_path, n - i)
+                break
+            self._offsets.append(offset)
+            self._lengths.append(length)
+            self._flags.append(flags)
+        self._index = open(self.index_path, 'r+b')
+        self._index.truncate(len(self._offsets) * _index_entry.size)
+
+    def _rebuild_index(self):
+        '''Write the index from the record headers of the data file. The
+        latest record of each game id is used, ids without a record are
+        deleted and no game is trashed.'''
+        logger.warning('%s: rebuilding the index', self.index_path)
+        records = {}
+        data = self._get_mmap()
+        pos = _header.size
+        while pos + _record_header.size <= len(data):
+            game_id, length = _record_header.unpack_from(data, pos)
+            pos += _record_header.size
+            if pos + length > len(data):
+                break
+            records[game_id] = (pos, length)
+            pos += length
+        self._unmap()
+        with open(self.index_path, 'wb') as f:
+            for game_id in range(max(records) + 1 if records else 0):
+                offset, length = records.get(game_id, (0, 0))
+                f.write(_index_entry.pack(offset, length,
+                                          0 if length else flag_deleted))
+
+    def close(self):
+        self._unmap()
+        self._data.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        '''Number of games that haven't been deleted.'''
+        return sum(1 for flags in self._flags if not flags & flag_deleted)
+
+    def __contains__(self, game_id):
+        return (0 <= game_id < len(self._flags) and
+                not self._flags[game_id] & flag_deleted)
+
+    def ids(self, trashed=False):
+        '''Return the ids of the games, including the trashed games if
+        *trashed* is true.'''
+        skip = flag_deleted | (0 if trashed else flag_trashed)
+        return [i for i, flags in enumerate(self._flags) if not flags & skip]
+
+    def is_trashed(self, game_id):
+        self._check(game_id)
+        return bool(self._flags[game_id] & flag_trashed)
+
+    def _check(self, game_id):
+        if not game_id in self:
+            raise KeyError(game_id)
+
+    def _unmap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _get_mmap(self):
+        if self._mmap is None:
+            self._data.flush()
+            self._mmap = mmap.mmap(self._data.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def _write_index_entry(self, game_id):
+        self._index.seek(game_id * _index_entry.size)
+        self._index.write(_index_entry.pack(self._offsets[game_id],
+                                            self._lengths[game_id],
+                                            self._flags[game_id]))
+
+    def _append_record(self, game_id, data):
+        self._unmap()
+        self._data.seek(0, os.SEEK_END)
+        offset = self._data.tell() + _record_header.size
+        self._data.write(_record_header.pack(game_id, len(data)))
+        self._data.write(data)
+        return offset
+
+    def add(self, g, trashed=False):
+        '''Store Game *g* and return its id.'''
+        data = compact.dumps(g)
+        game_id = len(self._offsets)
+        self._offsets.append(self._append_record(game_id, data))
+        self._lengths.append(len(data))
+        self._flags.append(flag_trashed if trashed else 0)
+        self._write_index_entry(game_id)
+        return game_id
+
+    def replace(self, game_id, g):
+        '''Store a new version of the game with id *game_id*. The old record
+        stays in the data file until compaction.'''
+        self._check(game_id)
+        data = compact.dumps(g)
+        self._offsets[game_id] = self._append_record(game_id, data)
+        self._lengths[game_id] = len(data)
+        self._write_index_entry(game_id)
+
+    def get_data(self, game_id):
+        '''Return the compact encoding of a game.'''
+        self._check(game_id)
+        offset = self._offsets[game_id]
+        return self._get_mmap()[offset:offset + self._lengths[game_id]]
+
+    def get(self, game_id):
+        '''Return the Game with id *game_id*. Raises KeyError.'''
+        return compact.loads(self.get_data(game_id))
+
+    __getitem__ = get
+
+    def _set_flag(self, game_id, flag, value):
+        self._check(game_id)
+        if value:
+            self._flags[game_id] |= flag
+        else:
+            self._flags[game_id] &= ~flag
+        self._write_index_entry(game_id)
+
+    def trash(self, game_id):
+        self._set_flag(game_id, flag_trashed, True)
+
+    def restore(self, game_id):
+        self._set_flag(game_id, flag_trashed, False)
+
+    def delete(self, game_id):
+        '''Delete a game. Its id isn't used again.'''
+        self._set_flag(game_id, flag_deleted, True)
+
+    def scan_data(self, trashed=False):
+        '''Yield (id, compact encoding) of the games in the order of the
+        data file, which is the fastest order to read them in.'''
+        data = self._get_mmap()
+        game_ids = sorted(self.ids(trashed), key=self._offsets.__getitem__)
+        for game_id in game_ids:
+            offset = self._offsets[game_id]
+            yield game_id, data[offset:offset + self._lengths[game_id]]
+
+    def scan(self, trashed=False):
+        '''Yield (id, Game) of the games in the order of the data file.'''
+        for game_id, data in self.scan_data(trashed):
+            yield game_id, compact.loads(data)
+
+    def compact(self, trashed=False):
+        '''Rewrite the data file with only the latest record of each game
+        that hasn't been deleted, also deleting the trashed games if
+        *trashed* is true. Returns the number of bytes saved.'''
+        if trashed:
+            for game_id in self.ids(trashed=True):
+                if self._flags[game_id] & flag_trashed:
+                    self._flags[game_id] |= flag_deleted
+        tmp_path = self.data_path + '.tmp'
+        offsets = list(self._offsets)
+        lengths = list(self._lengths)
+        with open(tmp_path, 'wb') as f:
+            f.write(_header.pack(magic, version))
+            for game_id, data in self.scan_data(trashed=True):
+                f.write(_record_header.pack(game_id, len(data)))
+                offsets[game_id] = f.tell()
+                f.write(data)
+            new_size = f.tell()
+        for game_id, flags in enumerate(self._flags):
+            if flags & flag_deleted:
+                offsets[game_id] = lengths[game_id] = 0
+        self._data.seek(0, os.SEEK_END)
+        old_size = self._data.tell()
+        self._unmap()
+        self._data.close()
+        self._index.close()
+        with open(self.index_path + '.tmp', 'wb') as f:
+            for entry in zip(offsets, lengths, self._flags):
+                f.write(_index_entry.pack(*entry))
+        # The old index is wrong for the new data file, so remove it first:
+        # after a crash before the new index is in place it is rebuilt.
+        os.remove(self.index_path)
+        _replace(tmp_path, self.data_path)
+        _replace(self.index_path + '.tmp', self.index_path)
+        self._offsets = offsets
+        self._lengths = lengths
+        self._data = open(self.data_path, 'r+b')
+        self._index = open(self.index_path, 'r+b')
+        return old_size - new_size
+
+    def import_json(self, data_object):
+        '''Add the games of an export JSON style list of {'type', 'data'}
+        dictionaries (see game.iter_import_games()).
+
+        Returns ([ids of the games added], [(index in *data_object*,
+        exception) of the games that couldn't be read]).'''
+        game_ids = []
+        errors = []
+        for source, g in game.iter_import_games(data_object):
+            if isinstance(g, Exception):
+                errors.append((source, g))
+            else:
+                game_ids.append(self.add(g))
+        return game_ids, errors
+
+    def export_json(self, out, trashed=False):
+        '''Write the games to the file object *out* in the export JSON
+        format of handlers.ExportJSON, which Import and import_json()
+        read.'''
+        out.write('[')
+        separator = '\n'
+        for game_id, g in self.scan(trashed):
+            out.write(separator + json.dumps({'type': 'single_game_JSON',
+                                              'data': g.json}))
+            separator = ',\n'
+        out.write('\n]\n')
+
+
+def _replace(src, dst):
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        os.rename(src, dst)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command',
+                        choices=['import', 'export', 'compact', 'info'])
+    parser.add_argument('store', help='path of the store, without .dat')
+    parser.add_argument('files', nargs='*', metavar='FILE',
+                        help='export JSON files to import, or the file to '
+                        'export to (default standard output)')
+    parser.add_argument('--trashed', action='store_true',
+                        help='export the trashed games too, or delete them '
+                        'when compacting')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    with GameStore(args.store) as store:
+        if args.command == 'import':
+            for filename in args.files:
+                with io.open(filename, encoding='utf-8') as f:
+                    game_ids, errors = store.import_json(json.load(f))
+                logger.info('%s: imported %d games, %d errors', filename,
+                            len(game_ids), len(errors))
+                for source, e in errors:
+                    logger.warning('%s: entry %d: %s', filename, source, e)
+        elif args.command == 'export':
+            if args.files:
+                with open(args.files[0], 'w') as f:
+                    store.export_json(f, args.trashed)
+            else:
+                store.export_json(sys.stdout, args.trashed)
+        elif args.command == 'compact':
+            saved = store.compact(args.trashed)
+            logger.info('%s: saved %d bytes', store.data_path, saved)
+        else:
+            logger.info('%s: %d games (%d trashed), %d data bytes',
+                        args.store, len(store),
+                        len(store) - len(store.ids()),
+                        os.path.getsize(store.data_path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+'''
+Crossword Game Stats background tasks.
+
+Tasks are functions registered with the task() decorator. They are added
+to *queue*, which runs them through the App Engine task queue by POSTing
+to task_url. Replace *queue* with an InProcessQueue to run them locally.
+'''
+
+import collections
+import datetime
+import logging
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+
+import cache
+import gae
+
+
+task_url = '/app/tasks/run'
+tasks = {}
+
+refresh_chunk_size = 100
+
+
+def task(func):
+    '''Register *func* as a task that can be added to a queue by name.'''
+    tasks[func.__name__] = func
+    return func
+
+
+def run_task(name, params, queue):
+    '''Run task *name* with keyword arguments *params*.'''
+    tasks[name](queue=queue, **params)
+
+
+class TaskQueue(object):
+    '''Adds tasks to an App Engine push queue.'''
+    def __init__(self, queue_name='default'):
+        self.queue_name = queue_name
+
+    def add(self, name, **params):
+        params['task'] = name
+        taskqueue.add(url=task_url, params=params,
+                      queue_name=self.queue_name)
+
+
+class InProcessQueue(object):
+    '''Stand-in for TaskQueue which keeps tasks in memory until run() is
+    called.'''
+    def __init__(self):
+        self.pending = collections.deque()
+
+    def add(self, name, **params):
+        self.pending.append((name, params))
+
+    def run(self):
+        '''Run tasks, including any they add, until none are left.'''
+        count = 0
+        while self.pending:
+            name, params = self.pending.popleft()
+            run_task(name, params, self)
+            count += 1
+        return count
+
+
+queue = TaskQueue()
+
+
+def start_refresh(uploader_id):
+    '''Create a RefreshJob for the games of *uploader_id* and queue its
+    first chunk.'''
+    summary = gae.UserSummary.get_for_user(uploader_id)
+    now = datetime.datetime.now()
+    job = gae.RefreshJob(uploader_id=uploader_id, cursor='',
+                         total=summary.game_count + summary.trashed_count,
+                         date_started=now, date_modified=now)
+    job.put()
+    queue.add('refresh_games', job_key=str(job.key()), cursor='')
+    return job
+
+
+def start_refresh_if_needed(uploader_id, summary):
+    '''Start a refresh of the games of *uploader_id* if some of them were
+    stored before the list_projection properties (see
+    gae.UserSummary.list_ready) and they have never been refreshed.
+    Returns the RefreshJob started, or None.'''
+    if summary.list_ready:
+        return None
+    q = gae.RefreshJob.all(keys_only=True)
+    q.filter('uploader_id =', uploader_id)
+    if q.get() is not None:
+        return None
+    return start_refresh(uploader_id)
+
+
+@task
+def refresh_games(job_key, cursor, queue):
+    '''Re-create the derived properties of the next refresh_chunk_size games
+    of a RefreshJob from their stored JSON, in place.'''
+    job = db.get(job_key)
+    if job is None or job.status != 'running' or (job.cursor or '') != cursor:
+        # The job was cancelled, or this chunk has already been done by an
+        # earlier attempt at the task.
+        return
+    q = gae.GAEGame.all()
+    q.filter('uploader_id =', job.uploader_id)
+    if cursor:
+        q.with_cursor(cursor)
+    games = q.fetch(refresh_chunk_size)
+    refreshed = []
+    for gae_game in games:
+        try:
+            gae_game.set_game(gae_game.get_game())
+        except Exception:
+            logging.exception('Error refreshing game %s', gae_game.key())
+            job.errors += 1
+        else:
+            refreshed.append(gae_game)
+    db.put(refreshed)
+    gae.index_fingerprints(refreshed)
+    cache.get_render_cache().invalidate_user(job.uploader_id)
+    job.done += len(games)
+    job.cursor = q.cursor()
+    job.date_modified = datetime.datetime.now()
+    if len(games) < refresh_chunk_size:
+        job.status = 'done'
+        list_ready = None
+        if not job.errors:
+            # Every game now has the list properties, though the
+            # recount's query may not see the last chunk's changes yet.
+            list_ready = True
+        gae.UserSummary.rebuild(job.uploader_id, list_ready=list_ready)
+    job.put()
+    if job.status == 'running':
+        queue.add('refresh_games', job_key=job_key, cursor=job.cursor)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+'''
+Crossword Game Stats tests of the compact binary game encoding.
+'''
+
+import datetime
+import json
+import unittest
+
+import compact
+import game
+import stats
+
+
+gcg_txt = u'''#character-encoding UTF-8
+#player1 zoë Zoë Ångström
+#player2 李 李小龙
+#title Café game
+>zoë: AEIQRTU 8H QUAI +26 26
+>李: DEIOSTX 7I XI +36 36
+>zoë: BEGRTUW -BUW +0 26
+>李: DEEOSTZ 9F ZEST +24 60
+>李: DEEOSTZ -- -24 36
+>zoë: BEGRTUY K4 BUGGY +20 46
+>zoë: BEGRTUY (challenge) +5 51
+>李: ?EEORST 6J DOZEs +31 67
+>zoë: AER - +0 51
+>李: EST 9K ETS +10 77
+>李: (AER) +6 83
+'''
+
+sheet_txt = u'''played 2013-01-02 19:30
+entered by the club
+Bob Jones:: 36 36 67 77 80
+Alice Smith*:: 26 26 51 48
+A friendly game
+'''
+
+
+class RoundTripTest(unittest.TestCase):
+    def assert_round_trip(self, g):
+        data = compact.dumps(g)
+        self.assertEqual(compact.loads(data).json, g.json)
+        self.assertEqual(stats.json_hash(compact.loads(data).json),
+                         stats.json_hash(g.json))
+        self.assertLess(len(data), len(g.json))
+
+    def test_gcg_with_unicode_names(self):
+        self.assert_round_trip(game.Game(GCG_txt=gcg_txt))
+
+    def test_score_sheet(self):
+        self.assert_round_trip(game.Game(custom_txt=sheet_txt))
+
+    def test_json_with_extra_keys(self):
+        g = game.Game(GCG_txt=gcg_txt)
+        data = json.loads(g.json)
+        data['metadata']['zzz'] = [1, 2]
+        data['moves'][0]['note'] = u'opening'
+        copy = game.Game(single_game_JSON_txt=json.dumps(data))
+        self.assertEqual(compact.loads(compact.dumps(copy)).json, copy.json)
+
+    def test_metadata_key_order(self):
+        g = game.Game(GCG_txt=gcg_txt)
+        g._metadata['date_played'] = datetime.datetime(2013, 1, 2, 3, 4)
+        self.assertEqual(compact.loads(compact.dumps(g)).json, g.json)
+
+    def test_unknown_version(self):
+        data = bytearray(compact.dumps(game.Game(GCG_txt=gcg_txt)))
+        data[0] = compact.version + 1
+        self.assertRaises(ValueError, compact.loads, bytes(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+'''
+Crossword Game Stats tests of reading games.
+'''
+
+import unittest
+
+import game
+
+
+game_txt = '''#character-encoding UTF-8
+#player1 pip Pip Smith
+#player2 bob Bob Jones
+#title Club game %d
+#description A friendly game
+that went long
+>pip: AEJSTOU H4 JOUSTED +84 84
+>bob: ADEIKLY 9A LADYLIKE +94 94
+>pip: AFHIST A8 F.ATFISH +61 145
+>bob: EGINOPQ -PQ +0 94
+>pip: ?EINNRT D8 E.EINrT +72 217
+>pip: ?EINNRT -- -72 145
+>bob: AEIOUUU - +0 94
+>pip: EI 11D EN +10 155
+>bob: (EI) +4 98
+'''
+
+
+class GCGReaderTest(unittest.TestCase):
+    def test_one_game(self):
+        games = list(game.GCGReader(game_txt % 1))
+        self.assertEqual(len(games), 1)
+        self.assertEqual(games[0].json,
+                         game.Game(GCG_txt=game_txt % 1).json)
+
+    def test_many_games(self):
+        txt = ''.join(game_txt % i for i in range(3))
+        reader = game.GCGReader(txt.splitlines(True))
+        games = list(reader)
+        self.assertEqual([g._metadata['title'] for g in games],
+                         ['Club game 0', 'Club game 1', 'Club game 2'])
+        self.assertEqual(games[1]._players, ['pip', 'bob'])
+        self.assertEqual(games[1]._metadata['description'],
+                         'A friendly game\nthat went long')
+        self.assertEqual(reader.counters['games'], 3)
+        self.assertEqual(reader.counters['moves'], 27)
+        self.assertEqual(reader.last_game['moves'], 9)
+
+    def test_moves(self):
+        g = game.Game(GCG_txt=game_txt % 1)
+        move = g._moves[0]
+        self.assertEqual((move['player'], move['word'], move['score'],
+                          move['direction'], move['move_type']),
+                         ('pip', 'JOUSTED', 84, 'vertical', 'regular play'))
+        self.assertEqual([m['move_type'] for m in g._moves[3:7]],
+                         ['tile exchange', 'regular play', 'phoney withdraw',
+                          'pass'])
+
+
+sheet_txt = '''played 2013-01-02 19:30
+entered by the club
+Bob Jones:: 36 36 67 77 80
+Alice Smith*:: 26 26 51 48
+A friendly game
+'''
+
+
+class NFSHostReaderTest(unittest.TestCase):
+    def test_sheet(self):
+        g = game.Game(custom_txt=sheet_txt)
+        self.assertEqual(g._players, ['Bob Jones', 'Alice Smith'])
+        self.assertEqual(g._metadata['board_facing'], ['Alice Smith'])
+        self.assertEqual(g._metadata['description'], 'A friendly game\n')
+        self.assertEqual(g._metadata['date_played'].year, 2013)
+        self.assertEqual([(m['player'], m['score']) for m in g._moves],
+                         [('Bob Jones', 36), ('Alice Smith', 26),
+                          ('Bob Jones', 0), ('Alice Smith', 0),
+                          ('Bob Jones', 31), ('Alice Smith', 25),
+                          ('Bob Jones', 10), ('Alice Smith', -3),
+                          ('Bob Jones', 3)])
+        self.assertEqual([m['move_type'] for m in g._moves][-3:],
+                         ['regular play', 'last rack penalty',
+                          'last rack bonus'])
+
+    def test_many_sheets(self):
+        txt = sheet_txt + 'played\nAnn:: 10 20\nBo:: 5 30\n' + sheet_txt
+        games = list(game.NFSHostReader(txt))
+        self.assertEqual([g._players for g in games],
+                         [['Bob Jones', 'Alice Smith'], ['Ann', 'Bo'],
+                          ['Bob Jones', 'Alice Smith']])
+
+    def test_errors(self):
+        txt = sheet_txt + 'played 2013-01-03\nAnn:: 10 x\n' + sheet_txt
+        with self.assertRaises(game.ParseError) as context:
+            list(game.NFSHostReader(txt))
+        self.assertEqual(context.exception.lineno, 7)
+        games = list(game.NFSHostReader(txt, skip_errors=True))
+        self.assertTrue(isinstance(games[1], game.ParseError))
+        self.assertEqual(len(games), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
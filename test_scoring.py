@@ -0,0 +1,60 @@
+'''
+Crossword Game Stats tests of move scoring.
+'''
+
+import unittest
+
+import game
+import scoring
+
+
+header = '#player1 a Alice\n#player2 b Bob\n'
+
+
+def score_gcg(moves_txt):
+    g = game.Game(GCG_txt=header + moves_txt)
+    return scoring.score_game(g)
+
+
+class ScoreGameTest(unittest.TestCase):
+    def test_opening_play_on_the_centre_star(self):
+        result = score_gcg('>a: AEIQRTU 8H QUAI +26 26\n')[0]
+        self.assertEqual(result['score'], 26)
+        self.assertEqual(result['bonuses'], ['DW'])
+        self.assertFalse(result['mismatch'])
+
+    def test_bingo(self):
+        result = score_gcg('>a: AEINRST 8H RETAINS +66 66\n')[0]
+        # (1 + 1 + 1 + 1 + 1 * 2 + 1 + 1) * 2 + 50
+        self.assertEqual(result['score'], 66)
+        self.assertEqual(sorted(result['bonuses']), ['DL', 'DW'])
+
+    def test_play_forming_cross_words(self):
+        results = score_gcg('>a: AEIQRTU 8H QUAI +26 26\n'
+                            '>b: DEIOSTX 7I XI +36 36\n')
+        # XI with X on a DL, plus the cross words XU and IA.
+        self.assertEqual(results[1]['score'], 17 + 17 + 2)
+        self.assertEqual(results[1]['bonuses'], ['DL'])
+        self.assertFalse(results[1]['mismatch'])
+
+    def test_played_through_letters_score_without_bonuses(self):
+        results = score_gcg('>a: AEIQRTU 8H QUAI +26 26\n'
+                            '>b: ADEIOST J7 D.D +5 5\n')
+        # D A D down column J, with only the two D tiles placed.
+        self.assertEqual(results[1]['score'], 5)
+        self.assertEqual(results[1]['bonuses'], [])
+
+    def test_mismatch(self):
+        result = score_gcg('>a: AEIQRTU 8H QUAI +30 30\n')[0]
+        self.assertEqual(result['score'], 26)
+        self.assertTrue(result['mismatch'])
+        g = game.Game(GCG_txt=header + '>a: AEIQRTU 8H QUAI +30 30\n')
+        self.assertEqual([i for g, i, result in scoring.audit([g])], [0])
+
+    def test_blank_scores_nothing(self):
+        result = score_gcg('>a: AEIQRT? 8H QUAi +24 24\n')[0]
+        self.assertEqual(result['score'], 24)
+
+
+if __name__ == '__main__':
+    unittest.main()
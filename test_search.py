@@ -0,0 +1,75 @@
+'''
+Crossword Game Stats tests of the search of words and moves.
+'''
+
+import unittest
+
+import game
+import search
+
+
+gcg_txt = '''#player1 a Alice
+#player2 b Bob
+>a: AEIQRTU 8H QUAI +26 26
+>b: DEIOSTX 7I XI +36 36
+>a: BEGRTUW -BUW +0 26
+>b: ?EEORST L2 RETOrES +67 103
+>a: BDEGRTU K8 .D +3 29
+'''
+
+
+class MoveTermsTest(unittest.TestCase):
+    def setUp(self):
+        self.terms = search.get_move_terms(game.Game(GCG_txt=gcg_txt))
+
+    def test_terms(self):
+        self.assertEqual(self.terms['word:QUAI'], [0])
+        self.assertEqual(self.terms['letter:X'], [1])
+        self.assertEqual(self.terms['square:h8'], [0])
+        self.assertEqual(self.terms['bonus:DL'], [1, 3])
+        self.assertEqual(self.terms['type:tile_exchange'], [2])
+        self.assertEqual(self.terms['type:regular_play'], [0, 1, 3, 4])
+        self.assertEqual(self.terms['bonus:bingo'], [3])
+        self.assertEqual(self.terms['blank'], [3])
+
+    def test_words_include_letters_played_through(self):
+        self.assertEqual(self.terms['word:ID'], [4])
+        self.assertEqual(self.terms['letter:I'], [0, 1, 4])
+        self.assertEqual(self.terms['square:k8'], [0])
+
+
+class ParseQueryTest(unittest.TestCase):
+    def test_normalizes_case(self):
+        self.assertEqual(
+                search.parse_query('qi Letter:z SQUARE:H8 bonus:tl '
+                                   'bonus:BINGO Blank type:Tile_Exchange'),
+                ['word:QI', 'letter:Z', 'square:h8', 'bonus:TL',
+                 'bonus:bingo', 'blank', 'type:tile_exchange'])
+
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = search.SearchIndex()
+        self.index.add('one', game.Game(GCG_txt=gcg_txt))
+        self.index.add('two', game.Game(GCG_txt=gcg_txt.replace(
+                '7I XI +36 36', '7I XU +36 36')))
+
+    def test_same_move(self):
+        self.assertEqual(self.index.search('letter:x bonus:dl'),
+                         [('one', 1), ('two', 1)])
+        self.assertEqual(self.index.search('QUAI letter:X'), [])
+
+    def test_wildcards(self):
+        self.assertEqual(self.index.search('X?'), [('one', 1), ('two', 1)])
+        self.assertEqual(self.index.search('XI*'), [('one', 1)])
+        self.assertEqual(self.index.search('word:*ES'),
+                         [('one', 3), ('two', 3)])
+        self.assertEqual(self.index.count('letter:*'), 8)
+
+    def test_no_match(self):
+        self.assertEqual(self.index.search('ZZZ'), [])
+        self.assertEqual(self.index.search(''), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
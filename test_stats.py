@@ -0,0 +1,52 @@
+'''
+Crossword Game Stats tests of per-game statistics.
+'''
+
+import unittest
+
+import game
+import stats
+
+
+gcg_txt = '''#player1 al Alice Smith
+#player2 bo Bob Jones
+>al: AEIQRTU 8H QUAI +26 26
+>bo: DEIOSTX 7I XI +36 36
+>al: BEGRTUW -BUW +0 26
+>bo: DEEOSTZ 9F ZEST +24 60
+>bo: DEEOSTZ -- -24 36
+>al: BEGRTUY K4 BUGGY +20 46
+>al: BEGRTUY (challenge) +5 51
+>bo: DEEOSTZ 6J DOZE +31 67
+>bo: EST 9K ETS +10 77
+>bo: (AER) +6 83
+'''
+
+# The same game as a score sheet, with Bob listed first and the end of
+# game adjustments as a rack penalty and bonus.
+sheet_txt = '''played 2013-01-02
+Bob Jones:: 36 36 67 77 80
+Alice Smith*:: 26 26 51 48
+'''
+
+
+class FingerprintTest(unittest.TestCase):
+    def test_same_game_in_two_formats(self):
+        gcg = game.Game(GCG_txt=gcg_txt)
+        sheet = game.Game(custom_txt=sheet_txt)
+        self.assertNotEqual(gcg._players, sheet._players)
+        self.assertEqual(stats.fingerprint(gcg), stats.fingerprint(sheet))
+
+    def test_json_round_trip(self):
+        gcg = game.Game(GCG_txt=gcg_txt)
+        copy = game.Game(single_game_JSON_txt=gcg.json)
+        self.assertEqual(stats.fingerprint(gcg), stats.fingerprint(copy))
+
+    def test_different_scores(self):
+        gcg = game.Game(GCG_txt=gcg_txt)
+        other = game.Game(GCG_txt=gcg_txt.replace('+31 67', '+32 68'))
+        self.assertNotEqual(stats.fingerprint(gcg), stats.fingerprint(other))
+
+
+if __name__ == '__main__':
+    unittest.main()
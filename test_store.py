@@ -0,0 +1,90 @@
+'''
+Crossword Game Stats tests of the local game store.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import game
+import store
+
+
+def make_game(n):
+    return game.Game(GCG_txt='#player1 a Alice\n#player2 b Bob\n'
+                     '>a: AEIQRTU 8H QUAI +26 26\n'
+                     '>b: DEIOSTX 7I XI +%d %d\n' % (n, n))
+
+
+class GameStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'games')
+        self.games = [make_game(n) for n in range(10)]
+        with store.GameStore(self.path) as s:
+            for g in self.games:
+                s.add(g)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_get(self):
+        with store.GameStore(self.path) as s:
+            self.assertEqual(len(s), 10)
+            self.assertEqual(s[3].json, self.games[3].json)
+            self.assertRaises(KeyError, s.get, 10)
+
+    def test_trash_restore_and_delete(self):
+        with store.GameStore(self.path) as s:
+            s.trash(2)
+            s.delete(5)
+        with store.GameStore(self.path) as s:
+            self.assertTrue(s.is_trashed(2))
+            self.assertFalse(5 in s)
+            self.assertEqual(len(s), 9)
+            self.assertEqual(s.ids(), [0, 1, 3, 4, 6, 7, 8, 9])
+            self.assertEqual([i for i, g in s.scan(trashed=True)],
+                             [0, 1, 2, 3, 4, 6, 7, 8, 9])
+            s.restore(2)
+            self.assertFalse(s.is_trashed(2))
+
+    def test_replace_and_compact(self):
+        with store.GameStore(self.path) as s:
+            s.replace(1, self.games[9])
+            s.trash(2)
+            s.delete(5)
+            self.assertTrue(s.compact() > 0)
+            self.assertEqual(s[1].json, self.games[9].json)
+            self.assertEqual(s[8].json, self.games[8].json)
+            self.assertTrue(s.is_trashed(2))
+            s.compact(trashed=True)
+            self.assertFalse(2 in s)
+            self.assertEqual(len(s), 8)
+        with store.GameStore(self.path) as s:
+            self.assertEqual(s.ids(), [0, 1, 3, 4, 6, 7, 8, 9])
+            self.assertEqual(s[9].json, self.games[9].json)
+            self.assertEqual(s.add(self.games[0]), 10)
+
+    def test_rebuild_index(self):
+        with store.GameStore(self.path) as s:
+            s.replace(4, self.games[0])
+            s.delete(6)
+        os.remove(self.path + '.idx')
+        with store.GameStore(self.path) as s:
+            # The latest record of each game is used; flags are lost.
+            self.assertEqual(len(s), 10)
+            self.assertEqual(s[4].json, self.games[0].json)
+            self.assertEqual(s[6].json, self.games[6].json)
+
+    def test_incomplete_record(self):
+        with open(self.path + '.dat', 'r+b') as f:
+            f.seek(-3, os.SEEK_END)
+            f.truncate()
+        with store.GameStore(self.path) as s:
+            self.assertEqual(len(s), 9)
+            self.assertEqual(s[8].json, self.games[8].json)
+
+
+if __name__ == '__main__':
+    unittest.main()